@@ -45,7 +45,7 @@ setup(name='SubSynco',
                     ('share/subsynco/', ['src/subsynco/data/gui/icons/hicolor/s'
                                          'calable/apps/subsynco.svg'])
       ],
-      scripts=['src/subsynco-gtk'],
+      scripts=['src/subsynco-gtk', 'src/subsynco-batch'],
       # NOTE windows-version requires chardet instead of magic
       #requires=['magic']
 )
@@ -139,7 +139,9 @@ if sys.platform == "win32":
     base = "Win32GUI"
 
 executables = [
-    Executable("subsynco-gtk", base=base, icon=r'subsynco\data\gui\icons\hicolor\ico\subsynco.ico')
+    Executable("subsynco-gtk", base=base, icon=r'subsynco\data\gui\icons\hicolor\ico\subsynco.ico'),
+    # The batch runner is a console application.
+    Executable("subsynco-batch", base=None, icon=r'subsynco\data\gui\icons\hicolor\ico\subsynco.ico')
 ]
 
 build_options = {
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+'''
+SubSynco - a tool for synchronizing subtitle files
+Copyright (C) 2015  da-mkay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+import audioop
+import math
+from subsynco.media.cut_detector import CutDetector
+from subsynco.utils.logger import Logger
+
+
+class MediaAnalyzer(object):
+    """MediaAnalyzer decodes a video file as fast as possible (without
+    playing it) and passes the brightness of the frames and the
+    loudness of the audio to a CutDetector, which proposes a cutlist.
+
+    To be fast, the video is decoded to small grey frames (FRAME_WIDTH
+    x FRAME_HEIGHT at FRAME_RATE frames per second) and the audio to
+    mono samples (AUDIO_RATE samples per second). The sinks do not
+    sync to the clock, so a video is usually analyzed much faster than
+    real time.
+
+    The marker and progress callbacks are invoked in GStreamer's
+    streaming threads (use GLibHelpers.idle_add to update the GUI),
+    the finished callback is invoked in the main loop.
+    """
+    FRAME_RATE = 5
+    FRAME_WIDTH = 64
+    FRAME_HEIGHT = 36
+    AUDIO_RATE = 8000
+
+    def __init__(self, file_uri, detector=None):
+        """Constructor
+
+        If no CutDetector is passed, a CutDetector with the default
+        settings is used.
+        """
+        self._file_uri = file_uri
+        self._detector = CutDetector() if detector is None else detector
+        self._progress_callback = None
+        self._finished_callback = None
+        self._position = 0
+        self._pipeline = None
+
+    def set_marker_callback(self, callback):
+        """Set the callback function that will be called for each
+        marker found by the CutDetector (see CutDetector).
+        """
+        self._detector.set_marker_callback(callback)
+
+    def set_progress_callback(self, callback):
+        """Set the callback function that will be called with the
+        position (in nanoseconds) of each analyzed video frame.
+        """
+        self._progress_callback = callback
+
+    def set_finished_callback(self, callback):
+        """Set the callback function that will be called with the
+        proposed cuts (a CutMap, see CutDetector.finish) and None when
+        the analysis is finished, or with None and the error if the
+        analysis failed.
+        """
+        self._finished_callback = callback
+
+    def start(self):
+        self._pipeline = Gst.Pipeline.new('MediaAnalyzer')
+        decodebin = Gst.ElementFactory.make('uridecodebin')
+        decodebin.set_property('uri', self._file_uri)
+        decodebin.connect('pad-added', self._on_pad_added)
+        self._pipeline.add(decodebin)
+        bus = self._pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message', self._on_message)
+        self._pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self):
+        if self._pipeline is not None:
+            self._pipeline.set_state(Gst.State.NULL)
+            self._pipeline.get_bus().remove_signal_watch()
+            self._pipeline = None
+
+    def _on_pad_added(self, decodebin, pad):
+        # The branches are created when the pads appear, so that a
+        # video without audio (or vice versa) does not leave a sink
+        # without data which would block the pipeline.
+        caps = pad.get_current_caps() or pad.query_caps(None)
+        name = caps.get_structure(0).get_name()
+        if name.startswith('video/'):
+            elements = [
+                ('queue', {}),
+                ('videorate', {}),
+                ('capsfilter', {'caps': Gst.caps_from_string(
+                             'video/x-raw, framerate=(fraction){}/1'.format(
+                                                  MediaAnalyzer.FRAME_RATE))}),
+                ('videoconvert', {}),
+                ('videoscale', {}),
+                ('capsfilter', {'caps': Gst.caps_from_string(
+                    'video/x-raw, format=(string)GRAY8, width=(int){}, '
+                    'height=(int){}'.format(MediaAnalyzer.FRAME_WIDTH,
+                                            MediaAnalyzer.FRAME_HEIGHT))}),
+                ('appsink', {}),
+            ]
+            callback = self._on_video_sample
+        elif name.startswith('audio/'):
+            elements = [
+                ('queue', {}),
+                ('audioconvert', {}),
+                ('audioresample', {}),
+                ('capsfilter', {'caps': Gst.caps_from_string(
+                    'audio/x-raw, format=(string)S16LE, channels=(int)1, '
+                    'rate=(int){}'.format(MediaAnalyzer.AUDIO_RATE))}),
+                ('appsink', {}),
+            ]
+            callback = self._on_audio_sample
+        else:
+            return
+        branch = []
+        for factory, properties in elements:
+            element = Gst.ElementFactory.make(factory)
+            for key, value in properties.iteritems():
+                element.set_property(key, value)
+            self._pipeline.add(element)
+            if branch:
+                branch[-1].link(element)
+            branch.append(element)
+        appsink = branch[-1]
+        appsink.set_property('emit-signals', True)
+        appsink.set_property('sync', False)
+        appsink.connect('new-sample', callback)
+        for element in branch:
+            element.sync_state_with_parent()
+        pad.link(branch[0].get_static_pad('sink'))
+
+    def _pull_buffer(self, appsink):
+        """Returns the buffer of the next sample and its data.
+        """
+        sample = appsink.emit('pull-sample')
+        buf = sample.get_buffer()
+        ok, map_info = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return buf, None
+        try:
+            return buf, str(map_info.data)
+        finally:
+            buf.unmap(map_info)
+
+    def _on_video_sample(self, appsink):
+        buf, data = self._pull_buffer(appsink)
+        if data:
+            millis = buf.pts / Gst.MSECOND
+            duration = (buf.duration / Gst.MSECOND
+                        if buf.duration != Gst.CLOCK_TIME_NONE
+                        else 1000 / MediaAnalyzer.FRAME_RATE)
+            brightness = sum(bytearray(data)) / len(data)
+            self._detector.add_frame(millis, duration, brightness)
+            self._position = buf.pts
+            if self._progress_callback is not None:
+                self._progress_callback(buf.pts)
+        return Gst.FlowReturn.OK
+
+    def _on_audio_sample(self, appsink):
+        buf, data = self._pull_buffer(appsink)
+        if data:
+            millis = buf.pts / Gst.MSECOND
+            # 2 bytes per sample
+            duration = len(data) * 1000 / (2 * MediaAnalyzer.AUDIO_RATE)
+            rms = audioop.rms(data, 2)
+            level = (20 * math.log10(rms / 32768.0) if rms > 0
+                     else float('-inf'))
+            self._detector.add_audio(millis, duration, level)
+        return Gst.FlowReturn.OK
+
+    def _on_message(self, bus, message):
+        if message.type == Gst.MessageType.EOS:
+            ok, duration = self._pipeline.query_duration(Gst.Format.TIME)
+            if not ok:
+                duration = self._position
+            self.stop()
+            cuts = self._detector.finish(duration / Gst.MSECOND)
+            if self._finished_callback is not None:
+                self._finished_callback(cuts, None)
+        elif message.type == Gst.MessageType.ERROR:
+            self.stop()
+            (err, debug) = message.parse_error()
+            Logger.error(_('[Analyzer] {}').format(err), debug)
+            if self._finished_callback is not None:
+                self._finished_callback(None, err)
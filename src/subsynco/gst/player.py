@@ -20,6 +20,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import Gdk
+from gi.repository import GLib
 from gi.repository import Gst
 from gi.repository import Gtk
 # Needed for window.get_xid(), xvimagesink.set_window_handle(),
@@ -31,11 +32,18 @@ import re
 import sys
 # Import TimeClbFilter so that the plugin gets registered:
 from subsynco.gst.filter import TimeClbFilter
-from subsynco.media.text_formatter import TextFormatter
+from subsynco.media.styled_text import StyledText
 from subsynco.utils.logger import Logger
 
 
 class MultimediaPlayer(object):
+    # The pango markup of the subtitles is prepared in the GUI-thread
+    # (see set_subtitle_list and _prepare_markup), so that the streaming
+    # thread only needs to look it up (see _show_subtitle). Subtitles
+    # without prepared markup (added or edited ones) are shown as plain
+    # text until their markup is prepared.
+    _re_tag = re.compile(r'<[^>]*>')
+
     def __init__(self, drawing_area):
         self._drawing_area = drawing_area;
         self._subtitle = None
@@ -43,6 +51,7 @@ class MultimediaPlayer(object):
         self._duration_changed_callback = None
         self._subtitle_list = None
         self._cur_subtitle = None
+        self._markup = {} # {subtitle: pango markup, ...}
         self._duration = None
         self._position = 0
         self._file_uri = None
@@ -89,28 +98,40 @@ class MultimediaPlayer(object):
         bus.enable_sync_message_emission()
         bus.connect('message', self._on_player_message)
         bus.connect('sync-message::element', self._on_player_sync_message)
-        
-        self._text_formatter = TextFormatter()
 
     def _on_timer_tick(self, nanos):
         self._position = nanos
         # If a SubtitleList is set we show/hide the subtitles here
         # based on the time.
         if (self._subtitle_list is not None):
-            millis = nanos / 1000000
-            __, subtitle = self._subtitle_list.get_subtitle(millis)
-            if (subtitle is not self._cur_subtitle):
-                if (subtitle is None):
-                    txt = ''
-                else:
-                    txt = self._text_formatter.fix_format(subtitle.text,
-                                                          pango_markup=True)
-                self._textoverlay.set_property('text', txt)
-                self._cur_subtitle = subtitle
+            self._show_subtitle(nanos / 1000000)
         # Invoke users position_changed callback if any.
         if (self._position_changed_callback is not None):
             self._position_changed_callback(nanos)
 
+    def _show_subtitle(self, millis):
+        __, subtitle = self._subtitle_list.get_subtitle(millis)
+        if (subtitle is not self._cur_subtitle):
+            if (subtitle is None):
+                txt = ''
+            else:
+                txt = self._markup.get(subtitle)
+                if txt is None:
+                    txt = GLib.markup_escape_text(
+                                          self._re_tag.sub('', subtitle.text))
+                    GLib.idle_add(self._prepare_markup, subtitle)
+            self._textoverlay.set_property('text', txt)
+            self._cur_subtitle = subtitle
+
+    def _prepare_markup(self, subtitle):
+        # Called in the GUI-thread (using GLib.idle_add) for a subtitle
+        # that was shown without markup. It is shown again with markup
+        # on the next timer tick.
+        self._markup[subtitle] = subtitle.styled_text.render(StyledText.PANGO)
+        if subtitle is self._cur_subtitle:
+            self._cur_subtitle = None
+        return False
+
     def _on_video_realize(self, widget):
         # The window handle must be retrieved in GUI-thread and before
         # playing pipeline.
@@ -217,8 +238,25 @@ class MultimediaPlayer(object):
         """
         self._textoverlay.set_property('text', '')
         self._cur_subtitle = None
+        if subtitle_list is None:
+            self._markup = {}
+        else:
+            self._markup = dict((subtitle,
+                                 subtitle.styled_text.render(StyledText.PANGO))
+                                for subtitle in subtitle_list)
         self._subtitle_list = subtitle_list
 
+    def invalidate_subtitle(self, subtitle):
+        """Must be called when the subtitle of the SubtitleList was
+        edited or replaced (see SubtitleListTreeModel).
+
+        The markup of the subtitle is dropped. If it is the current
+        subtitle, it is shown again on the next timer tick.
+        """
+        self._markup.pop(subtitle, None)
+        if subtitle is self._cur_subtitle:
+            self._cur_subtitle = None
+
     def pause(self):
         if self._file_uri is not None:
             self._player.set_state(Gst.State.PAUSED)
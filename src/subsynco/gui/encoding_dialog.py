@@ -21,6 +21,7 @@ from gi.repository import Gtk
 from operator import itemgetter
 from os import path
 
+from subsynco.utils.ingest import IngestedFile
 from subsynco.utils.textfile import TextFile
 from subsynco.utils.resources import Resources
 
@@ -71,12 +72,14 @@ class EncodingDialog(object):
     @staticmethod
     def detect_textfile_encoding(parent, file_):
         """Try to automatically detect the character encoding of the
-        specified file. If that fails show a dialog to force the user
-        to select the correct character encoding.
+        specified file (a path or an IngestedFile). If that fails show
+        a dialog to force the user to select the correct character
+        encoding.
         """
-        encoding = TextFile.detect_encoding(file_)
+        file_ = IngestedFile.get(file_)
+        encoding = file_.detect_encoding()
         if encoding is None:
-            enc_dlg = EncodingDialog(parent, open(file_).read())
+            enc_dlg = EncodingDialog(parent, file_.data)
             res = enc_dlg.run()
             enc_dlg.destroy_dialog()
             if res == Gtk.ResponseType.OK and enc_dlg.encoding is not None:
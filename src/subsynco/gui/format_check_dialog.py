@@ -29,7 +29,13 @@ from subsynco.utils.time import Time
 
 class FormatCheckDialog(object):
 
-    def __init__(self, parent, subtitle_list):
+    def __init__(self, parent, subtitle_list, on_edit_callback=None):
+        """Constructor
+
+        on_edit_callback is passed to the SubtitleListTreeModel of the
+        fixed subtitles (see SubtitleListTreeModel), so that edits in
+        the dialog can be shown elsewhere.
+        """
         self._subtitle_list = subtitle_list
         
         self._builder = Gtk.Builder()
@@ -52,7 +58,8 @@ class FormatCheckDialog(object):
                                                       self._on_subtitle_changed,
                                                       True)
         self._subtitle_list_model_new = SubtitleListTreeModel(subtitle_list,
-                                                      self._on_subtitle_changed)
+                                      self._on_subtitle_changed,
+                                      on_edit_callback=on_edit_callback)
         self._tree_subtitles_old.set_model(self._subtitle_list_model_old)
         self._tree_subtitles_new.set_model(self._subtitle_list_model_new)
 
@@ -144,6 +151,14 @@ class FormatCheckDialog(object):
     def run(self):
         return self._dialog.run()
 
+    def show(self):
+        """Shows the dialog without blocking (unlike run). The dialog is
+        destroyed when it is closed.
+        """
+        self._dialog.connect('response',
+                             lambda dialog, response: self.destroy_dialog())
+        self._dialog.show()
+
     def destroy_dialog(self):
         return self._dialog.destroy()
 
@@ -44,6 +44,7 @@ from subsynco.gui.format_check_dialog import FormatCheckDialog
 from subsynco.gui.glib_helpers import GLibHelpers
 from subsynco.gui.script_run_dialog import ScriptRunDialog
 from subsynco.gui.subtitle_dialog import SubtitleDialog
+from subsynco.gst.analyzer import MediaAnalyzer
 from subsynco.gst.player import MultimediaPlayer
 from subsynco.gui.spin_entry import TimeEntry
 from subsynco.gui.subtitle_list_tree_model import SubtitleListTreeModel
@@ -52,9 +53,11 @@ from subsynco.media.subtitle import Subtitle, SubtitleList
 from subsynco.media.subtitle import SubtitleFile
 from subsynco.media.submod import Submod
 from subsynco.media.text_formatter import TextFormatter
+from subsynco.utils.ingest import IngestedFile
 from subsynco.utils.logger import Logger
 from subsynco.utils.resources import Resources
 from subsynco.utils.settings import Settings
+from subsynco.utils.thread_helpers import ThreadHelpers
 from subsynco.utils.time import Time
 
 
@@ -132,11 +135,18 @@ class MainWindow(object):
                                                                self._autoscroll)
         self._submod = None
         self._cuts = None
+        self._video_file_uri = None
+        self._analyzer = None
+        # Minutes of the video that were analyzed, see
+        # _on_analyzer_progress
+        self._analyzer_minutes = 0
         self._subtitle_file = None
         self._subtitle_filename = None
         self._subtitle_encoding = None
         self._subtitle_unsaved = False
-        self._text_formatter = TextFormatter()
+        # Identifies the latest format check, see
+        # _check_and_fix_subtitle_format
+        self._format_check_id = 0
 
     def show(self):
         self._window.show_all()
@@ -195,6 +205,8 @@ class MainWindow(object):
             elif res == Gtk.ResponseType.CANCEL:
                 quit = False
         if quit:
+            if self._analyzer is not None:
+                self._analyzer.stop()
             self._player.stop()
             Gtk.main_quit()
             return True
@@ -305,7 +317,7 @@ class MainWindow(object):
         if res == Gtk.ResponseType.OK and path.isfile(file_):
             dir_, filename = path.split(file_)
             Settings().set(self, 'cuts_folder', dir_)
-            self._open_cutlist(file_, filechooser.encoding)
+            self._open_cutlist(file_, filechooser.encoding, True)
 
     def _on_btn_save_clicked(self, btn):
         self._save_current_subtitle()
@@ -350,19 +362,36 @@ class MainWindow(object):
                 title += '*'
             dir_, filename = path.split(self._subtitle_file)
             title += filename + ' - '
-        self._window.set_title(title + 'SubSynco')
+        title += 'SubSynco'
+        if self._analyzer is not None:
+            title += ' ' + _('(analyzing video: {} min)').format(
+                                                        self._analyzer_minutes)
+        self._window.set_title(title)
 
     def open_subtitle(self, subtitle_file, encoding=None):
+        # The file is read only once for encoding detection, parsing and
+        # hashing (see Submod).
+        ingested_file = IngestedFile(subtitle_file)
+        try:
+            ingested_file.read()
+        except IOError as e:
+            dialog = Gtk.MessageDialog(self._window, 0, Gtk.MessageType.ERROR,
+                         Gtk.ButtonsType.OK,
+                         _('Failed to load subtitle file:\n{}!').format(e))
+            dialog.run()
+            dialog.destroy()
+            return
         if encoding is None:
             encoding = EncodingDialog.detect_textfile_encoding(self._window,
-                                                               subtitle_file)
+                                                               ingested_file)
         if encoding is None:
             return
         
         Logger.info(_('Using encoding {} for subtitle').format(encoding))
 
         try:
-            subtitle_list = SubtitleFile.load_srt(subtitle_file, encoding)
+            subtitle_list = SubtitleFile.load_srt(subtitle_file, encoding,
+                                                  ingested_file.data)
         except Exception as e:
             dialog = Gtk.MessageDialog(self._window, 0, Gtk.MessageType.ERROR,
                          Gtk.ButtonsType.OK,
@@ -371,7 +400,7 @@ class MainWindow(object):
             dialog.destroy()
             return
         
-        self._submod = Submod(subtitle_file, copy.deepcopy(subtitle_list),
+        self._submod = Submod(ingested_file, copy.deepcopy(subtitle_list),
                               encoding)
         self._cuts = None
         
@@ -385,7 +414,8 @@ class MainWindow(object):
         self._check_and_fix_subtitle_format(subtitle_list)
         
         self._subtitle_list_model = SubtitleListTreeModel(subtitle_list,
-                                                      self._on_subtitle_changed)
+                              self._on_subtitle_changed,
+                              on_edit_callback=self._player.invalidate_subtitle)
         self._tree_subtitles.set_model(self._subtitle_list_model)
         self._player.set_subtitle_list(subtitle_list)
         
@@ -410,10 +440,25 @@ class MainWindow(object):
                 self._open_cutlist(file_)
         
     def _open_video(self, video_file_uri):
+        if self._analyzer is not None:
+            # The markers and the proposed cutlist would refer to the
+            # previous video.
+            self._analyzer.stop()
+            self._analyzer = None
+            self._scale_position.clear_marks()
+            self._update_window_title()
+        self._video_file_uri = video_file_uri
         self._player.set_file(video_file_uri)
         self._player.pause()
 
-    def _open_cutlist(self, cutlist_file, encoding=None):
+    def _open_cutlist(self, cutlist_file, encoding=None,
+                      ask_projection=False):
+        """Opens the cutlist and marks the cuts. If ask_projection is
+        True (the user chose the cutlist) and a subtitle is open, the
+        user is asked whether the subtitles should be projected to the
+        cut video (see _project_subtitles_to_cuts). Cutlists that are
+        opened together with the subtitle never change it.
+        """
         self._scale_position.clear_marks()
         if encoding is None:
             encoding = EncodingDialog.detect_textfile_encoding(self._window,
@@ -437,6 +482,32 @@ class MainWindow(object):
             cut_nanos = cut*1000000
             self._scale_position.add_mark(cut_nanos, Gtk.PositionType.TOP,
                         '<span foreground="white" background="blue"> X </span>')
+        if ask_projection and self._subtitle_list_model is not None:
+            self._project_subtitles_to_cuts()
+
+    def _project_subtitles_to_cuts(self):
+        """Asks whether the subtitles have timings for the uncut video
+        and if so projects them to the cut video (see
+        SubtitleList.project_to_cuts).
+        """
+        dialog = Gtk.MessageDialog(self._window, 0, Gtk.MessageType.QUESTION,
+                     Gtk.ButtonsType.YES_NO,
+                     _('Does the subtitle have timings for the uncut video? '
+                       'If so, the subtitles are adapted to the cut video: '
+                       'subtitles that overlap a removed part of the video '
+                       'are shortened, split at the cut or removed.'))
+        res = dialog.run()
+        dialog.destroy()
+        if res != Gtk.ResponseType.YES:
+            return
+        subtitle_list = self._subtitle_list_model.data.project_to_cuts(
+                                                                    self._cuts)
+        self._subtitle_list_model = SubtitleListTreeModel(subtitle_list,
+                              self._on_subtitle_changed,
+                              on_edit_callback=self._player.invalidate_subtitle)
+        self._tree_subtitles.set_model(self._subtitle_list_model)
+        self._player.set_subtitle_list(subtitle_list)
+        self._set_unsaved(True)
 
     def _check_and_fix_subtitle_format(self, subtitle_list):
         """Check if the format-syntax in each subtitle is correct.
@@ -445,22 +516,59 @@ class MainWindow(object):
         '<i>...</i>'. If any invalid syntax is detected the subtitle is
         automatically corrected. Then a dialog is shown so that the user
         can verify the auto-corrected subtitles.
+
+        The check runs in the background (see
+        TextFormatter.fix_formats), so the subtitles can be shown and
+        edited meanwhile.
         """
+        self._format_check_id += 1
+        texts = [subtitle.text for subtitle in subtitle_list]
+        self._fix_subtitle_formats(self._format_check_id, texts)
+
+    @ThreadHelpers.run_in_thread
+    def _fix_subtitle_formats(self, format_check_id, texts):
+        fixes = TextFormatter.fix_formats(texts)
+        if fixes:
+            fixed_texts = dict((texts[i], new_text) for i, new_text in fixes)
+            self._apply_subtitle_format_fixes(format_check_id, fixed_texts)
+
+    @GLibHelpers.idle_add
+    def _apply_subtitle_format_fixes(self, format_check_id, fixed_texts):
+        if (format_check_id != self._format_check_id or
+                self._subtitle_list_model is None):
+            # Another subtitle file was opened meanwhile.
+            return
+        # The subtitles may have been changed since the check was
+        # started (for example by projecting them to a cutlist), so the
+        # fixed texts are applied to the current subtitles by their
+        # text.
         # holds the subs that were fixed and need to be checked
         fixed_subtitle_list = SubtitleList()
-        for subtitle in subtitle_list:
-            new_text = self._text_formatter.fix_format(subtitle.text)
-            if new_text != subtitle.text:
+        for i, subtitle in enumerate(self._subtitle_list_model.data):
+            new_text = fixed_texts.get(subtitle.text)
+            if new_text is not None:
                 subtitle.text = new_text
+                self._subtitle_list_model.signal_row_changed(i)
+                self._player.invalidate_subtitle(subtitle)
                 # add the SAME subtitle object to the list of fixed subs
                 fixed_subtitle_list.add_subtitle(subtitle)
-        
         if len(fixed_subtitle_list) > 0:
-            # Show dialog so that user can check fixed subtitles
-            fmt_dlg = FormatCheckDialog(self._window, fixed_subtitle_list)
-            res = fmt_dlg.run()
-            fmt_dlg.destroy_dialog()
             self._set_unsaved(True)
+            # Show dialog so that user can check fixed subtitles
+            fmt_dlg = FormatCheckDialog(self._window, fixed_subtitle_list,
+                                        self._on_format_check_subtitle_edited)
+            fmt_dlg.show()
+
+    def _on_format_check_subtitle_edited(self, subtitle):
+        # The FormatCheckDialog edits the SAME subtitle objects that are
+        # shown in the main window
+        # (unless another subtitle file was opened meanwhile).
+        for i, item in enumerate(self._subtitle_list_model.data):
+            if item is subtitle:
+                self._subtitle_list_model.signal_row_changed(i)
+                self._player.invalidate_subtitle(subtitle)
+                self._set_unsaved(True)
+                break
 
     def _remove_extension(self, filename):
         """Returns the filename without extension.
@@ -507,8 +615,10 @@ class MainWindow(object):
         if folder is not None:
             filechooser.set_current_folder(folder)
         filter_scripts = Gtk.FileFilter()
-        filter_scripts.set_name(_('Submod-script files')+' (*.submod)')
+        filter_scripts.set_name(_('Submod-script files')+
+                                ' (*.submod, *.submodb)')
         filter_scripts.add_pattern('*.submod')
+        filter_scripts.add_pattern('*.submodb')
         filechooser.add_filter(filter_scripts)
         res = filechooser.run()
         file_ = filechooser.get_filename()
@@ -535,13 +645,28 @@ class MainWindow(object):
         filter_scripts.set_name(_('Submod-script files')+' (*.submod)')
         filter_scripts.add_pattern('*.submod')
         filechooser.add_filter(filter_scripts)
+        filter_binary_scripts = Gtk.FileFilter()
+        filter_binary_scripts.set_name(_('Binary Submod-script files')+
+                                       ' (*.submodb)')
+        filter_binary_scripts.add_pattern('*.submodb')
+        filechooser.add_filter(filter_binary_scripts)
+        # Matching the subtitles by content (see SubtitleAligner) keeps
+        # the script small if subtitles were removed and added again.
+        align_button = Gtk.CheckButton(_('Match subtitles by content instead'
+                                         ' of ids'))
+        align_button.set_active(Settings().get(self, 'script_align', False))
+        filechooser.set_extra_widget(align_button)
         res = filechooser.run()
         file_ = filechooser.get_filename()
+        binary = (filechooser.get_filter() == filter_binary_scripts or
+                  file_ is not None and file_.lower().endswith('.submodb'))
+        align = align_button.get_active()
         filechooser.destroy()
         if res != Gtk.ResponseType.OK:
             return
-        if not file_.lower().endswith('.submod'):
-            file_ = file_ + '.submod'
+        ext = '.submodb' if binary else '.submod'
+        if not file_.lower().endswith(ext):
+            file_ = file_ + ext
         cuts = None
         if self._cuts is not None:
             dialog = Gtk.MessageDialog(self._window, 0,
@@ -562,10 +687,11 @@ class MainWindow(object):
 
         dir_, filename = path.split(file_)
         Settings().set(self, 'script_folder', dir_)
+        Settings().set(self, 'script_align', align)
         # export Submod-script
         subtitle_list = self._subtitle_list_model.data
-        self._submod.generate_script(subtitle_list, cuts)
-        self._submod.save_script(file_)
+        self._submod.generate_script(subtitle_list, cuts, align)
+        self._submod.save_script(file_, binary)
         dialog = Gtk.MessageDialog(self._window, 0, Gtk.MessageType.INFO,
             Gtk.ButtonsType.OK, _('Submod-script exported successfully!'))
         dialog.run()
@@ -599,6 +725,111 @@ class MainWindow(object):
             dialog.run()
             dialog.destroy()
 
+    def _on_mnu_fix_timings_activate(self, widget):
+        if self._subtitle_list_model is None:
+            dialog = Gtk.MessageDialog(self._window, 0, Gtk.MessageType.ERROR,
+                         Gtk.ButtonsType.OK,
+                         _('Please open a subtitle file first!'))
+            dialog.run()
+            dialog.destroy()
+            return
+        max_cps = Settings().get(self, 'fix_timings_max_cps', 17)
+        min_gap = Settings().get(self, 'fix_timings_min_gap', 80)
+        num_changed = self._subtitle_list_model.fix_timings(max_cps, min_gap)
+        dialog = Gtk.MessageDialog(self._window, 0, Gtk.MessageType.INFO,
+                     Gtk.ButtonsType.OK,
+                     _('The timings of {} subtitles were fixed!').format(
+                                                                   num_changed))
+        dialog.run()
+        dialog.destroy()
+
+    def _on_mnu_propose_cutlist_activate(self, widget):
+        if self._video_file_uri is None:
+            dialog = Gtk.MessageDialog(self._window, 0, Gtk.MessageType.ERROR,
+                         Gtk.ButtonsType.OK,
+                         _('Please open a video file first!'))
+            dialog.run()
+            dialog.destroy()
+            return
+        if self._analyzer is not None:
+            dialog = Gtk.MessageDialog(self._window, 0, Gtk.MessageType.ERROR,
+                         Gtk.ButtonsType.OK,
+                         _('The video is already being analyzed!'))
+            dialog.run()
+            dialog.destroy()
+            return
+        # The markers are shown while the video is analyzed, so that
+        # the user can already seek to them.
+        self._scale_position.clear_marks()
+        # The callbacks get the analyzer, so that callbacks of an
+        # analyzer that was stopped meanwhile (see _open_video) can be
+        # ignored.
+        analyzer = MediaAnalyzer(self._video_file_uri)
+        analyzer.set_marker_callback(
+                lambda millis: self._on_analyzer_marker(analyzer, millis))
+        analyzer.set_progress_callback(
+                lambda nanos: self._on_analyzer_progress(analyzer, nanos))
+        analyzer.set_finished_callback(
+                lambda cuts, error: self._on_analyzer_finished(analyzer, cuts,
+                                                               error))
+        self._analyzer = analyzer
+        self._analyzer_minutes = 0
+        self._update_window_title()
+        analyzer.start()
+
+    @GLibHelpers.idle_add
+    def _on_analyzer_marker(self, analyzer, millis):
+        if analyzer is not self._analyzer:
+            return
+        self._scale_position.add_mark(millis*1000000, Gtk.PositionType.TOP,
+                         '<span foreground="white" background="red"> | </span>')
+
+    def _on_analyzer_progress(self, analyzer, nanos):
+        # Called in the streaming thread for each analyzed frame. The
+        # GUI is only updated for each analyzed minute of the video.
+        minutes = nanos / (60 * Gst.SECOND)
+        if analyzer is self._analyzer and minutes != self._analyzer_minutes:
+            self._analyzer_minutes = minutes
+            self._show_analyzer_progress(analyzer)
+
+    @GLibHelpers.idle_add
+    def _show_analyzer_progress(self, analyzer):
+        if analyzer is self._analyzer:
+            self._update_window_title()
+
+    @GLibHelpers.idle_add
+    def _on_analyzer_finished(self, analyzer, cuts, error):
+        if analyzer is not self._analyzer:
+            return
+        self._analyzer = None
+        self._update_window_title()
+        if cuts is None:
+            dialog = Gtk.MessageDialog(self._window, 0, Gtk.MessageType.ERROR,
+                         Gtk.ButtonsType.OK,
+                         _('Failed to analyze video file:\n{}!').format(error))
+            dialog.run()
+            dialog.destroy()
+            return
+        filechooser = Gtk.FileChooserDialog(
+            _('Where should the proposed cutlist be saved?'), self._window,
+            Gtk.FileChooserAction.SAVE,
+            (Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL,
+             Gtk.STOCK_SAVE, Gtk.ResponseType.OK))
+        filechooser.set_do_overwrite_confirmation(True)
+        filter_cutlists = Gtk.FileFilter()
+        filter_cutlists.set_name(_('Cutlist files')+' (*.cutlist)')
+        filter_cutlists.add_pattern('*.cutlist')
+        filechooser.add_filter(filter_cutlists)
+        res = filechooser.run()
+        file_ = filechooser.get_filename()
+        filechooser.destroy()
+        if res != Gtk.ResponseType.OK:
+            return
+        if not file_.lower().endswith('.cutlist'):
+            file_ = file_ + '.cutlist'
+        CutsFile.save_cutlist(file_, cuts)
+        self._open_cutlist(file_, 'utf-8', True)
+
     def _on_btn_add_subtitle_clicked(self, widget):
         if self._subtitle_list_model is None:
             return
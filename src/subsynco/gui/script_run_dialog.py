@@ -24,11 +24,13 @@ from os import path
 from subsynco.gui.encoding_dialog import EncodingDialog
 from subsynco.gui.ext_file_chooser_dialog import ExtFileChooserDialog
 from subsynco.gui.glib_helpers import GLibHelpers
+from subsynco.utils.ingest import IngestedFile
 from subsynco.utils.resources import Resources
 from subsynco.utils.settings import Settings
 from subsynco.utils.thread_helpers import ThreadHelpers
 from subsynco.media.cuts import CutsFile
 from subsynco.media.submod import Submod
+from subsynco.media.submod_binary import SubmodBinary
 from subsynco.media.subtitle import SubtitleFile
 
 
@@ -83,12 +85,15 @@ class ScriptRunDialog(object):
         return self._dialog.destroy()
 
     def _on_dialog_show(self, widget):
-        encoding = EncodingDialog.detect_textfile_encoding(self._dialog,
-                                                           self._script_file)
-        if encoding is None:
-            self._error(self.STEP_LOADING_SUBMOD,
-                        _('Could not determine encoding of Submod-script!'))
-            return
+        encoding = None
+        # Binary Submod-scripts have no encoding.
+        if not SubmodBinary.is_binary_file(self._script_file):
+            encoding = EncodingDialog.detect_textfile_encoding(
+                                                self._dialog, self._script_file)
+            if encoding is None:
+                self._error(self.STEP_LOADING_SUBMOD,
+                            _('Could not determine encoding of Submod-script!'))
+                return
         self._submod = Submod()
         self._load_script(encoding)
     
@@ -108,7 +113,7 @@ class ScriptRunDialog(object):
     @GLibHelpers.idle_add
     def _open_cutlist(self):
         self._show_step_icons(self.STEP_LOADING_CUTLIST)
-        if self._submod.script['timings-for'] == 'uncut':
+        if self._submod.plan.timings_for == 'uncut':
             dialog = Gtk.MessageDialog(self._dialog, 0, 
                         Gtk.MessageType.QUESTION,
                         Gtk.ButtonsType.YES_NO,
@@ -175,16 +180,22 @@ class ScriptRunDialog(object):
         self._show_step_icons(self.STEP_LOADING_SUBTITLE)
         # Generate path for subtitle based on script-directory and
         # subtitle filename from the script.
-        subtitle_filename = self._submod.script['subtitle']['filename']
+        subtitle_filename = self._submod.plan.subtitle['filename']
         dir_, script_filename = path.split(self._script_file)
         subtitle_file = path.join(dir_, subtitle_filename)
         if not path.isfile(subtitle_file):
             self._error(self.STEP_LOADING_SUBTITLE,
                  _('Could not find subtitle file "{}"!').format(subtitle_file))
             return
-        encoding = None
-        if 'encoding' in self._submod.script['subtitle']:
-            encoding = self._submod.script['subtitle']['encoding']
+        # The subtitle file is read only once for checksum, encoding
+        # detection and parsing.
+        subtitle_file = IngestedFile(subtitle_file)
+        try:
+            subtitle_file.read()
+        except IOError as e:
+            self._error(self.STEP_LOADING_SUBTITLE, unicode(e))
+            return
+        encoding = self._submod.plan.subtitle.get('encoding')
         if encoding is None:
             encoding = EncodingDialog.detect_textfile_encoding(self._dialog,
                                                                subtitle_file)
@@ -195,7 +206,8 @@ class ScriptRunDialog(object):
         self._load_subtitle_run_script(subtitle_file, encoding)
         
     def _load_subtitle(self, subtitle_file, encoding):
-        subtitle_list = SubtitleFile.load_srt(subtitle_file, encoding)
+        subtitle_list = SubtitleFile.load_srt(subtitle_file.path, encoding,
+                                              subtitle_file.data)
         self._show_step_icons(self.STEP_RUNNING_SUBMOD)
         return subtitle_list
     
@@ -224,7 +236,7 @@ class ScriptRunDialog(object):
         # extension. If the file already exists a new filename is
         # generated (by adding '.1', '.2' .. before the extension)
         # until a non existing filename is found.
-        subtitle_filename = self._submod.script['subtitle']['filename']
+        subtitle_filename = self._submod.plan.subtitle['filename']
         name_parts = subtitle_filename.rsplit('.', 1)
         name_base = name_parts[0] + '_submod'
         ext = '.'+name_parts[1] if len(name_parts)==2 else ''
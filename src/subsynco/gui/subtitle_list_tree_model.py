@@ -25,9 +25,15 @@ class SubtitleListTreeModel(ListTreeModel):
     Any changes to the subtitles of the SubtitleList should be made
     using SubtitleListTreeModel, so that the GUI gets updated and shows
     always the correct data.
+
+    on_change_callback is called after each change. on_edit_callback
+    (if any) is additionally called with the old subtitle when a
+    subtitle was edited (see edit_subtitle).
     """
-    def __init__(self, subtitle_list, on_change_callback, use_orig_text=False):
+    def __init__(self, subtitle_list, on_change_callback, use_orig_text=False,
+                 on_edit_callback=None):
         self._on_change_callback = on_change_callback
+        self._on_edit_callback = on_edit_callback
         column_config = [(long, 'start'), (long, 'end'),
                          (str, 'orig_text') if use_orig_text else (str, 'text')]
         super(SubtitleListTreeModel, self).__init__(subtitle_list,
@@ -55,6 +61,8 @@ class SubtitleListTreeModel(ListTreeModel):
             if old_subtitle.text != new_subtitle.text:
                 old_subtitle.text = new_subtitle.text
                 self.signal_row_changed(i)
+                if self._on_edit_callback is not None:
+                    self._on_edit_callback(old_subtitle)
                 self._on_change_callback()
         else:
             # NOTE: Since new_subtitle should be a copy of the original
@@ -68,6 +76,8 @@ class SubtitleListTreeModel(ListTreeModel):
                 self.signal_row_changed(i)
             else:
                 self.signal_row_moved(i, new_i)
+            if self._on_edit_callback is not None:
+                self._on_edit_callback(old_subtitle)
             self._on_change_callback()
 
     def move_subtitle_by(self, iter_, millis, move_subsequent):
@@ -128,5 +138,20 @@ class SubtitleListTreeModel(ListTreeModel):
         for i in range(0, num_changed):
             self.signal_row_changed(i)
         self._on_change_callback()
+
+    def fix_timings(self, max_cps, min_gap):
+        """Fix the end-times of all subtitles (see
+        SubtitleList.fix_timings) as one batched change.
+
+        The original values of the subtitles are kept, so the fixes
+        will result in update-entries when exporting a Submod-script.
+        Returns the number of changed (or reordered stacked) subtitles.
+        """
+        changed = self.data.fix_timings(max_cps, min_gap)
+        for i in changed:
+            self.signal_row_changed(i)
+        if changed:
+            self._on_change_callback()
+        return len(changed)
     
 
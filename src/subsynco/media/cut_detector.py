@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+'''
+SubSynco - a tool for synchronizing subtitle files
+Copyright (C) 2015  da-mkay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import bisect
+import threading
+from subsynco.media.cuts import CutMap
+
+
+class CutDetector(object):
+    """CutDetector proposes a cutlist for a recording (for example a TV
+    broadcast) by searching for advertisement breaks.
+
+    The brightness of the video frames and the loudness of the audio
+    are passed to the detector while the video is decoded (see
+    gst.analyzer.MediaAnalyzer). Runs of black frames that coincide
+    with silence are typical for the boundaries between programme and
+    advertisements (and between two advertisements). The middle of each
+    such run is a marker. When all frames were passed, the parts
+    between successive markers that are at most max_ad_length
+    milliseconds long are joined to breaks, and each break of at least
+    min_break_length milliseconds is cut.
+
+    Frames and audio may be passed from different threads.
+    """
+    def __init__(self, black_threshold=32, silence_threshold=-50.0,
+                 min_break_length=60000, max_ad_length=120000,
+                 marker_callback=None):
+        """Constructor
+
+        black_threshold is the maximum average brightness (0-255) of a
+        black frame and silence_threshold the maximum loudness (RMS in
+        dB, 0 is the maximum) of silent audio. marker_callback is
+        invoked with the position (in milliseconds) of each marker as
+        soon as it was found, so that the markers can be shown while
+        the video is still being analyzed. Note that the markers are not
+        necessarily found in order.
+        """
+        self._black_threshold = black_threshold
+        self._silence_threshold = silence_threshold
+        self._min_break_length = min_break_length
+        self._max_ad_length = max_ad_length
+        self._marker_callback = marker_callback
+        self._lock = threading.Lock()
+        # Finished runs of black frames/silence as sorted lists of
+        # (start, end)-tuples and the start of the current runs.
+        self._black_runs = []
+        self._silence_runs = []
+        self._black_start = None
+        self._silence_start = None
+        self._black_end = None
+        self._silence_end = None
+        self._markers = []
+
+    def set_marker_callback(self, callback):
+        """Set the callback function that will be called with the
+        position of each marker (see constructor).
+        """
+        self._marker_callback = callback
+
+    def add_frame(self, millis, duration, brightness):
+        """Passes the average brightness (0-255) of the video frame at
+        millis which is shown for duration milliseconds.
+        """
+        with self._lock:
+            if brightness <= self._black_threshold:
+                if self._black_start is None:
+                    self._black_start = millis
+                self._black_end = millis + duration
+            elif self._black_start is not None:
+                run = (self._black_start, self._black_end)
+                self._black_start = None
+                self._add_run(run, self._black_runs, self._silence_runs)
+
+    def add_audio(self, millis, duration, level):
+        """Passes the loudness (RMS in dB) of the audio from millis to
+        millis+duration.
+        """
+        with self._lock:
+            if level <= self._silence_threshold:
+                if self._silence_start is None:
+                    self._silence_start = millis
+                self._silence_end = millis + duration
+            elif self._silence_start is not None:
+                run = (self._silence_start, self._silence_end)
+                self._silence_start = None
+                self._add_run(run, self._silence_runs, self._black_runs)
+
+    def _add_run(self, run, runs, other_runs):
+        """Adds the finished run to runs and adds a marker for each run
+        of other_runs that overlaps run. Since each pair of runs is
+        matched when the later one is finished, each marker is found
+        exactly once.
+        """
+        bisect.insort(runs, run)
+        start, end = run
+        # Runs of the same kind do not overlap, so only the run before
+        # the first run starting at or after end may overlap as well.
+        i = bisect.bisect_left(other_runs, (end,))
+        while i > 0 and other_runs[i-1][1] > start:
+            i -= 1
+            lower = max(start, other_runs[i][0])
+            upper = min(end, other_runs[i][1])
+            marker = (lower + upper) / 2
+            bisect.insort(self._markers, marker)
+            if self._marker_callback is not None:
+                self._marker_callback(marker)
+
+    def get_markers(self):
+        """Returns the sorted list of markers found so far.
+        """
+        with self._lock:
+            return list(self._markers)
+
+    def finish(self, duration):
+        """Finishes the current runs (at the end of the video) and
+        returns the proposed cuts as CutMap for a video of duration
+        milliseconds.
+        """
+        with self._lock:
+            if self._black_start is not None:
+                run = (self._black_start, self._black_end)
+                self._black_start = None
+                self._add_run(run, self._black_runs, self._silence_runs)
+            if self._silence_start is not None:
+                run = (self._silence_start, self._silence_end)
+                self._silence_start = None
+                self._add_run(run, self._silence_runs, self._black_runs)
+            boundaries = ([0] + [marker for marker in self._markers
+                                 if 0 < marker < duration] + [duration])
+        kept_ranges = []
+        kept_start = 0
+        break_start = None
+        for start, end in zip(boundaries, boundaries[1:]):
+            if end - start <= self._max_ad_length:
+                if break_start is None:
+                    break_start = start
+                continue
+            if (break_start is not None and
+                    start - break_start >= self._min_break_length):
+                kept_ranges.append((kept_start, break_start))
+                kept_start = start
+            break_start = None
+        if (break_start is not None and
+                duration - break_start >= self._min_break_length):
+            kept_ranges.append((kept_start, break_start))
+        else:
+            kept_ranges.append((kept_start, duration))
+        return CutMap.from_kept_ranges(kept_ranges)
@@ -17,6 +17,7 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
+import bisect
 import codecs
 from subsynco.utils.textfile import TextFile
 
@@ -24,7 +25,11 @@ from subsynco.utils.textfile import TextFile
 class CutsFile(object):
     @staticmethod
     def load_cutlist(path, encoding):
-        return Cutlist(path).load(encoding)
+        return CutMap(Cutlist(path).load(encoding))
+
+    @staticmethod
+    def save_cutlist(path, cuts):
+        Cutlist(path).save(cuts)
 
 
 class Cutlist(object):
@@ -61,3 +66,330 @@ class Cutlist(object):
             cuts.append((start, duration, cut_position))
         return cuts
 
+    def save(self, cuts):
+        """Saves the list of cuts (see load) to the cutlist file. Only
+        the cuts are written (start and duration in seconds), so the
+        saved file can be loaded again.
+        """
+        with codecs.open(self._path, 'w', encoding='utf-8') as f:
+            f.write('[General]\r\n')
+            f.write('NoOfCuts={}\r\n'.format(len(cuts)))
+            for i, (start, duration, cut) in enumerate(cuts):
+                f.write('\r\n[Cut{}]\r\n'.format(i))
+                f.write('Start={!r}\r\n'.format(start / 1000.0))
+                f.write('Duration={!r}\r\n'.format(duration / 1000.0))
+
+
+
+class CutMap(object):
+    """A CutMap is a compiled list of cuts (see Cutlist.load) which maps
+    timings between the uncut and the cut video.
+
+    The boundaries of the cuts are precomputed as sorted lists, so that
+    each lookup is a binary search (O(log c) for c cuts) instead of a
+    linear scan of the cuts.
+
+    A CutMap can still be used like the list of cuts it was created
+    from (len(), indexing, slicing, iteration).
+
+    A CutMap without cuts keeps the whole video (like an empty
+    cutlist). A CutMap that keeps nothing has cuts without duration
+    (see from_kept_ranges).
+    """
+    def __init__(self, cuts):
+        self._cuts = list(cuts)
+        # start of each cut in the uncut video
+        self._starts = [start for start, duration, cut in self._cuts]
+        # end of each cut in the uncut video
+        self._ends = [start+duration for start, duration, cut in self._cuts]
+        # end of each cut in the cut video
+        self._cut_positions = [long(cut) for start, duration, cut
+                               in self._cuts]
+        # difference between uncut and cut timings for each cut
+        self._offsets = [start - (cut - duration) for start, duration, cut
+                         in self._cuts]
+        self._keeps_nothing = bool(self._cuts) and all(
+                     duration <= 0 for start, duration, cut in self._cuts)
+
+    @staticmethod
+    def compile(cuts):
+        """Returns cuts if it is already a CutMap, otherwise a new
+        CutMap is created for the list of cuts.
+        """
+        if isinstance(cuts, CutMap):
+            return cuts
+        return CutMap(cuts)
+
+    def get_cut_offset(self, millis):
+        """Returns the offset which must be subtracted from the timing
+        millis of the uncut video to get the timing in the cut video.
+        """
+        if not self._cuts:
+            return 0.0
+        i = min(bisect.bisect_right(self._ends, millis), len(self._cuts) - 1)
+        return self._offsets[i]
+
+    def get_uncut_offset(self, millis):
+        """Returns the offset which must be added to the timing millis
+        of the cut video to get the timing in the uncut video.
+        """
+        if not self._cuts:
+            return 0.0
+        i = min(bisect.bisect_right(self._cut_positions, millis),
+                len(self._cuts) - 1)
+        return self._offsets[i]
+
+    def to_cut(self, millis):
+        return millis - self.get_cut_offset(millis)
+
+    def to_uncut(self, millis):
+        return millis + self.get_uncut_offset(millis)
+
+    def get_cut_offsets(self, millis_list):
+        """Returns the list of the offsets for the timings millis_list
+        of the uncut video (see get_cut_offset).
+        """
+        return self._get_offsets(self._ends, millis_list)
+
+    def get_uncut_offsets(self, millis_list):
+        """Returns the list of the offsets for the timings millis_list
+        of the cut video (see get_uncut_offset).
+        """
+        return self._get_offsets(self._cut_positions, millis_list)
+
+    def to_cut_many(self, millis_list):
+        """Maps a list of uncut timings to the cut video.
+        """
+        millis_list = list(millis_list)
+        return [millis - offset for millis, offset
+                in zip(millis_list, self.get_cut_offsets(millis_list))]
+
+    def to_uncut_many(self, millis_list):
+        """Maps a list of cut timings to the uncut video.
+        """
+        millis_list = list(millis_list)
+        return [millis + offset for millis, offset
+                in zip(millis_list, self.get_uncut_offsets(millis_list))]
+
+    def _get_offsets(self, bounds, millis_list):
+        """Returns the offsets of the timings millis_list for the sorted
+        bounds (the ends of the cuts in the uncut or cut video).
+
+        Like project, the timings are processed in a single sweep
+        through the bounds (ordered by the timings) instead of a binary
+        search for each single timing.
+        """
+        millis_list = list(millis_list)
+        if not self._cuts:
+            return [0.0] * len(millis_list)
+        offsets = self._offsets
+        last = len(self._cuts) - 1
+        result = [None] * len(millis_list)
+        k = 0
+        for n in sorted(xrange(len(millis_list)), key=millis_list.__getitem__):
+            millis = millis_list[n]
+            while k < last and bounds[k] <= millis:
+                k += 1
+            result[n] = offsets[k]
+        return result
+
+    def project(self, intervals):
+        """Projects the (start, end)-intervals of the uncut video to the
+        cut video.
+
+        Returns a list with a list of (start, end)-tuples for each
+        interval: the parts of the interval which are kept in the cut
+        video. So an interval that overlaps a removed part of the video
+        is clipped, an interval that contains a removed part is split
+        and an interval inside of a removed part is dropped (empty
+        list). An interval without duration is kept if it starts in a
+        kept part of the video.
+
+        The intervals are processed in a single sweep through the
+        boundaries of the cuts (ordered by the starts of the intervals),
+        so no cut needs to be looked up for each single interval.
+        """
+        intervals = list(intervals)
+        if not self._cuts:
+            return [[(start, end)] for start, end in intervals]
+        starts, ends, offsets = self._starts, self._ends, self._offsets
+        count = len(self._cuts)
+        projected = [None] * len(intervals)
+        k = 0
+        for n in sorted(xrange(len(intervals)), key=lambda n: intervals[n][0]):
+            start, end = intervals[n]
+            # The cuts that end before the interval starts also end before
+            # all following intervals start.
+            while k < count and ends[k] <= start:
+                k += 1
+            parts = []
+            if end <= start:
+                if k < count and starts[k] <= start:
+                    parts.append((start - offsets[k], end - offsets[k]))
+            m = k
+            while m < count and starts[m] < end:
+                lower = max(start, starts[m])
+                upper = min(end, ends[m])
+                if lower < upper:
+                    parts.append((lower - offsets[m], upper - offsets[m]))
+                m += 1
+            projected[n] = parts
+        return projected
+
+    def get_kept_ranges(self):
+        """Returns the list of (start, end)-tuples of the parts of the
+        uncut video that are kept. The list is empty for a CutMap
+        without cuts (which keeps the whole video) as well as for a
+        CutMap that keeps nothing.
+        """
+        return [(start, end) for start, end in zip(self._starts, self._ends)
+                if start < end]
+
+    @staticmethod
+    def from_kept_ranges(ranges):
+        """Creates a CutMap from the sorted, non-overlapping list of
+        (start, end)-tuples of the parts of the uncut video that are
+        kept. Empty ranges are ignored and adjacent ranges are joined.
+
+        If no range is left, the CutMap keeps nothing: it has a single
+        cut without duration (a CutMap without any cut would keep the
+        whole video).
+        """
+        cuts = []
+        cut_position = 0.0
+        for start, end in ranges:
+            if end <= start:
+                continue
+            if cuts and cuts[-1][0] + cuts[-1][1] == start:
+                # Join with the previous cut.
+                start = cuts[-1][0]
+                cut_position -= cuts.pop()[1]
+            cut_position += end - start
+            cuts.append((start, end - start, cut_position))
+        if not cuts:
+            cuts.append((0.0, 0.0, 0.0))
+        return CutMap(cuts)
+
+    def compose(self, other):
+        """Returns the CutMap that cuts the uncut video like this
+        CutMap followed by the CutMap other, where the timings of other
+        refer to the video cut by this CutMap. So for example a
+        broadcast cutlist may be applied on top of a distributor cut
+        and subtitles of the uncut video can be mapped to the video cut
+        twice in one pass.
+
+        The kept parts of other are mapped back to the uncut video by
+        a merge of both sorted lists of boundaries.
+        """
+        # A CutMap without cuts keeps the whole video.
+        if not self._cuts:
+            return other
+        if not other._cuts:
+            return self
+        # The kept parts of this CutMap in the cut video.
+        cut_starts = [cut - duration for start, duration, cut in self._cuts]
+        cut_ends = [cut for start, duration, cut in self._cuts]
+        offsets = self._offsets
+        count = len(self._cuts)
+        ranges = []
+        k = 0
+        for start, end in other.get_kept_ranges():
+            while k < count and cut_ends[k] <= start:
+                k += 1
+            m = k
+            while m < count and cut_starts[m] < end:
+                lower = max(start, cut_starts[m])
+                upper = min(end, cut_ends[m])
+                if lower < upper:
+                    ranges.append((lower + offsets[m], upper + offsets[m]))
+                m += 1
+        return CutMap.from_kept_ranges(ranges)
+
+    def intersect(self, other):
+        """Returns the CutMap that keeps only the parts of the uncut
+        video that are kept by both this CutMap and the CutMap other
+        (both refer to the same uncut video).
+        """
+        # A CutMap without cuts keeps the whole video.
+        if not self._cuts:
+            return other
+        if not other._cuts:
+            return self
+        ranges = []
+        a, b = self.get_kept_ranges(), other.get_kept_ranges()
+        i, j = 0, 0
+        while i < len(a) and j < len(b):
+            lower = max(a[i][0], b[j][0])
+            upper = min(a[i][1], b[j][1])
+            if lower < upper:
+                ranges.append((lower, upper))
+            # Continue with the range that ends first.
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        return CutMap.from_kept_ranges(ranges)
+
+    def invert(self, length=None):
+        """Returns the CutMap that keeps the parts of the uncut video
+        that are removed by this CutMap (and removes the kept parts).
+
+        length is the length of the uncut video. If it is not set, the
+        uncut video is assumed to end with the last kept part (or to be
+        endless if this CutMap keeps nothing).
+        """
+        if not self._cuts:
+            return CutMap.from_kept_ranges([])
+        if self._keeps_nothing and length is None:
+            return CutMap([])
+        ranges = []
+        position = 0.0
+        for start, end in self.get_kept_ranges():
+            ranges.append((position, start))
+            position = end
+        if length is not None:
+            ranges.append((position, length))
+        return CutMap.from_kept_ranges(ranges)
+
+    def __iter__(self):
+        return iter(self._cuts)
+
+    def __getitem__(self, key):
+        return self._cuts[key]
+
+    def __len__(self):
+        return len(self._cuts)
+
+
+if __name__ == '__main__':
+    everything = CutMap([])
+    nothing = CutMap.from_kept_ranges([])
+    a = CutMap.from_kept_ranges([(0, 1000), (2000, 3000)])
+    b = CutMap.from_kept_ranges([(1000, 2000)])
+    video = [(0, 4000)]
+    # [[(0, 4000)]]
+    print(everything.project(video))
+    # [[]]
+    print(nothing.project(video))
+    # [[]]
+    print(a.intersect(b).project(video))
+    # [[(0.0, 1000.0), (1000.0, 2000.0)]]
+    print(a.intersect(everything).project(video))
+    # [[(0.0, 1000.0), (1000.0, 2000.0)]]
+    print(everything.compose(a).project(video))
+    # [[(0.0, 1000.0), (1000.0, 2000.0)]]
+    print(a.compose(everything).project(video))
+    # [[]]
+    print(a.compose(nothing).project(video))
+    # [[]]
+    print(everything.invert(4000).project(video))
+    # [[(0.0, 4000.0)]]
+    print(nothing.invert(4000).project(video))
+    # [[(0, 4000)]]
+    print(nothing.invert().project(video))
+    # [[(0.0, 1000.0)]]
+    print(a.invert(3000).project(video))
+    # [1500.0, 500.0, 1000.0]
+    print(a.to_cut_many([2500, 500, 2000]))
+    # [2500.0, 500.0, 2000.0]
+    print(a.to_uncut_many([1500, 500, 1000]))
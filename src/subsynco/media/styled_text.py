@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+'''
+SubSynco - a tool for synchronizing subtitle files
+Copyright (C) 2015  da-mkay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import re
+
+
+_BRACE_PAT = re.compile('[<>]')
+_TAG_PAT = re.compile('(/?u|/?i|/?b|(font( color="?([^"]*)"?)?\s*)|/font)$',
+                      re.IGNORECASE)
+# The b, i and u tags (and their closing tags) by their original
+# spelling, so that the most frequent tags need not be matched against
+# _TAG_PAT.
+_SIMPLE_TAGS = dict((tag, tag.lower()) for tag in
+                    ('u', 'i', 'b', 'U', 'I', 'B', '/u', '/i', '/b', '/U', '/I',
+                     '/B'))
+
+
+class StyledText(object):
+    """StyledText is the parsed form of a subtitle text with format tags
+    (b, i, u and font with an optional color).
+
+    The text is parsed only once into a tree of tags, which fixes
+    missing start/end-tags and invalid nesting of tags (see
+    TextFormatter.fix_format). It can then be rendered for the targets
+    SRT, PANGO, ASS and WEBVTT, each rendering is cached. Empty tags
+    are omitted in all renderings.
+
+    Other tags or special characters (<, >, &, ...) are kept as text.
+    They remain unchanged in SRT and are escaped for PANGO and WEBVTT.
+    """
+    # Subtitle text with format tags as used by SRT-files, for example
+    # '<i>a</i> <font color="red">b</font>'.
+    SRT = 'srt'
+    # Pango markup, for example '<i>a</i> <span foreground="red">b</span>'
+    PANGO = 'pango'
+    # Text of an ASS-event with override codes, for example
+    # '{\i1}a{\i0} {\c&H0000FF&}b'.
+    ASS = 'ass'
+    # WebVTT cue text, for example '<i>a</i> <c.red>b</c>'. WebVTT only
+    # has classes for some named colors, other colors are omitted.
+    WEBVTT = 'webvtt'
+
+    def __init__(self, text):
+        self.text = text
+        self._root = _parse(text)
+        self._renderings = {}
+
+    def render(self, target):
+        """Returns the text rendered for the target (SRT, PANGO, ASS or
+        WEBVTT).
+        """
+        rendering = self._renderings.get(target)
+        if rendering is None:
+            rendering = _RENDERERS[target](self._root)
+            self._renderings[target] = rendering
+        return rendering
+
+    def __copy__(self):
+        # A StyledText is not changed after it was parsed (except for
+        # the cached renderings), so copies of a Subtitle can share it.
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def get_runs(self):
+        """Returns the text as list of (text, style)-tuples where style
+        is a (bold, italic, underline, color)-tuple. color is the value
+        of the color attribute of the innermost font tag (None if
+        there is none). Successive runs have different styles and the
+        text of a run is never empty.
+        """
+        return _get_runs(self._root)
+
+
+class _Tag(object):
+    """A format tag of the text and its content (a list of strings and
+    _Tags). name is 'b', 'i', 'u' or 'font', color is the color of a
+    font tag (or None).
+    """
+    __slots__ = ('name', 'color', 'content')
+
+    def __init__(self, name, color=None):
+        self.name = name
+        self.color = color
+        self.content = []
+
+
+def _parse(msg):
+    """Returns the root _Tag of the tree of tags for msg.
+    """
+    # msg is split into text and tags which are collected in a tree of
+    # _Tags, so that a missing opening tag can be added by wrapping the
+    # content of a _Tag instead of rebuilding the string.
+    root = _Tag(None)
+    # list of (tag, _Tag)-tuples
+    opened_tags = []
+    # the list to which the text and tags are added
+    content = root.content
+    brace_opened = False
+    pos = 0
+    for brace_match in _BRACE_PAT.finditer(msg):
+        brace_pos = brace_match.start()
+        if msg[brace_pos] == '<':
+            if brace_opened:
+                # There was already a single '<': keep it
+                content.append('<')
+            if pos < brace_pos:
+                content.append(msg[pos:brace_pos])
+            pos = brace_pos + 1
+            brace_opened = True
+            continue
+        tag = msg[pos:brace_pos]
+        pos = brace_pos + 1
+        if not brace_opened:
+            # missing '<': keep single '>'
+            content.append(tag + '>')
+            continue
+        brace_opened = False
+        tag_name = _SIMPLE_TAGS.get(tag)
+        if tag_name is None:
+            tag_match = _TAG_PAT.match(tag)
+            if not tag_match:
+                # unknown tag: keep braces
+                content.append('<'+tag+'>')
+                continue
+            tag_name = tag.lower()
+        if tag_name[0] != '/':
+            # opening tag
+            if len(tag_name) == 1:
+                node = _Tag(tag_name)
+            else:
+                color = tag_match.group(4)
+                node = _Tag('font', None if color is None else color.strip())
+            content.append(node)
+            opened_tags.append((node.name, node))
+            content = node.content
+        else:
+            # closing tag
+            tag_name = tag_name[1:]
+            if opened_tags and opened_tags[-1][0] == tag_name:
+                opened_tags.pop()
+                content = (opened_tags[-1][1].content if opened_tags else
+                           root.content)
+            elif tag_name != 'font':
+                # missing opening tag: the tag encloses the content of
+                # the innermost opened tag (or the whole text)
+                parent = opened_tags[-1][1] if opened_tags else root
+                node = _Tag(tag_name)
+                node.content = parent.content
+                parent.content = [node]
+                content = parent.content
+            # else: tag is removed since we don't know the color
+    if brace_opened:
+        # There was a single '<': keep it
+        content.append('<')
+    if pos < len(msg):
+        content.append(msg[pos:])
+    return root
+
+
+def _get_runs(root):
+    """Returns the runs for the content of the _Tag root (see
+    StyledText.get_runs).
+    """
+    runs = []
+    stack = []
+    content = iter(root.content)
+    style = (False, False, False, None)
+    while True:
+        for item in content:
+            if item.__class__ is _Tag:
+                stack.append((content, style))
+                content = iter(item.content)
+                bold, italic, underline, color = style
+                if item.name == 'b':
+                    bold = True
+                elif item.name == 'i':
+                    italic = True
+                elif item.name == 'u':
+                    underline = True
+                elif item.color is not None:
+                    color = item.color
+                style = (bold, italic, underline, color)
+                break
+            if not item:
+                continue
+            # The text of successive items with the same style is
+            # joined at the end.
+            if runs and runs[-1][1] == style:
+                runs[-1][0].append(item)
+            else:
+                runs.append(([item], style))
+        else:
+            if not stack:
+                return [(''.join(texts), style) for texts, style in runs]
+            content, style = stack.pop()
+
+
+def _render_tree(root, tag_strings, escape=None):
+    """Returns the string for the content of the _Tag root. tag_strings
+    returns the (start, end)-tuple of strings for a _Tag, escape (if
+    any) is applied to the text. Empty tags (for example '<i></i>') are
+    removed.
+    """
+    # The tree is traversed without recursion since the tags may be
+    # nested deeply. A tag is written when it is entered and removed
+    # again when it is left without any content written.
+    out = []
+    stack = []
+    content = iter(root.content)
+    start = 0
+    end = ''
+    written = False
+    while True:
+        for item in content:
+            if item.__class__ is _Tag:
+                stack.append((content, start, end, written))
+                content = iter(item.content)
+                start = len(out)
+                tag_start, end = tag_strings(item)
+                written = False
+                out.append(tag_start)
+                break
+            if item:
+                out.append(item if escape is None else escape(item))
+                written = True
+        else:
+            if not stack:
+                return ''.join(out)
+            if written:
+                out.append(end)
+            else:
+                del out[start:]
+            tag_written = written
+            content, start, end, written = stack.pop()
+            written = written or tag_written
+
+
+_SIMPLE_TAG_STRINGS = dict((name, ('<'+name+'>', '</'+name+'>'))
+                           for name in ('b', 'i', 'u'))
+
+
+def _srt_tag_strings(tag):
+    if tag.name != 'font':
+        return _SIMPLE_TAG_STRINGS[tag.name]
+    if tag.color is None:
+        return '<font>', '</font>'
+    return '<font color="'+tag.color+'">', '</font>'
+
+
+def _pango_tag_strings(tag):
+    if tag.name != 'font':
+        return _SIMPLE_TAG_STRINGS[tag.name]
+    if tag.color is None:
+        return '<span>', '</span>'
+    return '<span foreground="'+tag.color+'">', '</span>'
+
+
+# The colors of the default color classes of WebVTT.
+_WEBVTT_CLASSES = {
+    'ffffff': 'white',
+    '00ff00': 'lime',
+    '00ffff': 'cyan',
+    'ff0000': 'red',
+    'ffff00': 'yellow',
+    'ff00ff': 'magenta',
+    '0000ff': 'blue',
+    '000000': 'black',
+}
+
+
+def _render_pango(root):
+    # GLib is imported on demand, so that StyledText can be used without
+    # GTK (for example by subsynco-batch).
+    from gi.repository import GLib
+    return _render_tree(root, _pango_tag_strings, GLib.markup_escape_text)
+
+
+def _webvtt_tag_strings(tag):
+    if tag.name != 'font':
+        return _SIMPLE_TAG_STRINGS[tag.name]
+    class_ = _WEBVTT_CLASSES.get(_parse_color(tag.color))
+    return '<c>' if class_ is None else '<c.'+class_+'>', '</c>'
+
+
+def _webvtt_escape(text):
+    return (text.replace('&', '&amp;').replace('<', '&lt;')
+                .replace('>', '&gt;').replace('\r\n', '\n'))
+
+
+def _render_ass(root):
+    # ASS has no nested tags, so the override codes are written for
+    # each change of the style.
+    out = []
+    bold, italic, underline, rgb = False, False, False, None
+    for text, style in _get_runs(root):
+        new_rgb = _parse_color(style[3])
+        overrides = []
+        if style[0] != bold:
+            overrides.append('\\b1' if style[0] else '\\b0')
+        if style[1] != italic:
+            overrides.append('\\i1' if style[1] else '\\i0')
+        if style[2] != underline:
+            overrides.append('\\u1' if style[2] else '\\u0')
+        if new_rgb != rgb:
+            # ASS colors are in BGR order
+            overrides.append('\\c' if new_rgb is None else
+                             '\\c&H'+(new_rgb[4:6]+new_rgb[2:4]+
+                                      new_rgb[0:2]).upper()+'&')
+        if overrides:
+            out.append('{'+''.join(overrides)+'}')
+        out.append(text.replace('\r\n', '\\N').replace('\n', '\\N'))
+        bold, italic, underline = style[:3]
+        rgb = new_rgb
+    return ''.join(out)
+
+
+# The basic HTML color names (and cyan and magenta) by their RGB-value.
+_COLORS = {
+    'black': '000000', 'silver': 'c0c0c0', 'gray': '808080',
+    'white': 'ffffff', 'maroon': '800000', 'red': 'ff0000',
+    'purple': '800080', 'fuchsia': 'ff00ff', 'magenta': 'ff00ff',
+    'green': '008000', 'lime': '00ff00', 'olive': '808000',
+    'yellow': 'ffff00', 'navy': '000080', 'blue': '0000ff',
+    'teal': '008080', 'aqua': '00ffff', 'cyan': '00ffff',
+}
+_RE_HEX_COLOR = re.compile('#?([0-9a-f]{6}|[0-9a-f]{3})$')
+
+
+def _parse_color(color):
+    """Returns the RGB-value of the color of a font tag as lower case
+    hex string (for example 'ff0000' for 'red', '#f00' or '#FF0000') or
+    None if the color is unknown.
+    """
+    if color is None:
+        return None
+    color = color.lower()
+    rgb = _COLORS.get(color)
+    if rgb is not None:
+        return rgb
+    match = _RE_HEX_COLOR.match(color)
+    if match is None:
+        return None
+    rgb = match.group(1)
+    if len(rgb) == 3:
+        rgb = ''.join(c * 2 for c in rgb)
+    return rgb
+
+
+_RENDERERS = {
+    StyledText.SRT: lambda root: _render_tree(root, _srt_tag_strings),
+    StyledText.PANGO: _render_pango,
+    StyledText.ASS: _render_ass,
+    StyledText.WEBVTT: lambda root: _render_tree(root, _webvtt_tag_strings,
+                                                 _webvtt_escape),
+}
@@ -18,16 +18,20 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 import codecs
-import hashlib
-import itertools
+import copy
 import json
-import re
-from collections import OrderedDict
+import os
+import threading
 from os import path
+from subsynco.media.cuts import CutMap
+from subsynco.media.submod_align import SubtitleAligner
+from subsynco.media.submod_binary import SubmodBinary
+from subsynco.media.submod_plan import SubmodPlan
+from subsynco.media.submod_stream import SubmodStream
 from subsynco.media.subtitle import Subtitle
 from subsynco.media.subtitle import SubtitleList
-from subsynco.utils.textfile import TextFile
-from subsynco.utils.time import Time
+from subsynco.utils.ingest import IngestedFile
+from subsynco.utils.lru_cache import LruCache
 
 
 class Submod(object):
@@ -68,7 +72,14 @@ class Submod(object):
     the id 21 will be modified and the subtitles 22 to 30 will be
     removed. Moreover a new subtitle will be added at position
     "00:00:12.345".
+
+    Loaded scripts are compiled to a SubmodPlan (see load) which is
+    used to run the script.
     """
+    # Compiled plans of loaded script files, see load.
+    _plan_cache = LruCache(32)
+    _plan_cache_lock = threading.Lock()
+
     def __init__(self, orig_subtitle_path=None, orig_subtitle_list=None,
                  orig_subtitle_encoding=None):
         """Constructor
@@ -77,7 +88,8 @@ class Submod(object):
         subtitle file. The information about the original subtitle file
         will be used when generating a Submod-script. For example the
         hash of the subtitle file will be generated and the SubtitleList
-        will be compared to the new one.
+        will be compared to the new one. Instead of the path you may
+        pass an IngestedFile, so that the file is not read again.
         
         If you only want to run a Submod-script you don't need to pass
         a path/SubtitleList/encoding.
@@ -90,223 +102,122 @@ class Submod(object):
             self._orig_subtitle_encoding = None
         else:
             self._orig_subtitle_list = orig_subtitle_list
-            __, self._subtitle_filename = path.split(orig_subtitle_path)
+            orig_subtitle_path = IngestedFile.get(orig_subtitle_path)
+            __, self._subtitle_filename = path.split(orig_subtitle_path.path)
             self._subtitle_sha256 = self._hash_subtitle_file(orig_subtitle_path)
             self._orig_subtitle_encoding = orig_subtitle_encoding
     
+    @property
+    def script(self):
+        """The Submod-script (JSON-data). If only the compiled plan is
+        known (see load), the script is created from the plan.
+        """
+        if self._script is None and self._plan is not None:
+            self._script = self._plan.to_script()
+        return self._script
+
+    @script.setter
+    def script(self, script):
+        self._script = script
+        self._plan = None
+
+    @property
+    def plan(self):
+        """The SubmodPlan of the Submod-script. It is compiled from the
+        script when first needed.
+        """
+        if self._plan is None and self._script is not None:
+            self._plan = self._validate(self._script)
+        return self._plan
+
+    @plan.setter
+    def plan(self, plan):
+        self._plan = plan
+        self._script = None
+
     def load(self, path_, enc):
         """Loads the Submod-script file.
         
+        The script is validated and compiled to a SubmodPlan once. The
+        plan is cached, so loading the same (unchanged) script file
+        again does not need to parse the file.
+
+        Binary Submod-scripts (see SubmodBinary) are detected
+        automatically, enc is not used for these (and may be None).
+
+        JSON-scripts are read incrementally (see SubmodStream), so the
+        JSON-data of a large script is never loaded completely.
+
         An Exception will be raised if the script is not valid
         (ValueError, TypeError, KeyError).
         """
-        with codecs.open(path_, 'r', encoding=enc) as f:
-            json_data = json.load(f)
-        self._validate(json_data)
-        self.script = json_data
-        if 'timings-for' not in self.script:
-            self.script['timings-for'] = 'original'
+        stat = os.stat(path_)
+        key = (path.realpath(path_), stat.st_size, stat.st_mtime,
+               stat.st_ino, enc)
+        with Submod._plan_cache_lock:
+            plan = Submod._plan_cache.get(key)
+        if plan is None:
+            with open(path_, 'rb') as f:
+                if SubmodBinary.is_binary(f.read(len(SubmodBinary.MAGIC))):
+                    f.seek(0)
+                    plan = SubmodBinary.loads(f.read())
+                else:
+                    f.seek(0)
+                    plan = SubmodStream.load(f, enc)
+            with Submod._plan_cache_lock:
+                Submod._plan_cache.set(key, plan)
+        self.plan = plan
 
     def _validate(self, value):
         """Validates the loaded JSON-data to ensure it is a valid
-        Submod-script.
+        Submod-script and returns the compiled SubmodPlan.
         
         If validation fails an Exception is raised (ValueError,
         TypeError, KeyError).
         """
-        item_validators = {
-            'subtitle': self._validate_subtitle,
-            'move': self._create_list_validator(self._validate_move_item),
-            'update': self._create_list_validator(self._validate_update_item),
-            'remove': self._create_list_validator(self._validate_remove_item),
-            'add': self._create_list_validator(self._validate_add_item)
-        }
-        opt_item_validators = {
-            'timings-for': self._validate_timings_for
-        }
-        self._validate_dict(value, item_validators,
-                            opt_item_validators=opt_item_validators)
-
-    def _validate_subtitle(self, value):
-        item_validators = {
-            'filename': self._validate_any_str,
-            'sha256': lambda v: self._validate_str(v, r'^[0-9a-f]{64}$')
-        }
-        optional_items_validators = {
-            'encoding': self._validate_encoding
-        }
-        self._validate_dict(value, item_validators,
-                            opt_item_validators=optional_items_validators)
-
-    def _validate_move_item(self, value):
-        item_validators = {
-            'id': self._validate_id,
-            'by': self._validate_signed_time,
-        }
-        self._validate_dict(value, item_validators)
-            
-    def _validate_update_item(self, value):
-        # id is required
-        item_validators = {
-            'id': self._validate_id
-        }
-        # but we need only one of start, end or text
-        any_item_validators = {
-            'start': self._validate_time,
-            'end': self._validate_time,
-            'text': self._validate_any_str,
-        }
-        self._validate_dict(value, item_validators, any_item_validators)
-
-    def _validate_remove_item(self, value):
-        item_validators = {
-            'id': self._validate_id
-        }
-        self._validate_dict(value, item_validators)
-
-    def _validate_add_item(self, value):
-        item_validators = {
-            'start': self._validate_time,
-            'end': self._validate_time,
-            'text': self._validate_any_str,
-        }
-        self._validate_dict(value, item_validators)
-
-    def _validate_timings_for(self, value):
-        self._validate_str(value, r'^(original|uncut)$')
-
-    def _validate_time(self, value):
-        self._validate_str(value, r'^\d{2}:[0-5]\d:[0-5]\d\.\d{3}$')
+        return SubmodPlan.compile(value)
 
-    def _validate_signed_time(self, value):
-        self._validate_str(value, r'^[+-]\d{2}:[0-5]\d:[0-5]\d\.\d{3}$')
-
-    def _validate_id(self, value):
-        if isinstance(value, int) or isinstance(value, long):
-            return
-        groups = self._validate_str(value, r'^(\d+)-(\d+)$')
-        if long(groups[0]) >= long(groups[1]):
-            raise ValueError(_('Invalid ids in Submod-script!'))
-
-    def _validate_encoding(self, value):
-        self._validate_any_str(value)
-        if value not in TextFile.get_available_encodings():
-            raise TypeError(_('Invalid encoding ({}) in Submod-script!').format(
-                                                                         value))
-        
-    def _validate_any_str(self, value):
-        if not isinstance(value, unicode):
-            raise TypeError(_('Invalid Submod-script! Expected string, but foun'
-                              'd:\n{}').format(json.dumps(value)))
-        
-    def _validate_str(self, value, regex):
-        self._validate_any_str(value)
-        match = re.match(regex, value)
-        if match is None:
-            raise ValueError(_('Invalid "{}" in Submod-script!').format(value))
-        return match.groups()
-
-    def _create_list_validator(self, item_validator):
-        return lambda v: self._validate_list(v, item_validator)
-
-    def _validate_list(self, value, item_validator):
-        """Validates that the given value is a list and validates each
-        list item using the given item_validator.
-        """
-        if not isinstance(value, list):
-            raise TypeError(_('Invalid Submod-script! Expected array, but found'
-                              ':\n{}').format(json.dumps(value)))
-        for item in value:
-            item_validator(item)
-
-    def _validate_dict(self, value, item_validators, any_item_validators={},
-                       opt_item_validators={}):
-        """Validates that the given value is a dict and that the dict
-        itself is valid.
-        
-        The dict is considered to be valid if the following is true:
-          1. item_validators, any_item_validators and
-             opt_item_validators contain the valid keys. Each key of
-             the dict value must be a valid key.
-          2. The dict value must contain all keys of item_validators.
-          3. The dict value must contain at least one key of
-             any_item_validators.
-          4. item_validators, any_item_validators and
-             opt_item_validators also contain a validation method for
-             each valid key. These are used to validate the dict'
-             values.
-
-        Each *_valiators-parameter is a dict that assigns a validator-
-        function to a key, for example: {'id': self._validate_id}. In
-        this case the dict's 'id' value is validated using the method
-        self._validate_id.
-        """
-        if not isinstance(value, dict):
-            raise TypeError(_('Invalid Submod-script! Expected object, but foun'
-                              'd:\n{}').format(json.dumps(value)))
-        for key, v in value.iteritems():
-            if key in item_validators:
-                item_validators[key](v)
-            elif key in any_item_validators:
-                any_item_validators[key](v)
-            elif key in opt_item_validators:
-                opt_item_validators[key](v)
-            else:
-                raise ValueError(
-                                _('Unknown "{}" in Submod-script!').format(key))
-        for key in item_validators:
-            if key not in value:
-                raise KeyError(_('Missing "{}" in Submod-script!').format(key))
-        if len(any_item_validators) > 0 and len(value) <= len(item_validators):
-            raise KeyError(_('Missing one of "{}" in Submod-script!').format(
-                                       '", "'.join(any_item_validators.keys())))
-
-    def _get_ids_for_script(self, id1, id2):
-        return id1 if id1 == id2 else "{}-{}".format(str(id1), str(id2))
-
-    def _get_valid_ids(self, subtitle_list, value):
-        """Get a list of valid subtitle ids.
+    def _get_id_range(self, subtitle_list, first, last):
+        """Get the range of subtitle indices for the given ids.
         
-        For example 1 will return [0] and "3-6" will return
-        [2, 3, 4, 5].
+        For example (1, 1) will return (0, 1) and (3, 6) will return
+        (2, 6). The first index is included, the second one is
+        excluded.
         
         If any of the ids is not contained in the SubtitleList an
         IndexError is raised.
         """
-        if isinstance(value, int) or isinstance(value, long):
-            range_ = [value, value]
-        else:
-            range_ = map(long, value.split('-'))
-        range_[0] -= 1
-        ids = range(*range_)
-        max_valid_id = len(subtitle_list) - 1
-        not_found = filter(lambda id_: id_>max_valid_id, ids)
-        if not_found:
+        count = len(subtitle_list)
+        if first < 1 or last > count:
+            not_found = (SubmodPlan.format_ids(max(first, count+1), last)
+                         if first >= 1 else SubmodPlan.format_ids(first, last))
             raise IndexError(_('Subtitle(s) "{}" not found!').format(
-                               '", "'.join(map(lambda v: str(v+1), not_found))))
-        return ids
-
-    def _get_subtitles_by_ids(self, subtitle_list, ids):
-        id_list = self._get_valid_ids(subtitle_list, ids)
-        return map(lambda id_: subtitle_list[id_], id_list)
-
-    def _hash_subtitle_file(self, path_):
-        sha256 = hashlib.sha256()
-        with open(path_, 'rb') as f:
-            buf = f.read()
-            sha256.update(buf)
-        return sha256.hexdigest()
-
-    def run(self, path_, subtitle_loader, cuts=None):
-        """Loads a SubtitleList from the subtitle file path_ using the
-        given subtitle_loader function and applies the loaded Submod-
-        script.
+                                                                     not_found))
+        return first-1, last
+
+    def _hash_subtitle_file(self, subtitle_file):
+        # The subtitle file is always parsed after it was hashed, so it
+        # is read first. Thus the hashed bytes are the parsed bytes and
+        # the file is not read again for parsing.
+        subtitle_file = IngestedFile.get(subtitle_file)
+        subtitle_file.read()
+        return subtitle_file.sha256
+
+    def run(self, subtitle_file, subtitle_loader, cuts=None):
+        """Loads a SubtitleList from the subtitle file subtitle_file (a
+        path or an IngestedFile) using the given subtitle_loader
+        function and applies the loaded Submod-script.
         
-        subtitle_loader must be a function that accept a path as
-        parameter and returns a SubtitleList.
+        subtitle_loader must be a function that accepts an IngestedFile
+        as parameter and returns a SubtitleList. The file is read only
+        once, so the loader should parse the data of the IngestedFile.
         
         If cuts is set then the timings are adapted for these cuts so
-        that the created subtitle and the cut video are in sync.
+        that the created subtitle and the cut video are in sync. The
+        moved, updated and added subtitles are projected to the cut
+        video (see SubtitleList.project_subtitles): subtitles that
+        overlap a removed part of the video are clipped, split at the
+        cut or dropped.
         
         The changes are always made in the following order: move,
         update, remove, add.
@@ -323,69 +234,344 @@ class Submod(object):
         
         Returns a SubtitleList.
         """
+        plan = self.plan
+        subtitle_file = IngestedFile.get(subtitle_file)
+        sha256 = self._hash_subtitle_file(subtitle_file).lower()
+        if sha256 != plan.subtitle['sha256']:
+            raise ValueError(_('The subtitle has a wrong checksum ("{}")!')
+                             .format(sha256))
+        if cuts is not None:
+            cuts = CutMap.compile(cuts)
+        subtitle_list = subtitle_loader(subtitle_file)
+        return self._apply_plan(plan, subtitle_list, cuts)
+
+    @staticmethod
+    def run_stream(script_file, enc, subtitle_file, subtitle_loader,
+                   cuts=None):
+        """Like load and run, but the Submod-script file script_file is
+        applied while it is read (see SubmodStream), so that the
+        entries of a very large script are not kept in memory.
+
+        The moves and updates are applied as soon as they were read if
+        the "subtitle" was read before and (for updates) the "move"-
+        section is complete, which is the case for the order used by
+        save_script (subtitle, timings-for, move, update, remove, add).
+        Otherwise they are kept until these are available. The
+        removes and adds are always applied at the end.
+
+        Binary Submod-scripts are loaded completely and then applied.
+
+        The subtitles are changed copy-on-write (see run_many), so
+        subtitle_loader may return the same SubtitleList for multiple
+        scripts.
+
+        Returns a SubtitleList. An Exception is raised if the script is
+        not valid (see load) or cannot be applied (see run).
+        """
+        submod = Submod()
+        subtitle_file = IngestedFile.get(subtitle_file)
+        if cuts is not None:
+            cuts = CutMap.compile(cuts)
+        if SubmodBinary.is_binary_file(script_file):
+            submod.load(script_file, enc)
+            plan = submod.plan
+            sha256 = submod._hash_subtitle_file(subtitle_file).lower()
+            if sha256 != plan.subtitle['sha256']:
+                raise ValueError(_('The subtitle has a wrong checksum ("{}")!')
+                                 .format(sha256))
+            return submod._apply_plan(plan, subtitle_loader(subtitle_file),
+                                      cuts, copy_on_write=True)
+        subtitles = None
+        uncut = None
+        copied = set()
+        moves, updates, removes, adds = [], [], [], []
+        move_read = False
+        with open(script_file, 'rb') as f:
+            for key, value in SubmodStream.iter_script(f, enc):
+                if key == 'move':
+                    moves.extend(value)
+                    move_read = True
+                elif key == 'update':
+                    updates.extend(value)
+                elif key == 'remove':
+                    removes.extend(value)
+                elif key == 'add':
+                    adds.extend(value)
+                elif key == 'subtitle':
+                    sha256 = submod._hash_subtitle_file(subtitle_file).lower()
+                    if sha256 != value['sha256']:
+                        raise ValueError(_('The subtitle has a wrong checksum'
+                                           ' ("{}")!').format(sha256))
+                    subtitles = list(subtitle_loader(subtitle_file))
+                    if cuts is not None:
+                        uncut = [False] * len(subtitles)
+                if subtitles is None:
+                    continue
+                submod._apply_moves(moves, subtitles, copied, uncut)
+                del moves[:]
+                # Each key occurs only once, so the moves are complete
+                # once another key follows the "move"-section.
+                if key != 'move' and move_read:
+                    submod._apply_updates(updates, subtitles, cuts, copied,
+                                          uncut)
+                    del updates[:]
+        submod._apply_moves(moves, subtitles, copied, uncut)
+        submod._apply_updates(updates, subtitles, cuts, copied, uncut)
+        submod._apply_removes(removes, subtitles, uncut)
+        return submod._create_subtitle_list(subtitles, adds, cuts, uncut)
+
+    def _apply_plan(self, plan, subtitle_list, cuts=None,
+                    copy_on_write=False):
+        """Applies the SubmodPlan plan to the subtitle_list (see run)
+        and returns a new SubtitleList. cuts must be a CutMap or None.
+
+        By default the subtitles of subtitle_list are modified. If
+        copy_on_write is True subtitle_list is not changed at all:
+        a subtitle is copied before it is modified, all other subtitles
+        are shared by subtitle_list and the returned SubtitleList.
+        """
         # NOTE: We do not use SubtitleList's methods to modify the
         #       timestamps of subtitles. For example move_subtitle()
         #       could change the order of the subtitles so that the id's
         #       from the submod may not refer to the correct subtitle
         #       anymore. Instead we modify the subtitle's start/end
-        #       values directly which will result in a SubtitleList that
-        #       is not properly ordered. After moving, updating and
-        #       removing subtitles we add all subtitles of the current
-        #       SubtitleList to a new SubtitleList which then will take
-        #       care of the correct order of the subtitles based on
-        #       their timestamps. At the end we add the new subtitles
-        #       from the add-section of the submod.
-        sha256 = self._hash_subtitle_file(path_).lower()
-        if sha256 != self.script['subtitle']['sha256']:
-            raise ValueError(_('The subtitle has a wrong checksum ("{}")!')
-                             .format(sha256))
-        subtitle_list = subtitle_loader(path_)
-        offset = 0.0
-        for move in self.script['move']:
-            by = Time.millis_from_str(move['by'])
-            for i in self._get_valid_ids(subtitle_list, move['id']):
-                if cuts is not None:
-                    offset = self._get_run_offset(subtitle_list[i].start + by,
-                                                  cuts)
-                subtitle_list[i].start = (subtitle_list[i].start + by) - offset
-                subtitle_list[i].end = (subtitle_list[i].end + by) - offset
-        for update in self.script['update']:
-            # Each update may contain any of end, start and text values
-            # where the end/start-strings must be converted to number of
-            # milliseconds.
+        #       values directly which will result in a list that is not
+        #       properly ordered. After moving, updating and removing
+        #       subtitles we add all subtitles of the current list to a
+        #       new SubtitleList which then will take care of the
+        #       correct order of the subtitles based on their
+        #       timestamps. At the end we add the new subtitles from the
+        #       add-section of the submod.
+        subtitles = list(subtitle_list)
+        # Indices of the subtitles that were already copied (only used
+        # if copy_on_write is True).
+        copied = set() if copy_on_write else None
+        # Flags of the subtitles that have timings for the uncut video
+        # and must be projected (only used if cuts are set).
+        uncut = [False] * len(subtitles) if cuts is not None else None
+        self._apply_moves(plan.moves, subtitles, copied, uncut)
+        self._apply_updates(plan.updates, subtitles, cuts, copied, uncut)
+        self._apply_removes(plan.removes, subtitles, uncut)
+        return self._create_subtitle_list(subtitles, plan.adds, cuts, uncut)
+
+    def _apply_moves(self, moves, subtitles, copied, uncut):
+        """Applies the moves of a SubmodPlan to the list subtitles (see
+        _apply_plan). If copied is not None, each subtitle whose index
+        is not in copied is copied before it is modified.
+
+        If uncut is not None, the moved subtitles are flagged in uncut,
+        since the moved timings are timings for the uncut video, which
+        are projected to the cut video at the end.
+        """
+        for first, last, by in moves:
+            i, j = self._get_id_range(subtitles, first, last)
+            for k in xrange(i, j):
+                subtitle = subtitles[k]
+                if copied is not None and k not in copied:
+                    subtitle = subtitles[k] = copy.copy(subtitle)
+                    copied.add(k)
+                subtitle.start += by
+                subtitle.end += by
+                if uncut is not None:
+                    uncut[k] = True
+
+    def _apply_updates(self, updates, subtitles, cuts, copied, uncut):
+        """Applies the updates of a SubmodPlan to the list subtitles
+        (see _apply_moves).
+
+        Updates of start and end, and updates of subtitles that were
+        already moved, are timings for the uncut video (flagged in
+        uncut). If only the start or the end of another subtitle is
+        updated, the time is mapped to the cut video directly.
+        """
+        if cuts is not None:
+            # The times of all updates are mapped to the cut video at
+            # once (in the order of the updates, start before end).
+            cut_times = iter(cuts.to_cut_many(
+                              time for __, __, start, end, __ in updates
+                              for time in (start, end) if time is not None))
+        for first, last, start, end, text in updates:
+            # Each update may contain any of start, end and text values.
             new_values = []
-            for k, f in [('start', lambda x : self._get_run_time(
-                                                Time.millis_from_str(x), cuts)),
-                         ('end', lambda x : self._get_run_time(
-                                                Time.millis_from_str(x), cuts)),
-                         ('text', lambda x : x.encode('utf-8'))]:
-                if k in update:
-                    new_values.append((k, f(update[k],)))
-            subtitles = self._get_subtitles_by_ids(subtitle_list, update['id'])
-            for subtitle in subtitles:
-                for k, v in new_values:
-                    setattr(subtitle, k, v)
-        # Gather ids of subs that should be removed and sort them desc.
-        # The subs are removed in that order. Thus the sub with the 
-        # biggest id will be removed first. If we would start with a
-        # smaller id, then further ids that should be removed will point
-        # to a wrong subtitle.
-        to_remove = []
-        for remove in self.script['remove']:
-            to_remove += self._get_valid_ids(subtitle_list, remove['id'])
-        for i in sorted(to_remove, reverse=True):
-            subtitle_list.remove_subtitle(i)
+            if text is not None:
+                new_values.append(('text', text))
+            new_times = []
+            if start is not None:
+                new_times.append(('start', start))
+            if end is not None:
+                new_times.append(('end', end))
+            both_times = len(new_times) == 2
+            if cuts is not None:
+                new_cut_times = [(key, next(cut_times))
+                                 for key, value in new_times]
+            i, j = self._get_id_range(subtitles, first, last)
+            for k in xrange(i, j):
+                subtitle = subtitles[k]
+                if copied is not None and k not in copied:
+                    subtitle = subtitles[k] = copy.copy(subtitle)
+                    copied.add(k)
+                for key, value in new_values:
+                    setattr(subtitle, key, value)
+                if uncut is None or both_times or uncut[k]:
+                    for key, value in new_times:
+                        setattr(subtitle, key, value)
+                    if uncut is not None and new_times:
+                        uncut[k] = True
+                else:
+                    for key, value in new_cut_times:
+                        setattr(subtitle, key, value)
+
+    def _apply_removes(self, removes, subtitles, uncut):
+        """Removes the subtitles of the removes of a SubmodPlan from the
+        list subtitles (and their flags from uncut if it is not None).
+        """
+        # Gather the id ranges of subs that should be removed, merge
+        # overlapping ranges and sort them desc. The ranges are removed
+        # in that order. Thus the range with the biggest ids will be
+        # removed first. If we would start with smaller ids, then
+        # further ids that should be removed will point to a wrong
+        # subtitle.
+        to_remove = sorted(self._get_id_range(subtitles, first, last)
+                           for first, last in removes)
+        merged_to_remove = []
+        for i, j in to_remove:
+            if merged_to_remove and i <= merged_to_remove[-1][1]:
+                merged_to_remove[-1][1] = max(merged_to_remove[-1][1], j)
+            else:
+                merged_to_remove.append([i, j])
+        for i, j in reversed(merged_to_remove):
+            del subtitles[i:j]
+            if uncut is not None:
+                del uncut[i:j]
+
+    def _create_subtitle_list(self, subtitles, adds, cuts, uncut):
+        """Returns a new (properly ordered) SubtitleList containing the
+        subtitles and the new subtitles of the adds of a SubmodPlan.
+
+        If cuts are set, the added subtitles and the subtitles flagged
+        in uncut are projected to the cut video in one pass (see
+        SubtitleList.project_subtitles), so subtitles overlapping a
+        removed part of the video are clipped, split or dropped.
+        """
+        new_subtitles = [Subtitle(start, end, text) for start, end, text
+                         in adds]
         new_subtitle_list = SubtitleList()
-        for subtitle in subtitle_list:
-            new_subtitle_list.add_subtitle(subtitle)
-        for add in self.script['add']:
-            start = self._get_run_time(Time.millis_from_str(add['start']), cuts)
-            end = self._get_run_time(Time.millis_from_str(add['end']), cuts)
-            subtitle = Subtitle(start, end, add['text'].encode('utf-8'))
-            new_subtitle_list.add_subtitle(subtitle)
+        if cuts is None:
+            new_subtitle_list.add_subtitles(subtitles)
+            new_subtitle_list.add_subtitles(new_subtitles)
+            return new_subtitle_list
+        new_subtitles.extend(subtitle for subtitle, flag
+                             in zip(subtitles, uncut) if flag)
+        new_subtitle_list.add_subtitles(subtitle for subtitle, flag
+                                        in zip(subtitles, uncut) if not flag)
+        new_subtitle_list.add_subtitles(
+                          SubtitleList.project_subtitles(new_subtitles, cuts))
         return new_subtitle_list
 
-    def generate_script(self, subtitle_list, cuts=None):
+    @staticmethod
+    def run_many(submods, subtitle_file, subtitle_loader, cuts=None,
+                 return_exceptions=False):
+        """Runs multiple Submod-scripts for the same subtitle file.
+
+        Like run, but the subtitle file subtitle_file (a path or an
+        IngestedFile) is read, hashed and loaded (using
+        subtitle_loader) only once. Each script is applied to a
+        copy-on-write view of the loaded SubtitleList: only the
+        subtitles changed by a script are copied, the unchanged
+        subtitles are shared by all returned SubtitleLists (so these
+        should not be modified in place).
+
+        cuts is only used for the scripts with timings for the uncut
+        video.
+
+        Returns the list of the new SubtitleLists (in the order of
+        submods). If return_exceptions is True, an Exception raised
+        for a script (for example due to a wrong checksum) is returned
+        in place of its SubtitleList instead of being raised.
+        """
+        subtitle_file = IngestedFile.get(subtitle_file)
+        if cuts is not None:
+            cuts = CutMap.compile(cuts)
+        subtitle_list = None
+        results = []
+        for submod in submods:
+            try:
+                plan = submod.plan
+                sha256 = submod._hash_subtitle_file(subtitle_file).lower()
+                if sha256 != plan.subtitle['sha256']:
+                    raise ValueError(_('The subtitle has a wrong checksum '
+                                       '("{}")!').format(sha256))
+                if subtitle_list is None:
+                    subtitle_list = subtitle_loader(subtitle_file)
+                plan_cuts = cuts if plan.timings_for == 'uncut' else None
+                results.append(submod._apply_plan(plan, subtitle_list,
+                                                  plan_cuts, True))
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                results.append(e)
+        return results
+
+    @staticmethod
+    def compose(first, second, subtitle_file, subtitle_loader, cuts=None):
+        """Composes two Submod-scripts into one equivalent script.
+
+        first must be a Submod-script for the subtitle file
+        subtitle_file (a path or an IngestedFile) and second a Submod-
+        script for the subtitle created by running first. The returned
+        Submod has a script for subtitle_file which creates the same
+        subtitle as running first and then second. Chains of scripts
+        can be composed by composing the result with the next script.
+
+        Moves of overlapping id ranges are combined, updates override
+        earlier changes, removes and adds are mapped to the ids of
+        subtitle_file (for example a subtitle added by first and moved
+        by second becomes a single add).
+
+        The ids of second refer to the subtitle created by first, which
+        depend on the timings of all subtitles. So the scripts are not
+        combined section by section. Instead both plans are applied
+        (without any string parsing) to the SubtitleList of
+        subtitle_file, keeping track of the original ids, and the
+        result is compared to the original SubtitleList like in
+        generate_script.
+
+        subtitle_loader is used like in run. cuts is required if any of
+        the scripts has timings for the uncut video. If cuts is set the
+        composed script has timings for the uncut video (like
+        generate_script). Subtitles that overlap a removed part of the
+        video are projected when the scripts are applied (see run), so
+        in the result of the composed script these may be clipped or
+        split differently than in the result of running both scripts.
+
+        A ValueError/IndexError may be raised, for example if the
+        subtitle file has a wrong checksum or if a subtitle was not
+        found.
+        """
+        first_plan, second_plan = first.plan, second.plan
+        subtitle_file = IngestedFile.get(subtitle_file)
+        sha256 = first._hash_subtitle_file(subtitle_file).lower()
+        if sha256 != first_plan.subtitle['sha256']:
+            raise ValueError(_('The subtitle has a wrong checksum ("{}")!')
+                             .format(sha256))
+        if cuts is not None:
+            cuts = CutMap.compile(cuts)
+        elif 'uncut' in (first_plan.timings_for, second_plan.timings_for):
+            raise ValueError(_('A cutlist is required to compose Submod-'
+                               'scripts with timings for the uncut video!'))
+        orig_subtitle_list = subtitle_loader(subtitle_file)
+        subtitle_list = orig_subtitle_list
+        for plan in (first_plan, second_plan):
+            plan_cuts = cuts if plan.timings_for == 'uncut' else None
+            subtitle_list = first._apply_plan(plan, subtitle_list, plan_cuts,
+                                              True)
+        submod = Submod(subtitle_file, orig_subtitle_list,
+                        first_plan.subtitle.get('encoding'))
+        submod.generate_script(subtitle_list, cuts)
+        return submod
+
+    def generate_script(self, subtitle_list, cuts=None, align=False,
+                        align_tolerance=2000):
         """Generate a Submod-script by comparing the original and new
         SubtitleList.
         
@@ -396,94 +582,96 @@ class Submod(object):
         If cuts is set the Submod-script will export timings that will
         fit to the uncut video instead of the cut video. Thus the
         Submod-script can be used for a different cutlist as well.
+
+        By default the subtitles are compared by their original ids
+        (orig_id), so subtitle_list must have been created by editing
+        the original SubtitleList. If align is True the subtitles are
+        matched by their content instead (see SubtitleAligner), so
+        subtitle_list may be loaded from a different file, for example
+        a re-issued subtitle file with inserted subtitles.
+        align_tolerance is the maximum time difference (in
+        milliseconds) of matching subtitles.
         """
         if self._orig_subtitle_list is None:
             raise ValueError(_('Failed to generate Subdmod-script: the original'
                                ' subtitle list is missing)!'))
-        # We use OrderedDicts so that the exported JSON will be more
-        # readable.
-        script = OrderedDict([
-            ('subtitle', OrderedDict([
-                ('filename', self._subtitle_filename.decode('utf-8')),
-                ('sha256', self._subtitle_sha256)])
-            ),
-            ('timings-for', 'original'),
-            ('move', []),
-            ('update', []),
-            ('remove', []),
-            ('add', []),
-        ])
+        subtitle = {'filename': self._subtitle_filename.decode('utf-8'),
+                    'sha256': self._subtitle_sha256}
         if self._orig_subtitle_encoding is not None:
-            script['subtitle']['encoding'] = self._orig_subtitle_encoding
+            subtitle['encoding'] = self._orig_subtitle_encoding
+        plan = SubmodPlan(subtitle)
         if cuts is not None:
-            script['timings-for'] = 'uncut'
+            plan.timings_for = 'uncut'
+            cuts = CutMap.compile(cuts)
         # Check which subtitles were moved (start/end-time changed by
         # the same amount, anything else unchanged) and which subtitles
         # were updated or added.
-        # New subtiles will be added directly to the script. Moved and
+        # New subtiles will be added directly to the plan. Moved and
         # updated subtitles will be added to tmp-dicts which will be
         # used to merge subtitles with the same changes and successive
         # ids. For example if subtitle 1 and subtitle 2 were both moved
         # by 100 ms then only one move-item will be generated for the
         # id "1-2".
-        tmp_updates_by_id = {} # {id: {start:X, end:Y, text:Z}, ...}
+        # All times of the plan are whole milliseconds, like the times
+        # of a loaded script.
+        tmp_updates_by_id = {} # {id: (start, end, text), ...}
         tmp_moves_by_id = {} # {id: time_diff, ...}
-        processed_ids = [] # moves/updates were generated for these ids
-        offset = 0.0
-        for subtitle in subtitle_list:
-            if subtitle.orig_id is None:
+        processed_ids = set() # moves/updates were generated for these ids
+        # Pairs of the original and the new subtitle. The orig_*-values
+        # of the original subtitle are compared to the new subtitle.
+        if align:
+            pairs = SubtitleAligner.align(self._orig_subtitle_list,
+                                          subtitle_list, align_tolerance)
+        else:
+            pairs = [(subtitle if subtitle.orig_id is not None else None,
+                      subtitle) for subtitle in subtitle_list]
+        # The timings of all subtitles are mapped to the uncut video at
+        # once (see CutMap.get_uncut_offsets).
+        starts = [subtitle.start for __, subtitle in pairs]
+        ends = [subtitle.end for __, subtitle in pairs]
+        if cuts is not None:
+            offsets = cuts.get_uncut_offsets(starts)
+            ends = cuts.to_uncut_many(ends)
+        else:
+            offsets = [0.0] * len(pairs)
+        export_starts = [self._get_export_millis(start + offset)
+                         for start, offset in zip(starts, offsets)]
+        export_ends = [self._get_export_millis(end) for end in ends]
+        for n, (orig, subtitle) in enumerate(pairs):
+            if orig is None:
                 # subtitle was not in file before
-                script['add'].append(OrderedDict([
-                    ('start', self._get_export_time(subtitle.start, cuts)),
-                    ('end', self._get_export_time(subtitle.end, cuts)),
-                    ('text', subtitle.text.decode('utf-8'))
-                ]))
+                plan.adds.append((export_starts[n], export_ends[n],
+                                  subtitle.text))
             else:
                 # subtitle was in file before --> update or move
-                processed_ids.append(subtitle.orig_id)
-                start_diff = subtitle.start - subtitle.orig_start
-                end_diff = subtitle.end - subtitle.orig_end
-                text_changed = (subtitle.text != subtitle.orig_text)
+                processed_ids.add(orig.orig_id)
+                start_diff = subtitle.start - orig.orig_start
+                end_diff = subtitle.end - orig.orig_end
+                text_changed = (subtitle.text != orig.orig_text)
                 # TODO handle optional coordinates (X1, X2, Y1, Y2)
                 if (text_changed or start_diff != end_diff):
                     # text has changed or start/end time were changed
                     # differently (--> update instead of move)
-                    tmp_update = []
-                    if start_diff != 0:
-                        tmp_update.append(('start',
-                                  self._get_export_time(subtitle.start, cuts),))
-                    if end_diff != 0:
-                        tmp_update.append(('end',
-                                    self._get_export_time(subtitle.end, cuts),))
-                    if text_changed:
-                        tmp_update.append(
-                                       ('text', subtitle.text.decode('utf-8'),))
-                    tmp_updates_by_id[subtitle.orig_id] = tmp_update
+                    tmp_updates_by_id[orig.orig_id] = (
+                        export_starts[n] if start_diff != 0 else None,
+                        export_ends[n] if end_diff != 0 else None,
+                        subtitle.text if text_changed else None)
                 elif start_diff != 0:
-                    if cuts is not None:
-                        offset = self._get_export_offset(subtitle.start, cuts)
-                            
-                    tmp_moves_by_id[subtitle.orig_id] = (start_diff, offset)
+                    tmp_moves_by_id[orig.orig_id] = (start_diff, offsets[n])
                 # else: subtitle has not changed
         # Updates
         todo_update_list = self._merge_by_ids(tmp_updates_by_id)
-        for id1, id2, tmp_update in todo_update_list:
-            new_update = [('id', self._get_ids_for_script(id1, id2))]
-            new_update.extend(tmp_update)
-            script['update'].append(OrderedDict(new_update))
+        for id1, id2, (start, end, text) in todo_update_list:
+            plan.updates.append((id1, id2, start, end, text))
         # Moves
         todo_move_list = self._merge_by_ids(tmp_moves_by_id)
         for id1, id2, (time_diff, offset) in todo_move_list:
             # NOTE: We do not pass  cuts here since the offset was 
             #       already calculated based on the cuts (s.a.)
-            move_by = self._get_export_time(offset + time_diff)
-            sign = '+' if move_by[0]!='-' else ''
-            script['move'].append(OrderedDict([
-                ('id', self._get_ids_for_script(id1, id2)),
-                ('by', sign + move_by)
-            ]))
+            plan.moves.append((id1, id2,
+                               self._get_export_millis(offset + time_diff)))
         # Check which subtitles of the original SubtitleList were
-        # removed. Then add remove-items to the script (merging
+        # removed. Then add remove-items to the plan (merging
         # successive ids).
         tmp_removes_by_id = {} # {id: None, ...}
         for subtitle in self._orig_subtitle_list:
@@ -492,81 +680,122 @@ class Submod(object):
                 tmp_removes_by_id[subtitle.orig_id] = None
         todo_remove_list = self._merge_by_ids(tmp_removes_by_id)
         for id1, id2, __ in todo_remove_list:
-            script['remove'].append(OrderedDict([
-                ('id', self._get_ids_for_script(id1, id2))
-            ]))
-        self.script = script
-
-    def convert_origial_to_uncut(self, path_, subtitle_loader, cuts):
+            plan.removes.append((id1, id2))
+        self.plan = plan
+
+    def invert(self, result_file, result_list, orig_subtitle_list=None):
+        """Returns a new Submod with the inverse Submod-script: running
+        it on the subtitle created by this script restores the original
+        subtitle.
+
+        result_file is the saved subtitle file (a path or an
+        IngestedFile) and result_list the SubtitleList returned by run
+        (its subtitles still know their original ids and values). If
+        the script removes subtitles, the original SubtitleList is
+        needed to restore their content, otherwise a ValueError is
+        raised. The same applies to scripts with timings for the uncut
+        video, since subtitles moved into a removed part of the video
+        are dropped when the script is run with cuts (see run).
+
+        The inverse script is created in a single pass over result_list
+        using the id ranges of the compiled plan. The SubtitleLists are
+        not compared again.
+        """
+        plan = self.plan
+        if plan.removes and orig_subtitle_list is None:
+            raise ValueError(_('The original subtitle list is required to '
+                               'invert a Submod-script that removes '
+                               'subtitles!'))
+        if plan.timings_for == 'uncut' and orig_subtitle_list is None:
+            raise ValueError(_('The original subtitle list is required to '
+                               'invert a Submod-script with timings for the '
+                               'uncut video!'))
+        result_file = IngestedFile.get(result_file)
+        __, filename = path.split(result_file.path)
+        inverse = SubmodPlan({'filename': filename.decode('utf-8'),
+                              'sha256': result_file.sha256})
+        tmp_updates_by_id = {} # {id: (start, end, text), ...}
+        tmp_moves_by_id = {} # {id: time_diff, ...}
+        tmp_removes_by_id = {} # {id: None, ...}
+        kept_ids = set()
+        for id_, subtitle in enumerate(result_list, 1):
+            if subtitle.orig_id is None:
+                # added by the script (or further part of a subtitle
+                # split at a cut) --> remove
+                tmp_removes_by_id[id_] = None
+                continue
+            kept_ids.add(subtitle.orig_id)
+            # The subtitle file contains whole milliseconds only (the
+            # times of a script run with cuts may have fractions).
+            start = long(round(subtitle.start))
+            end = long(round(subtitle.end))
+            start_diff = subtitle.orig_start - start
+            end_diff = subtitle.orig_end - end
+            text_changed = (subtitle.text != subtitle.orig_text)
+            if text_changed or start_diff != end_diff:
+                tmp_updates_by_id[id_] = (
+                    subtitle.orig_start if start_diff != 0 else None,
+                    subtitle.orig_end if end_diff != 0 else None,
+                    subtitle.orig_text if text_changed else None)
+            elif start_diff != 0:
+                tmp_moves_by_id[id_] = start_diff
+        for id1, id2, by in self._merge_by_ids(tmp_moves_by_id):
+            inverse.moves.append((id1, id2, by))
+        for id1, id2, (start, end, text) in self._merge_by_ids(
+                                                            tmp_updates_by_id):
+            inverse.updates.append((id1, id2, start, end, text))
+        for id1, id2, __ in self._merge_by_ids(tmp_removes_by_id):
+            inverse.removes.append((id1, id2))
+        # Removed subtitles (and subtitles dropped at cuts) --> add
+        # The orig_*-values are used, since run may have modified the
+        # subtitles of orig_subtitle_list.
+        if orig_subtitle_list is not None:
+            for id_, subtitle in enumerate(orig_subtitle_list, 1):
+                if id_ not in kept_ids:
+                    inverse.adds.append((subtitle.orig_start,
+                                         subtitle.orig_end,
+                                         subtitle.orig_text))
+        submod = Submod()
+        submod.plan = inverse
+        return submod
+
+    def convert_origial_to_uncut(self, subtitle_file, subtitle_loader, cuts):
         """Converts a submod-script with "timings-for" set to "original"
         to a submod-script with "timings-for" set to "uncut". So the
         submod-script can be used with other cutlists, too.
+
+        subtitle_file and subtitle_loader are used like in run.
         """
-        sha256 = self._hash_subtitle_file(path_).lower()
-        if sha256 != self.script['subtitle']['sha256']:
+        plan = self.plan
+        subtitle_file = IngestedFile.get(subtitle_file)
+        sha256 = self._hash_subtitle_file(subtitle_file).lower()
+        if sha256 != plan.subtitle['sha256']:
             raise ValueError(_('The subtitle has a wrong checksum ("{}")!')
                              .format(sha256))
-        subtitle_list = subtitle_loader(path_)
+        cuts = CutMap.compile(cuts)
+        subtitle_list = subtitle_loader(subtitle_file)
         tmp_moves_by_id = {}
-        for move in self.script['move']:
-            by = Time.millis_from_str(move['by'])
-            for i in self._get_valid_ids(subtitle_list, move['id']):
-                offset = self._get_export_offset(
-                                              subtitle_list[i].start + by, cuts)
-                tmp_moves_by_id[subtitle_list[i].orig_id] = (by, offset)
-        self.script['move'] = []
-        # Moves
-        todo_move_list = self._merge_by_ids(tmp_moves_by_id)
-        for id1, id2, (time_diff, offset) in todo_move_list:
-            # NOTE: We do not pass  cuts here since the offset was 
-            #       already calculated based on the cuts (s.a.)
-            move_by = self._get_export_time(offset + time_diff)
-            sign = '+' if move_by[0]!='-' else ''
-            self.script['move'].append(OrderedDict([
-                ('id', self._get_ids_for_script(id1, id2)),
-                ('by', sign + move_by)
-            ]))
-        for update in self.script['update']:
-            if 'start' in update:
-                update['start'] = self._get_export_time(
-                                    Time.millis_from_str(update['start']), cuts)
-            if 'end' in update:
-                update['end'] = self._get_export_time(
-                                      Time.millis_from_str(update['end']), cuts)
-        for add in self.script['add']:
-            add['start'] = self._get_export_time(
-                                       Time.millis_from_str(add['start']), cuts)
-            add['end'] = self._get_export_time(
-                                         Time.millis_from_str(add['end']), cuts)
-        self.script['timings-for'] = 'uncut'
-
-    def _get_export_offset(self, millis, cuts):
-        offset = 0.0
-        for start, duration, cut in cuts:
-            offset = start - (cut - duration)
-            if millis < long(cut):
-                return offset
-        return offset
-
-    def _get_export_time(self, millis, cuts=None):
-        if cuts is None:
-            return Time.format(millis)
-        offset = self._get_export_offset(millis, cuts)
-        return Time.format(offset + millis)
-
-    def _get_run_offset(self, millis, cuts):
-        offset = 0.0
-        for start, duration, cut in cuts:
-            offset = start - (cut - duration)
-            if millis < start+duration:
-                return offset
-        return offset
-
-    def _get_run_time(self, millis, cuts=None):
-        if cuts is None:
-            return millis
-        offset = self._get_run_offset(millis, cuts)
-        return millis - offset
+        for first, last, by in plan.moves:
+            i, j = self._get_id_range(subtitle_list, first, last)
+            for subtitle in subtitle_list[i:j]:
+                offset = cuts.get_uncut_offset(subtitle.start + by)
+                tmp_moves_by_id[subtitle.orig_id] = (by, offset)
+        moves = [(id1, id2, self._get_export_millis(uncut_offset + time_diff))
+                 for id1, id2, (time_diff, uncut_offset)
+                 in self._merge_by_ids(tmp_moves_by_id)]
+        to_uncut = lambda millis: (None if millis is None
+                                   else self._get_export_millis(millis, cuts))
+        updates = [(first, last, to_uncut(start), to_uncut(end), text)
+                   for first, last, start, end, text in plan.updates]
+        adds = [(to_uncut(start), to_uncut(end), text)
+                for start, end, text in plan.adds]
+        self.plan = SubmodPlan(plan.subtitle, 'uncut', moves, updates,
+                               plan.removes, adds)
+
+    def _get_export_millis(self, millis, cuts=None):
+        if cuts is not None:
+            millis = cuts.to_uncut(millis)
+        return long(round(millis))
 
     def _merge_by_ids(self, vals_by_id):
         """Merges successive ids with the same value.
@@ -591,8 +820,57 @@ class Submod(object):
                 merged_ids.append([id_, id_, new_value])
         return merged_ids
 
-    def save_script(self, path_):
+    def save_script(self, path_, binary=False):
+        """Saves the Submod-script to the file path_. If binary is True
+        the compact binary format is used (see SubmodBinary), otherwise
+        JSON.
+        """
+        if binary:
+            with open(path_, 'wb') as f:
+                f.write(SubmodBinary.dumps(self.plan))
+            return
         with codecs.open(path_, 'w', encoding='utf8') as f:
             json.dump(self.script, f, indent=2, sort_keys=False,
                       ensure_ascii=False)
 
+
+if __name__ == '__main__':
+    # Benchmark: generate a Submod-script for a subtitle file with 100k
+    # subtitles. Exits with a non-zero status if the budget (in seconds,
+    # may be passed as first argument) is exceeded.
+    import gettext
+    import sys
+    import tempfile
+    import time
+    from subsynco.media.subtitle import SubtitleFile
+    gettext.install('subsynco', unicode=1)
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    count = 100000
+    orig_subtitle_list = SubtitleList()
+    for i in xrange(count):
+        orig_subtitle_list.add_subtitle(Subtitle(i*2000, i*2000+1500,
+                                                 'Subtitle {}'.format(i+1),
+                                                 i+1))
+    fd, subtitle_file = tempfile.mkstemp(suffix='.srt')
+    os.close(fd)
+    try:
+        SubtitleFile.save_srt(subtitle_file, orig_subtitle_list)
+        subtitle_list = copy.deepcopy(orig_subtitle_list)
+        for i, subtitle in enumerate(subtitle_list):
+            if i % 3 == 0:
+                subtitle.start += 100
+                subtitle.end += 100
+            elif i % 7 == 0:
+                subtitle.text += ' (modified)'
+        for i in xrange(count-1, 0, -11):
+            subtitle_list.remove_subtitle(i)
+        submod = Submod(subtitle_file, orig_subtitle_list)
+        start = time.time()
+        submod.generate_script(subtitle_list)
+        duration = time.time() - start
+    finally:
+        os.remove(subtitle_file)
+    print('Generated Submod-script for {} subtitles in {:.3f}s (budget: '
+          '{:.3f}s)'.format(count, duration, budget))
+    if duration > budget:
+        sys.exit(1)
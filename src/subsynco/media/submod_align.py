@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+'''
+SubSynco - a tool for synchronizing subtitle files
+Copyright (C) 2015  da-mkay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import bisect
+from subsynco.media.subtitle import SubtitleList
+
+
+class SubtitleAligner(object):
+    """SubtitleAligner matches the subtitles of a new SubtitleList to
+    the subtitles of the original SubtitleList by their content instead
+    of their ids (see Submod.generate_script).
+
+    This is useful if the new subtitles were not created by editing the
+    original subtitle file, for example if a re-issued subtitle file
+    with inserted subtitles (and thus different ids) should be compared
+    to the original one.
+    """
+    @staticmethod
+    def align(orig_subtitle_list, subtitle_list, tolerance=2000):
+        """Returns a list of (orig_subtitle, subtitle)-tuples for all
+        subtitles of subtitle_list. orig_subtitle is the matching
+        subtitle of orig_subtitle_list or None if there is no match.
+        Each original subtitle is matched at most once.
+
+        The subtitles are aligned in two passes, both walking through
+        subtitle_list in order and keeping track of the time difference
+        (drift) of the last match, so that a run of moved subtitles is
+        matched as a whole:
+          1. Subtitles with the same normalized text (without tags,
+             case and repeated whitespace) are matched if the start of
+             the original subtitle, moved by the drift, differs at most
+             by tolerance milliseconds.
+          2. The remaining subtitles (for example subtitles with
+             corrected text) are matched to the remaining original
+             subtitles with the closest start (moved by the drift) if
+             the difference is at most tolerance / 10 milliseconds.
+
+        The texts are hashed (dict-lookups) and the closest start is
+        found by bisection, so the alignment needs O(n log n) time
+        unless lots of subtitles share the same text and start.
+        """
+        orig_subtitles = list(orig_subtitle_list)
+        subtitles = list(subtitle_list)
+        matches = [None] * len(subtitles)
+        used = set()
+        # Pass 1: match by text
+        candidates_by_text = {}
+        for i, orig_subtitle in enumerate(orig_subtitles):
+            key = SubtitleAligner._normalize(orig_subtitle.text)
+            candidates_by_text.setdefault(key, []).append(i)
+        starts_by_text = dict(
+                 (key, [orig_subtitles[i].start for i in candidates])
+                 for key, candidates in candidates_by_text.iteritems())
+        drift = 0
+        for n, subtitle in enumerate(subtitles):
+            key = SubtitleAligner._normalize(subtitle.text)
+            candidates = candidates_by_text.get(key)
+            if candidates is None:
+                continue
+            i = SubtitleAligner._find_closest(starts_by_text[key], candidates,
+                                              used, subtitle.start - drift,
+                                              tolerance)
+            if i is not None:
+                used.add(i)
+                matches[n] = i
+                drift = subtitle.start - orig_subtitles[i].start
+        # Pass 2: match the remaining subtitles by time
+        candidates = [i for i in xrange(len(orig_subtitles)) if i not in used]
+        starts = [orig_subtitles[i].start for i in candidates]
+        drift = 0
+        for n, subtitle in enumerate(subtitles):
+            if matches[n] is not None:
+                drift = subtitle.start - orig_subtitles[matches[n]].start
+                continue
+            i = SubtitleAligner._find_closest(starts, candidates, used,
+                                              subtitle.start - drift,
+                                              tolerance / 10)
+            if i is not None:
+                used.add(i)
+                matches[n] = i
+        return [(None if i is None else orig_subtitles[i], subtitle)
+                for i, subtitle in zip(matches, subtitles)]
+
+    @staticmethod
+    def _normalize(text):
+        if '<' in text:
+            text = SubtitleList._re_tag.sub('', text)
+        return ' '.join(text.split()).lower()
+
+    @staticmethod
+    def _find_closest(starts, candidates, used, millis, tolerance):
+        """Returns the candidate (not in used) whose start is closest to
+        millis, or None if there is no candidate within tolerance.
+        starts must be the sorted starts of the candidates.
+        """
+        k = bisect.bisect_left(starts, millis)
+        best, best_diff = None, None
+        # Walk to the left and to the right of millis, but only as long
+        # as the starts are within the tolerance.
+        for indices in (xrange(k-1, -1, -1), xrange(k, len(starts))):
+            for m in indices:
+                diff = abs(starts[m] - millis)
+                if diff > tolerance:
+                    break
+                if candidates[m] in used:
+                    continue
+                if best_diff is None or diff < best_diff:
+                    best, best_diff = candidates[m], diff
+                break
+        return best
+
+
+if __name__ == '__main__':
+    from subsynco.media.subtitle import Subtitle
+    orig_subtitle_list = SubtitleList()
+    for i, (start, text) in enumerate([(1000, 'Hello'),
+                                       (3000, 'How are you?'),
+                                       (5000, '<i>Fine.</i>'),
+                                       (7000, 'Bye')]):
+        orig_subtitle_list.add_subtitle(Subtitle(start, start+1000, text,
+                                                 i+1))
+    # A re-issued subtitle file with an inserted subtitle: the following
+    # subtitles are moved by 500 ms and one text was corrected.
+    subtitle_list = SubtitleList()
+    for start, text in [(1000, 'Hello'), (2500, 'Inserted'),
+                        (3500, 'How are you?'), (5500, 'fine.'),
+                        (7500, 'Bye!')]:
+        subtitle_list.add_subtitle(Subtitle(start, start+1000, text))
+    # 1 -> Hello
+    # None -> Inserted
+    # 2 -> How are you?
+    # 3 -> fine.
+    # 4 -> Bye!
+    for orig, subtitle in SubtitleAligner.align(orig_subtitle_list,
+                                                subtitle_list):
+        print('{} -> {}'.format(None if orig is None else orig.orig_id,
+                                subtitle.text))
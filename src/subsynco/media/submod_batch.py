@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+'''
+SubSynco - a tool for synchronizing subtitle files
+Copyright (C) 2015  da-mkay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+from __future__ import print_function
+import errno
+import gettext
+import glob
+import multiprocessing
+import os
+import stat
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from os import path
+from subsynco.media.cuts import CutsFile
+from subsynco.media.submod import Submod
+from subsynco.media.submod_binary import SubmodBinary
+from subsynco.media.submod_stream import SubmodStream
+from subsynco.media.subtitle import SubtitleFile
+from subsynco.utils.ingest import IngestedFile
+from subsynco.utils.textfile import TextFile
+
+
+class SubmodBatch(object):
+    """SubmodBatch runs many Submod-scripts without any GUI.
+
+    Each script is paired with its subtitle file using the filename
+    stored in the script (the subtitle file must be located in the
+    script's directory). Scripts with timings for the uncut video are
+    run with the cutlists passed to the constructor or, if these are
+    not set, with the cutlist file next to the subtitle file (same
+    name, extension ".cutlist") if there is one. Multiple cutlists are
+    applied one after the other, for example a broadcast cutlist on
+    top of a distributor cut (see CutMap.compose).
+
+    The scripts are run in a pool of processes. The new subtitle files
+    are written atomically next to the scripts (or into output_dir)
+    using the same naming scheme as ScriptRunDialog.
+    """
+    def __init__(self, processes=None, cutlist_files=None, output_dir=None,
+                 locale_dir=None):
+        self._processes = processes
+        self._cutlist_files = cutlist_files
+        self._output_dir = output_dir
+        self._locale_dir = locale_dir
+
+    @staticmethod
+    def find_scripts(patterns):
+        """Returns the sorted list of Submod-script files for the given
+        list of files, directories and glob patterns. For directories
+        all Submod-scripts (*.submod and binary *.submodb) inside the
+        directory are returned.
+        """
+        script_files = set()
+        for pattern in patterns:
+            if path.isdir(pattern):
+                dir_patterns = [path.join(pattern, '*.submod'),
+                                path.join(pattern, '*.submodb')]
+            else:
+                dir_patterns = [pattern]
+            for dir_pattern in dir_patterns:
+                for file_ in glob.glob(dir_pattern):
+                    if path.isfile(file_):
+                        script_files.add(path.abspath(file_))
+        return sorted(script_files)
+
+    def run(self, script_files, out=sys.stdout):
+        """Runs all Submod-scripts and prints the timing of each job
+        and the overall throughput to out.
+
+        The headers of the scripts are read first (see _load_script).
+        Then the scripts for the same subtitle file are run together in
+        one job, so that the subtitle file is read, hashed and parsed
+        only once.
+
+        Returns the list of results. Each result is a tuple of the
+        script file, the new subtitle file (None on failure), an error
+        message (None on success), the number of subtitles and the
+        duration of the job in seconds (scripts run in the same job
+        share the duration).
+        """
+        results = []
+        start = time.time()
+        pool = multiprocessing.Pool(self._processes, _init_worker,
+                                    (self._locale_dir,))
+        try:
+            scripts_by_subtitle = OrderedDict()
+            for (script_file, encoding, subtitle, timings_for, plan, error,
+                 duration) in pool.imap(_load_script, script_files):
+                if error is not None:
+                    result = (script_file, None, error, 0, duration)
+                    self._print_result(result, out)
+                    results.append(result)
+                    continue
+                # The subtitle file must be in the same directory as
+                # the script.
+                dir_, __ = path.split(script_file)
+                subtitle_file = path.join(dir_, subtitle['filename'])
+                key = (subtitle_file, subtitle.get('encoding'))
+                scripts_by_subtitle.setdefault(key, []).append(
+                                   (script_file, encoding, timings_for, plan))
+            jobs = [(subtitle_file, encoding, scripts, self._cutlist_files,
+                     self._output_dir)
+                    for (subtitle_file, encoding), scripts
+                    in scripts_by_subtitle.iteritems()]
+            for job_results in pool.imap_unordered(_run_job, jobs):
+                for result in job_results:
+                    self._print_result(result, out)
+                    results.append(result)
+        finally:
+            pool.close()
+            pool.join()
+        duration = max(time.time() - start, 1e-6)
+        failed = len([r for r in results if r[2] is not None])
+        count = sum(r[3] for r in results)
+        print(_('{} scripts ({} failed) in {:.3f}s: {:.1f} scripts/s, {:.0f} '
+                'subtitles/s').format(len(results), failed, duration,
+                                      len(results) / duration, count / duration)
+              .encode('utf-8'), file=out)
+        return results
+
+    def _print_result(self, result, out):
+        script_file, new_subtitle_file, error, count, duration = result
+        if error is None:
+            print(_('[ok] {} -> {} ({} subtitles, {:.3f}s)').format(
+                      script_file, new_subtitle_file, count, duration)
+                  .encode('utf-8'), file=out)
+        else:
+            print(_('[failed] {} ({:.3f}s): {}').format(
+                      script_file, duration, error).encode('utf-8'),
+                  file=out)
+
+
+def _init_worker(locale_dir):
+    gettext.install('subsynco', locale_dir, unicode=1, codeset='utf-8')
+
+
+def _load_script(script_file):
+    """Reads a single Submod-script and returns a tuple of the script
+    file, its encoding, its "subtitle" and "timings-for", the
+    SubmodPlan, an error message (None on success) and the duration in
+    seconds. This function is executed in the worker processes, see
+    SubmodBatch.run.
+
+    Binary scripts are loaded completely. Of JSON-scripts only the
+    header is read (see SubmodStream.read_header) and the plan is None:
+    these are applied while they are read in _run_job (see
+    Submod.run_stream), so that the entries of large scripts are
+    neither kept in memory nor passed between the processes.
+    """
+    start = time.time()
+    try:
+        if SubmodBinary.is_binary_file(script_file):
+            submod = Submod()
+            submod.load(script_file, None)
+            plan = submod.plan
+            return (script_file, None, plan.subtitle, plan.timings_for, plan,
+                    None, time.time() - start)
+        encoding = TextFile.detect_encoding(script_file)
+        if encoding is None:
+            raise ValueError(
+                     _('Could not determine encoding of Submod-script!'))
+        with open(script_file, 'rb') as f:
+            subtitle, timings_for = SubmodStream.read_header(f, encoding)
+    except Exception as e:
+        return (script_file, None, None, None, None, unicode(e),
+                time.time() - start)
+    return (script_file, encoding, subtitle, timings_for, None, None,
+            time.time() - start)
+
+
+def _run_job(job):
+    """Runs all Submod-scripts for a single subtitle file. This
+    function is executed in the worker processes, see SubmodBatch.run.
+    """
+    subtitle_file, encoding, scripts, cutlist_files, output_dir = job
+    start = time.time()
+    results = []
+    try:
+        uncut = any(timings_for == 'uncut'
+                    for __, __, timings_for, __ in scripts)
+        ingested_file, encoding, cuts = _load_subtitle(
+                               subtitle_file, encoding, cutlist_files, uncut)
+        # The subtitle file is parsed only once, the scripts do not
+        # change the loaded SubtitleList (see Submod.run_many and
+        # Submod.run_stream).
+        loaded = []
+        def subtitle_loader(f):
+            if not loaded:
+                loaded.append(SubtitleFile.load_srt(f.path, encoding, f.data))
+            return loaded[0]
+        submods = []
+        for __, __, __, plan in scripts:
+            if plan is not None:
+                submod = Submod()
+                submod.plan = plan
+                submods.append(submod)
+        planned_lists = iter(Submod.run_many(submods, ingested_file,
+                                             subtitle_loader, cuts,
+                                             return_exceptions=True))
+        subtitle_lists = []
+        for script_file, script_encoding, timings_for, plan in scripts:
+            if plan is not None:
+                subtitle_lists.append(next(planned_lists))
+                continue
+            try:
+                subtitle_lists.append(Submod.run_stream(
+                         script_file, script_encoding, ingested_file,
+                         subtitle_loader,
+                         cuts if timings_for == 'uncut' else None))
+            except Exception as e:
+                subtitle_lists.append(e)
+    except Exception as e:
+        subtitle_lists = [e] * len(scripts)
+    for (script_file, __, __, __), subtitle_list in zip(scripts,
+                                                         subtitle_lists):
+        if isinstance(subtitle_list, Exception):
+            results.append([script_file, None, unicode(subtitle_list), 0])
+            continue
+        try:
+            dir_, subtitle_filename = path.split(subtitle_file)
+            new_subtitle_file = _save_subtitle(
+                          dir_ if output_dir is None else output_dir,
+                          subtitle_filename, subtitle_list)
+        except Exception as e:
+            results.append([script_file, None, unicode(e), 0])
+            continue
+        results.append([script_file, new_subtitle_file, None,
+                        len(subtitle_list)])
+    duration = (time.time() - start) / len(scripts)
+    return [tuple(result + [duration]) for result in results]
+
+
+def _load_subtitle(subtitle_file, encoding, cutlist_files, uncut):
+    """Reads the subtitle file and loads the cutlists (if uncut is True
+    and a cutlist is available) for _run_job. Multiple cutlists are
+    composed to a single CutMap.
+
+    Returns a tuple of the IngestedFile, the encoding of the subtitle
+    and the cuts (or None).
+    """
+    if not path.isfile(subtitle_file):
+        raise ValueError(_('Could not find subtitle file "{}"!').format(
+                                                                 subtitle_file))
+    # The subtitle file is read only once for checksum, encoding
+    # detection and parsing.
+    ingested_file = IngestedFile(subtitle_file)
+    ingested_file.read()
+    if encoding is None:
+        encoding = ingested_file.detect_encoding()
+    if encoding is None:
+        raise ValueError(_('Could not determine encoding of subtitle file!'))
+    cuts = None
+    if uncut:
+        if not cutlist_files:
+            cutlist_files = [path.splitext(subtitle_file)[0] + '.cutlist']
+            if not path.isfile(cutlist_files[0]):
+                cutlist_files = []
+        for cutlist_file in cutlist_files:
+            cutlist_encoding = TextFile.detect_encoding(cutlist_file)
+            if cutlist_encoding is None:
+                raise ValueError(_('Cutlist encoding could not be detected!'))
+            cutlist = CutsFile.load_cutlist(cutlist_file, cutlist_encoding)
+            cuts = cutlist if cuts is None else cuts.compose(cutlist)
+    return ingested_file, encoding, cuts
+
+
+def _save_subtitle(dir_, subtitle_filename, subtitle_list):
+    """Saves the subtitle list atomically to a new file in dir_.
+
+    Like ScriptRunDialog '_submod' is added to the filename of the
+    original subtitle file (and '.1', '.2', .. if the file already
+    exists). The file name is reserved by creating the file
+    exclusively, so that multiple processes do not write to the same
+    file. The subtitle is written to a temporary file which then
+    replaces the reserved file.
+    """
+    name_parts = subtitle_filename.rsplit('.', 1)
+    name_base = name_parts[0] + '_submod'
+    ext = '.'+name_parts[1] if len(name_parts)==2 else ''
+    new_subtitle_file = path.join(dir_, name_base + ext)
+    c = 0
+    while True:
+        try:
+            fd = os.open(new_subtitle_file, os.O_CREAT | os.O_EXCL, 0o666)
+            os.close(fd)
+            break
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        c += 1
+        new_subtitle_file = path.join(dir_, name_base + '.' + str(c) + ext)
+    fd, tmp_file = tempfile.mkstemp(dir=dir_, suffix='.tmp')
+    os.close(fd)
+    try:
+        SubtitleFile.save_srt(tmp_file, subtitle_list)
+        # mkstemp creates the file for the owner only, the reserved file
+        # has the default permissions (according to the umask).
+        os.chmod(tmp_file, stat.S_IMODE(os.stat(new_subtitle_file).st_mode))
+        if sys.platform == 'win32':
+            # os.rename does not replace existing files on Windows.
+            os.remove(new_subtitle_file)
+        os.rename(tmp_file, new_subtitle_file)
+    except:
+        for file_ in (tmp_file, new_subtitle_file):
+            if path.isfile(file_):
+                os.remove(file_)
+        raise
+    return new_subtitle_file
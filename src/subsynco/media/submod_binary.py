@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+'''
+SubSynco - a tool for synchronizing subtitle files
+Copyright (C) 2015  da-mkay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import binascii
+import struct
+from subsynco.media.submod_plan import SubmodPlan
+
+
+class SubmodBinary(object):
+    """SubmodBinary converts SubmodPlans to and from a compact binary
+    form of Submod-scripts (usually stored in *.submodb-files).
+
+    Layout (all integers are unsigned LEB128-varints, signed integers
+    are zigzag-encoded before):
+
+        magic        "SUBMODB" followed by the format version (1 byte)
+        flags        1 byte: 1 = timings for uncut video,
+                             2 = encoding is set
+        sha256       32 bytes
+        filename     length + utf-8 bytes
+        encoding     length + utf-8 bytes (only if flag 2 is set)
+        counts       number of moves, updates, removes, adds
+        moves        first id, last id - first id, by
+        updates      first id, last id - first id, flags (1 = start,
+                     2 = end, 4 = text), [start], [end], [text length]
+        removes      first id, last id - first id
+        adds         start, end - start, text length
+        texts        utf-8 texts of updates and adds (in that order)
+
+    The first ids, the by-values of the moves and all start-values are
+    stored as signed differences to the previous item of the same
+    section, so that sorted ids and times produce small numbers.
+    """
+    MAGIC = 'SUBMODB'
+    VERSION = 1
+
+    _FLAG_UNCUT = 1
+    _FLAG_ENCODING = 2
+    _FLAG_START = 1
+    _FLAG_END = 2
+    _FLAG_TEXT = 4
+
+    @staticmethod
+    def is_binary(data):
+        """Returns True if data (a string or the beginning of a file)
+        is a binary Submod-script.
+        """
+        return data.startswith(SubmodBinary.MAGIC)
+
+    @staticmethod
+    def is_binary_file(path_):
+        with open(path_, 'rb') as f:
+            return SubmodBinary.is_binary(f.read(len(SubmodBinary.MAGIC)))
+
+    @staticmethod
+    def dumps(plan):
+        """Returns the binary Submod-script for the SubmodPlan plan.
+        """
+        out = bytearray(SubmodBinary.MAGIC)
+        out.append(SubmodBinary.VERSION)
+        encoding = plan.subtitle.get('encoding')
+        flags = 0
+        if plan.timings_for == 'uncut':
+            flags |= SubmodBinary._FLAG_UNCUT
+        if encoding is not None:
+            flags |= SubmodBinary._FLAG_ENCODING
+        out.append(flags)
+        out.extend(binascii.unhexlify(plan.subtitle['sha256']))
+        texts = []
+        _write_str(out, plan.subtitle['filename'].encode('utf-8'))
+        if encoding is not None:
+            _write_str(out, encoding.encode('utf-8'))
+        for section in (plan.moves, plan.updates, plan.removes, plan.adds):
+            _write_uint(out, len(section))
+        prev_first, prev_by = 0, 0
+        for first, last, by in plan.moves:
+            _write_int(out, first - prev_first)
+            _write_uint(out, last - first)
+            _write_int(out, by - prev_by)
+            prev_first, prev_by = first, by
+        prev_first, prev_start = 0, 0
+        for first, last, start, end, text in plan.updates:
+            _write_int(out, first - prev_first)
+            _write_uint(out, last - first)
+            prev_first = first
+            flags = ((SubmodBinary._FLAG_START if start is not None else 0) |
+                     (SubmodBinary._FLAG_END if end is not None else 0) |
+                     (SubmodBinary._FLAG_TEXT if text is not None else 0))
+            out.append(flags)
+            if start is not None:
+                _write_int(out, start - prev_start)
+                prev_start = start
+            if end is not None:
+                _write_int(out, end - (start if start is not None else 0))
+            if text is not None:
+                _write_uint(out, len(text))
+                texts.append(text)
+        prev_first = 0
+        for first, last in plan.removes:
+            _write_int(out, first - prev_first)
+            _write_uint(out, last - first)
+            prev_first = first
+        prev_start = 0
+        for start, end, text in plan.adds:
+            _write_int(out, start - prev_start)
+            _write_int(out, end - start)
+            _write_uint(out, len(text))
+            prev_start = start
+            texts.append(text)
+        out.extend(''.join(texts))
+        return str(out)
+
+    @staticmethod
+    def loads(data):
+        """Returns the SubmodPlan of the binary Submod-script data.
+
+        The plan is validated like a Submod-script in JSON-format (see
+        SubmodPlan.validate). If the data is not a valid binary
+        Submod-script a ValueError is raised (or TypeError, KeyError
+        from the validation).
+        """
+        if not SubmodBinary.is_binary(data):
+            raise ValueError(_('Invalid binary Submod-script!'))
+        pos = len(SubmodBinary.MAGIC)
+        try:
+            version, flags = struct.unpack_from('BB', data, pos)
+            pos += 2
+            if version != SubmodBinary.VERSION:
+                raise ValueError(_('Unsupported binary Submod-script version '
+                                   '({})!').format(version))
+            sha256 = binascii.hexlify(data[pos:pos+32])
+            pos += 32
+            filename, pos = _read_str(data, pos)
+            subtitle = {'filename': filename, 'sha256': sha256.decode('ascii')}
+            if flags & SubmodBinary._FLAG_ENCODING:
+                subtitle['encoding'], pos = _read_str(data, pos)
+            timings_for = ('uncut' if flags & SubmodBinary._FLAG_UNCUT
+                           else 'original')
+            counts = []
+            for __ in xrange(4):
+                count, pos = _read_uint(data, pos)
+                counts.append(count)
+            text_lengths = []
+            moves = []
+            first, by = 0, 0
+            for __ in xrange(counts[0]):
+                delta, pos = _read_int(data, pos)
+                span, pos = _read_uint(data, pos)
+                by_delta, pos = _read_int(data, pos)
+                first += delta
+                by += by_delta
+                moves.append((first, first + span, by))
+            updates = []
+            first, start = 0, 0
+            for __ in xrange(counts[1]):
+                delta, pos = _read_int(data, pos)
+                span, pos = _read_uint(data, pos)
+                first += delta
+                update_flags = ord(data[pos])
+                pos += 1
+                update_start, update_end, update_text = None, None, None
+                if update_flags & SubmodBinary._FLAG_START:
+                    start_delta, pos = _read_int(data, pos)
+                    start += start_delta
+                    update_start = start
+                if update_flags & SubmodBinary._FLAG_END:
+                    duration, pos = _read_int(data, pos)
+                    update_end = duration + (start if update_start is not None
+                                             else 0)
+                if update_flags & SubmodBinary._FLAG_TEXT:
+                    length, pos = _read_uint(data, pos)
+                    text_lengths.append(length)
+                    update_text = len(text_lengths) - 1
+                updates.append([first, first + span, update_start,
+                                update_end, update_text])
+            removes = []
+            first = 0
+            for __ in xrange(counts[2]):
+                delta, pos = _read_int(data, pos)
+                span, pos = _read_uint(data, pos)
+                first += delta
+                removes.append((first, first + span))
+            adds = []
+            start = 0
+            for __ in xrange(counts[3]):
+                start_delta, pos = _read_int(data, pos)
+                duration, pos = _read_int(data, pos)
+                length, pos = _read_uint(data, pos)
+                start += start_delta
+                text_lengths.append(length)
+                adds.append((start, start + duration, len(text_lengths) - 1))
+        except (IndexError, struct.error):
+            raise ValueError(_('Invalid binary Submod-script!'))
+        # Resolve the texts from the text blob.
+        texts = []
+        for length in text_lengths:
+            texts.append(data[pos:pos+length])
+            pos += length
+        if pos != len(data):
+            raise ValueError(_('Invalid binary Submod-script!'))
+        for update in updates:
+            if update[4] is not None:
+                update[4] = texts[update[4]]
+        plan = SubmodPlan(subtitle, timings_for, moves,
+                          [tuple(update) for update in updates], removes,
+                          [(start, end, texts[text])
+                           for start, end, text in adds])
+        plan.validate()
+        return plan
+
+
+def _write_uint(out, value):
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _write_int(out, value):
+    # zigzag-encoding: 0, -1, 1, -2, 2, .. --> 0, 1, 2, 3, 4, ..
+    _write_uint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+
+
+def _write_str(out, value):
+    _write_uint(out, len(value))
+    out.extend(value)
+
+
+def _read_uint(data, pos):
+    value, shift = 0, 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _read_int(data, pos):
+    value, pos = _read_uint(data, pos)
+    return ((value >> 1) if not value & 1 else -((value + 1) >> 1)), pos
+
+
+def _read_str(data, pos):
+    length, pos = _read_uint(data, pos)
+    if pos + length > len(data):
+        raise IndexError()
+    try:
+        return data[pos:pos+length].decode('utf-8'), pos + length
+    except UnicodeDecodeError:
+        raise ValueError(_('Invalid binary Submod-script!'))
@@ -0,0 +1,466 @@
+#!/usr/bin/env python
+'''
+SubSynco - a tool for synchronizing subtitle files
+Copyright (C) 2015  da-mkay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import json
+import re
+from collections import OrderedDict
+from subsynco.utils.textfile import TextFile
+from subsynco.utils.time import Time
+
+
+_RE_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+_RE_TIMINGS_FOR = re.compile(r'^(original|uncut)$')
+_RE_ID_RANGE = re.compile(r'^(\d+)-(\d+)$')
+# Times must be less than 100 hours (two digits for the hours).
+_MAX_MILLIS = 100 * 3600000
+
+
+class SubmodPlan(object):
+    """SubmodPlan is the compiled form of a Submod-script.
+
+    All strings of the script are parsed only once when the plan is
+    compiled, so that running the plan (see Submod.run) does not need
+    to parse any time or id again. The plan consists of:
+
+      subtitle    dict with the "filename", "sha256" and the optional
+                  "encoding" of the subtitle file
+      timings_for "original" or "uncut"
+      moves       list of (first_id, last_id, by)-tuples
+      updates     list of (first_id, last_id, start, end, text)-tuples
+                  where any of start, end and text may be None
+      removes     list of (first_id, last_id)-tuples
+      adds        list of (start, end, text)-tuples
+
+    Ids are 1-based and the last id is included. Times are numbers of
+    milliseconds and texts are utf-8 encoded strings (like the text of
+    a Subtitle).
+
+    A plan is not modified after it was created, thus it may be shared
+    by multiple Submod-objects.
+    """
+    # The keys of a Submod-script whose values are lists of entries.
+    SECTIONS = ('move', 'update', 'remove', 'add')
+
+    def __init__(self, subtitle, timings_for='original', moves=None,
+                 updates=None, removes=None, adds=None):
+        self.subtitle = subtitle
+        self.timings_for = timings_for
+        self.moves = [] if moves is None else moves
+        self.updates = [] if updates is None else updates
+        self.removes = [] if removes is None else removes
+        self.adds = [] if adds is None else adds
+
+    @staticmethod
+    def compile(value):
+        """Validates the JSON-data of a Submod-script and compiles it to
+        a SubmodPlan.
+
+        If validation fails an Exception is raised (ValueError,
+        TypeError, KeyError).
+        """
+        items = _compile_dict(value, _SCRIPT_COMPILERS,
+                              opt_item_compilers=_SCRIPT_OPT_COMPILERS)
+        return SubmodPlan(items['subtitle'],
+                          items.get('timings-for', 'original'),
+                          items['move'], items['update'], items['remove'],
+                          items['add'])
+
+    @staticmethod
+    def compile_item(key, value):
+        """Validates and compiles the value of the key of the JSON-
+        object of a Submod-script, for example the SubmodPlan.subtitle
+        for "subtitle" or the list of moves for "move".
+
+        If validation fails an Exception is raised (ValueError,
+        TypeError, KeyError).
+        """
+        item_compiler = (_SCRIPT_COMPILERS.get(key) or
+                         _SCRIPT_OPT_COMPILERS.get(key))
+        if item_compiler is None:
+            raise ValueError(_('Unknown "{}" in Submod-script!').format(key))
+        return item_compiler(value)
+
+    @staticmethod
+    def compile_entry(section, value):
+        """Validates and compiles a single entry of one of the SECTIONS
+        of a Submod-script, for example a (first_id, last_id, by)-tuple
+        for an entry of "move".
+
+        The times of the entry are kept as strings. These are parsed
+        for many entries at once by compile_times.
+
+        If validation fails an Exception is raised (ValueError,
+        TypeError, KeyError).
+        """
+        return _ENTRY_COMPILERS[section](value)
+
+    @staticmethod
+    def compile_times(section, entries):
+        """Parses the times of the entries of the section (see
+        compile_entry) at once using Time.parse_many and returns the
+        compiled entries.
+
+        If a time is not valid a ValueError is raised.
+        """
+        fields = _TIME_FIELDS[section]
+        if not fields:
+            return entries
+        texts = [entry[k] for entry in entries for k in fields
+                 if entry[k] is not None]
+        try:
+            times = iter(Time.parse_many(texts))
+        except TypeError:
+            # Find the first invalid time for the error message.
+            for text in texts:
+                try:
+                    Time.millis_from_str(text)
+                except TypeError:
+                    raise ValueError(_('Invalid "{}" in Submod-script!')
+                                     .format(text))
+            raise
+        compiled = []
+        for entry in entries:
+            entry = list(entry)
+            for k in fields:
+                if entry[k] is not None:
+                    entry[k] = next(times)
+            compiled.append(tuple(entry))
+        return compiled
+
+    def validate(self):
+        """Validates a plan which was not compiled from a Submod-script
+        (for example a binary Submod-script, see SubmodBinary). The
+        same rules apply as for Submod-scripts, so a plan is valid if
+        and only if its script (see to_script) is valid.
+
+        If validation fails an Exception is raised (ValueError,
+        TypeError, KeyError).
+        """
+        _compile_any_str(self.subtitle['filename'])
+        _compile_sha256(self.subtitle['sha256'])
+        if self.subtitle.get('encoding') is not None:
+            _compile_encoding(self.subtitle['encoding'])
+        if self.timings_for not in ('original', 'uncut'):
+            raise ValueError(_('Invalid "{}" in Submod-script!').format(
+                                                              self.timings_for))
+        for first, last, by in self.moves:
+            _validate_ids(first, last)
+            _validate_millis(by, signed=True)
+        for first, last, start, end, text in self.updates:
+            _validate_ids(first, last)
+            if start is None and end is None and text is None:
+                raise KeyError(_('Missing one of "{}" in Submod-script!')
+                               .format('", "'.join(_UPDATE_ANY_COMPILERS)))
+            for millis in (start, end):
+                if millis is not None:
+                    _validate_millis(millis)
+            if text is not None:
+                _validate_text(text)
+        for first, last in self.removes:
+            _validate_ids(first, last)
+        for start, end, text in self.adds:
+            _validate_millis(start)
+            _validate_millis(end)
+            _validate_text(text)
+
+    def to_script(self):
+        """Returns the Submod-script (JSON-data) of this plan.
+        """
+        # We use OrderedDicts so that the exported JSON will be more
+        # readable.
+        subtitle = OrderedDict([
+            ('filename', self.subtitle['filename']),
+            ('sha256', self.subtitle['sha256'])])
+        if self.subtitle.get('encoding') is not None:
+            subtitle['encoding'] = self.subtitle['encoding']
+        script = OrderedDict([
+            ('subtitle', subtitle),
+            ('timings-for', self.timings_for),
+            ('move', []),
+            ('update', []),
+            ('remove', []),
+            ('add', []),
+        ])
+        move_bys = Time.format_many([by for __, __, by in self.moves])
+        for (first, last, by), move_by in zip(self.moves, move_bys):
+            sign = '+' if move_by[0]!='-' else ''
+            script['move'].append(OrderedDict([
+                ('id', SubmodPlan.format_ids(first, last)),
+                ('by', sign + move_by)
+            ]))
+        # Format all timings of a section at once (see
+        # Time.format_many), None stays None.
+        update_times = iter(Time.format_many([time for update in self.updates
+                                              for time in update[2:4]
+                                              if time is not None]))
+        for first, last, start, end, text in self.updates:
+            update = [('id', SubmodPlan.format_ids(first, last))]
+            if start is not None:
+                update.append(('start', next(update_times)))
+            if end is not None:
+                update.append(('end', next(update_times)))
+            if text is not None:
+                update.append(('text', text.decode('utf-8')))
+            script['update'].append(OrderedDict(update))
+        for first, last in self.removes:
+            script['remove'].append(OrderedDict([
+                ('id', SubmodPlan.format_ids(first, last))
+            ]))
+        add_times = iter(Time.format_many([time for add in self.adds
+                                           for time in add[:2]]))
+        for start, end, text in self.adds:
+            script['add'].append(OrderedDict([
+                ('start', next(add_times)),
+                ('end', next(add_times)),
+                ('text', text.decode('utf-8'))
+            ]))
+        return script
+
+    @staticmethod
+    def format_ids(first, last):
+        """Returns the id-value for a Submod-script, for example 3 or
+        "3-6".
+        """
+        return first if first == last else '{}-{}'.format(first, last)
+
+
+def _compile_any_str(value):
+    if not isinstance(value, unicode):
+        raise TypeError(_('Invalid Submod-script! Expected string, but foun'
+                          'd:\n{}').format(json.dumps(value)))
+    return value
+
+
+def _compile_str(value, regex):
+    """Checks that value is a string matching the compiled regex and
+    returns the match-groups.
+    """
+    _compile_any_str(value)
+    match = regex.match(value)
+    if match is None:
+        raise ValueError(_('Invalid "{}" in Submod-script!').format(value))
+    return match.groups()
+
+
+def _compile_text(value):
+    return _compile_any_str(value).encode('utf-8')
+
+
+def _compile_time(value):
+    # The time is parsed later (see SubmodPlan.compile_times), only the
+    # sign is checked here.
+    if _compile_any_str(value)[:1] in ('+', '-'):
+        raise ValueError(_('Invalid "{}" in Submod-script!').format(value))
+    return value
+
+
+def _compile_signed_time(value):
+    if _compile_any_str(value)[:1] not in ('+', '-'):
+        raise ValueError(_('Invalid "{}" in Submod-script!').format(value))
+    return value
+
+
+def _compile_id(value):
+    """Returns the (first_id, last_id)-tuple for the id value, for
+    example (3, 3) for 3 and (3, 6) for "3-6".
+    """
+    if isinstance(value, int) or isinstance(value, long):
+        return value, value
+    groups = _compile_str(value, _RE_ID_RANGE)
+    first, last = long(groups[0]), long(groups[1])
+    if first >= last:
+        raise ValueError(_('Invalid ids in Submod-script!'))
+    return first, last
+
+
+def _validate_ids(first, last):
+    """Checks the ids of a plan like _compile_id checks the id value of
+    a Submod-script.
+    """
+    for id_ in (first, last):
+        if not isinstance(id_, int) and not isinstance(id_, long):
+            raise ValueError(_('Invalid ids in Submod-script!'))
+    if first != last and not 0 <= first < last:
+        raise ValueError(_('Invalid ids in Submod-script!'))
+
+
+def _validate_millis(millis, signed=False):
+    """Checks that the time of a plan can be written as (signed) time
+    string (see SubmodPlan.compile_times).
+    """
+    if (not isinstance(millis, int) and not isinstance(millis, long) or
+            abs(millis) >= _MAX_MILLIS or (millis < 0 and not signed)):
+        raise ValueError(_('Invalid "{}" in Submod-script!').format(millis))
+
+
+def _validate_text(text):
+    try:
+        text.decode('utf-8')
+    except (AttributeError, UnicodeDecodeError):
+        raise TypeError(_('Invalid Submod-script! Expected string, but foun'
+                          'd:\n{}').format(repr(text)))
+
+
+def _compile_timings_for(value):
+    return _compile_str(value, _RE_TIMINGS_FOR)[0]
+
+
+def _compile_sha256(value):
+    _compile_str(value, _RE_SHA256)
+    return value
+
+
+def _compile_encoding(value):
+    _compile_any_str(value)
+    if value not in TextFile.get_available_encodings():
+        raise TypeError(_('Invalid encoding ({}) in Submod-script!').format(
+                                                                     value))
+    return value
+
+
+def _compile_subtitle(value):
+    return _compile_dict(value, _SUBTITLE_COMPILERS,
+                         opt_item_compilers=_SUBTITLE_OPT_COMPILERS)
+
+
+def _compile_move_item(value):
+    items = _compile_dict(value, _MOVE_COMPILERS)
+    first, last = items['id']
+    return first, last, items['by']
+
+
+def _compile_update_item(value):
+    # id is required, but we need only one of start, end or text
+    items = _compile_dict(value, _ID_COMPILERS, _UPDATE_ANY_COMPILERS)
+    first, last = items['id']
+    return (first, last, items.get('start'), items.get('end'),
+            items.get('text'))
+
+
+def _compile_remove_item(value):
+    return _compile_dict(value, _ID_COMPILERS)['id']
+
+
+def _compile_add_item(value):
+    items = _compile_dict(value, _ADD_COMPILERS)
+    return items['start'], items['end'], items['text']
+
+
+def _compile_section(section, value):
+    return SubmodPlan.compile_times(section,
+                                    _compile_list(value,
+                                                  _ENTRY_COMPILERS[section]))
+
+
+def _compile_list(value, item_compiler):
+    """Checks that the given value is a list and compiles each list
+    item using the given item_compiler.
+    """
+    if not isinstance(value, list):
+        raise TypeError(_('Invalid Submod-script! Expected array, but found'
+                          ':\n{}').format(json.dumps(value)))
+    return [item_compiler(item) for item in value]
+
+
+def _compile_dict(value, item_compilers, any_item_compilers={},
+                  opt_item_compilers={}):
+    """Checks that the given value is a valid dict and returns a new
+    dict with the compiled values.
+
+    The dict is considered to be valid if the following is true:
+      1. item_compilers, any_item_compilers and opt_item_compilers
+         contain the valid keys. Each key of the dict value must be a
+         valid key.
+      2. The dict value must contain all keys of item_compilers.
+      3. The dict value must contain at least one key of
+         any_item_compilers.
+      4. item_compilers, any_item_compilers and opt_item_compilers
+         also contain a compile-function for each valid key. These are
+         used to validate and compile the dict' values.
+    """
+    if not isinstance(value, dict):
+        raise TypeError(_('Invalid Submod-script! Expected object, but foun'
+                          'd:\n{}').format(json.dumps(value)))
+    items = {}
+    for key, v in value.iteritems():
+        item_compiler = (item_compilers.get(key) or
+                         any_item_compilers.get(key) or
+                         opt_item_compilers.get(key))
+        if item_compiler is None:
+            raise ValueError(_('Unknown "{}" in Submod-script!').format(key))
+        items[key] = item_compiler(v)
+    for key in item_compilers:
+        if key not in value:
+            raise KeyError(_('Missing "{}" in Submod-script!').format(key))
+    if len(any_item_compilers) > 0 and len(value) <= len(item_compilers):
+        raise KeyError(_('Missing one of "{}" in Submod-script!').format(
+                                   '", "'.join(any_item_compilers.keys())))
+    return items
+
+
+# The compile-functions for the keys of each object of a Submod-script.
+# These are created only once (instead of each time an object is
+# compiled).
+_ENTRY_COMPILERS = {
+    'move': _compile_move_item,
+    'update': _compile_update_item,
+    'remove': _compile_remove_item,
+    'add': _compile_add_item
+}
+_SCRIPT_COMPILERS = {
+    'subtitle': _compile_subtitle,
+    'move': lambda v: _compile_section('move', v),
+    'update': lambda v: _compile_section('update', v),
+    'remove': lambda v: _compile_section('remove', v),
+    'add': lambda v: _compile_section('add', v)
+}
+# The indices of the times in the compiled entries of each section.
+_TIME_FIELDS = {
+    'move': (2,),
+    'update': (2, 3),
+    'remove': (),
+    'add': (0, 1)
+}
+_SCRIPT_OPT_COMPILERS = {
+    'timings-for': _compile_timings_for
+}
+_SUBTITLE_COMPILERS = {
+    'filename': _compile_any_str,
+    'sha256': _compile_sha256
+}
+_SUBTITLE_OPT_COMPILERS = {
+    'encoding': _compile_encoding
+}
+_MOVE_COMPILERS = {
+    'id': _compile_id,
+    'by': _compile_signed_time
+}
+_ID_COMPILERS = {
+    'id': _compile_id
+}
+_UPDATE_ANY_COMPILERS = {
+    'start': _compile_time,
+    'end': _compile_time,
+    'text': _compile_text
+}
+_ADD_COMPILERS = {
+    'start': _compile_time,
+    'end': _compile_time,
+    'text': _compile_text
+}
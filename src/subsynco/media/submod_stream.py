@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+'''
+SubSynco - a tool for synchronizing subtitle files
+Copyright (C) 2015  da-mkay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import codecs
+import json
+import re
+from subsynco.media.submod_plan import SubmodPlan
+
+
+_RE_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class SubmodStream(object):
+    """SubmodStream reads Submod-scripts (JSON-format) incrementally.
+
+    Unlike json.load the script file is not loaded completely before
+    it is validated. It is read in chunks of CHUNK_SIZE bytes and each
+    entry of the "move", "update", "remove" and "add" sections is
+    validated and compiled (see SubmodPlan) as soon as it was read, so
+    only the current chunk (and the compiled entries) must be kept in
+    memory. If an entry is invalid, the Exception names the section,
+    the number of the entry and its position (line and column) in the
+    script file.
+
+    Other than for json.load, each key of the script may occur only
+    once and a single JSON-value (an entry of a section) may not be
+    larger than MAX_VALUE_SIZE characters.
+    """
+    CHUNK_SIZE = 64 * 1024
+    MAX_VALUE_SIZE = 1024 * 1024
+    # Maximum number of entries yielded at once, see iter_script.
+    BATCH_SIZE = 1000
+
+    @staticmethod
+    def iter_script(file_, encoding):
+        """Reads the Submod-script from the file object file_ (opened in
+        binary mode) using the given encoding.
+
+        Yields a (key, value)-tuple for each key of the script in the
+        order of the script file. value is the compiled value (see
+        SubmodPlan.compile_item) for "subtitle" and "timings-for". For
+        the sections the compiled entries are yielded in lists of up
+        to BATCH_SIZE entries, so a section may be yielded multiple
+        times (but at least once, even if it is empty).
+
+        If the script is not valid an Exception is raised (ValueError,
+        TypeError, KeyError) as soon as the invalid part was read.
+        """
+        reader = _JsonReader(file_, encoding, SubmodStream.CHUNK_SIZE,
+                             SubmodStream.MAX_VALUE_SIZE)
+        if reader.peek() != '{':
+            # Let SubmodPlan raise the usual error.
+            SubmodPlan.compile(reader.read_value())
+        reader.read_delimiter('{')
+        keys = set()
+        delimiter = '}' if reader.peek() == '}' else ','
+        while delimiter == ',':
+            offset = reader.mark()
+            key = reader.read_value()
+            if not isinstance(key, unicode):
+                raise _invalid_json(*reader.position(offset))
+            if key in keys:
+                raise ValueError(_('Duplicate "{}" in Submod-script!').format(
+                                                                       key))
+            keys.add(key)
+            reader.read_delimiter(':')
+            if key in SubmodPlan.SECTIONS and reader.peek() == '[':
+                for entries in SubmodStream._iter_entries(reader, key):
+                    yield key, entries
+            else:
+                offset = reader.mark()
+                value = reader.read_value()
+                try:
+                    value = SubmodPlan.compile_item(key, value)
+                except (ValueError, TypeError, KeyError) as e:
+                    line, column = reader.position(offset)
+                    raise _add_position(e, _('"{}" at line {}, column {}')
+                                        .format(key, line, column))
+                yield key, value
+            delimiter = reader.read_delimiter(',', '}')
+        if delimiter == '}' and not keys:
+            reader.read_delimiter('}')
+        if reader.peek() != '':
+            raise _invalid_json(*reader.position())
+        for key in ('subtitle',) + SubmodPlan.SECTIONS:
+            if key not in keys:
+                raise KeyError(_('Missing "{}" in Submod-script!').format(key))
+
+    @staticmethod
+    def read_header(file_, encoding):
+        """Reads the "subtitle" and "timings-for" of the Submod-script
+        from the file object file_ (see iter_script) and returns them as
+        tuple ("original" if "timings-for" is not set).
+
+        Reading stops as soon as both were read, so only the start of
+        the scripts saved by Submod.save_script is read. The part of
+        the script that was read is validated like in iter_script.
+        """
+        subtitle = None
+        timings_for = None
+        for key, value in SubmodStream.iter_script(file_, encoding):
+            if key == 'subtitle':
+                subtitle = value
+            elif key == 'timings-for':
+                timings_for = value
+            if subtitle is not None and timings_for is not None:
+                break
+        return subtitle, 'original' if timings_for is None else timings_for
+
+    @staticmethod
+    def _iter_entries(reader, section):
+        reader.read_delimiter('[')
+        entries = []
+        index = 0
+        delimiter = ']' if reader.peek() == ']' else ','
+        while delimiter == ',':
+            offset = reader.mark()
+            value = reader.read_value()
+            index += 1
+            try:
+                entries.append(SubmodPlan.compile_entry(section, value))
+            except (ValueError, TypeError, KeyError) as e:
+                line, column = reader.position(offset)
+                raise _add_position(e, _('entry {} of "{}" at line {}, column'
+                                         ' {}').format(index, section, line,
+                                                       column))
+            if len(entries) >= SubmodStream.BATCH_SIZE:
+                yield SubmodStream._compile_times(section, entries, index)
+                entries = []
+            delimiter = reader.read_delimiter(',', ']')
+        if index == 0:
+            reader.read_delimiter(']')
+        yield SubmodStream._compile_times(section, entries, index)
+
+    @staticmethod
+    def _compile_times(section, entries, index):
+        """Parses the times of the entries of the section at once (see
+        SubmodPlan.compile_times). index is the number of entries of the
+        section that were read.
+        """
+        try:
+            return SubmodPlan.compile_times(section, entries)
+        except ValueError:
+            # Find the entry with the invalid time for the error message
+            # (its line and column are not known anymore).
+            first = index - len(entries) + 1
+            for n, entry in enumerate(entries):
+                try:
+                    SubmodPlan.compile_times(section, [entry])
+                except ValueError as e:
+                    raise _add_position(e, _('entry {} of "{}"').format(
+                                                          first + n, section))
+            raise
+
+    @staticmethod
+    def load(file_, encoding):
+        """Reads the Submod-script from the file object file_ (see
+        iter_script) and returns the SubmodPlan.
+        """
+        items = {'timings-for': 'original'}
+        for section in SubmodPlan.SECTIONS:
+            items[section] = []
+        for key, value in SubmodStream.iter_script(file_, encoding):
+            if key in SubmodPlan.SECTIONS:
+                items[key].extend(value)
+            else:
+                items[key] = value
+        return SubmodPlan(items['subtitle'], items['timings-for'],
+                          items['move'], items['update'], items['remove'],
+                          items['add'])
+
+
+class _JsonReader(object):
+    """_JsonReader reads single JSON-values and characters from a file
+    object. Only a small part of the file is kept in memory.
+    """
+    def __init__(self, file_, encoding, chunk_size, max_value_size):
+        self._file = file_
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json_decoder = json.JSONDecoder()
+        self._chunk_size = chunk_size
+        self._max_value_size = max_value_size
+        self._buf = u''
+        self._pos = 0
+        # The number of characters that were dropped from _buf.
+        self._offset = 0
+        self._eof = False
+        # The line number of the first character of _buf and the index
+        # of the start of that line in _buf (may be negative).
+        self._line = 1
+        self._line_start = 0
+
+    def _fill(self):
+        """Drops the consumed characters of the buffer and appends the
+        next chunk of the file. Returns False at the end of the file.
+        """
+        if self._eof:
+            return False
+        consumed = self._buf[:self._pos]
+        newline = consumed.rfind('\n')
+        if newline >= 0:
+            self._line += consumed.count('\n')
+            self._line_start = newline + 1 - self._pos
+        else:
+            self._line_start -= self._pos
+        self._buf = self._buf[self._pos:]
+        self._offset += self._pos
+        self._pos = 0
+        data = self._file.read(self._chunk_size)
+        if data:
+            self._buf += self._decoder.decode(data)
+        else:
+            self._buf += self._decoder.decode('', True)
+            self._eof = True
+        return True
+
+    def mark(self):
+        """Skips whitespace and returns the offset of the next character
+        which may be passed to position later.
+        """
+        self.peek()
+        return self._offset + self._pos
+
+    def position(self, offset=None):
+        """Returns the (line, column)-tuple of the current position or
+        of the offset (see mark) if it was not dropped from the buffer
+        yet.
+        """
+        pos = self._pos if offset is None else offset - self._offset
+        line = self._line + self._buf.count('\n', 0, pos)
+        newline = self._buf.rfind('\n', 0, pos)
+        line_start = self._line_start if newline < 0 else newline + 1
+        return line, pos - line_start + 1
+
+    def peek(self):
+        """Skips whitespace and returns the next character ('' at the
+        end of the file).
+        """
+        while True:
+            self._pos = _RE_WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return u''
+
+    def read_delimiter(self, *delimiters):
+        """Skips whitespace and reads the next character which must be
+        one of delimiters. Returns the character.
+        """
+        c = self.peek()
+        if c not in delimiters:
+            raise _invalid_json(*self.position())
+        self._pos += 1
+        return c
+
+    def read_value(self):
+        """Reads the next JSON-value. The buffer is filled until the
+        value is complete or MAX_VALUE_SIZE is exceeded.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buf,
+                                                           self._pos)
+            except ValueError:
+                end = None
+            # A number at the end of the buffer might be incomplete.
+            if end is not None and (end < len(self._buf) or self._eof):
+                self._pos = end
+                return value
+            if (len(self._buf) - self._pos > self._max_value_size or
+                    not self._fill()):
+                raise _invalid_json(*self.position())
+
+
+def _invalid_json(line, column):
+    return ValueError(_('Invalid JSON in Submod-script at line {}, column {}'
+                        '!').format(line, column))
+
+
+def _add_position(e, position):
+    """Returns a copy of the Exception e whose message is extended by
+    position.
+    """
+    message = e.args[0] if e.args else u''
+    return type(e)(u'{} ({})'.format(message, position))
@@ -19,16 +19,21 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import bisect
 import codecs
+import copy
+import heapq
+import math
 import re
 import sys
+from subsynco.media.cuts import CutMap
+from subsynco.media.styled_text import StyledText
 from subsynco.utils.textfile import TextFile
 from subsynco.utils.time import Time
 
 
 class SubtitleFile(object):
     @staticmethod
-    def load_srt(path, encoding):
-        return SrtFile(path).load(encoding)
+    def load_srt(path, encoding, data=None):
+        return SrtFile(path).load(encoding, data)
 
     @staticmethod
     def save_srt(path, subtitle_list):
@@ -44,16 +49,24 @@ class SrtFile(object):
             r'(\d{2}):([0-5]\d):([0-5]\d),(\d{3})'
             r'( X1:(\d+) X2:(\d+) Y1:(\d+) Y2:(\d+))?$')
 
-    def load(self, enc):
+    def load(self, enc, data=None):
+        """Load the SubtitleList from the file.
+
+        If the content of the file was already read it can be passed as
+        data, so that the file is not read again.
+        """
         subtitle_list = SubtitleList()
-        with codecs.open(self._path, 'r', encoding=enc) as f:
-            text = f.read().encode('utf-8')
-            i = 0
-            lines = re.split(r'\r?\n', text)
-            while i<len(lines):
-                i, subtitle = self._get_next_sub(lines, i)
-                subtitle_list.add_subtitle(subtitle)
-            return subtitle_list
+        if data is None:
+            with codecs.open(self._path, 'r', encoding=enc) as f:
+                text = f.read().encode('utf-8')
+        else:
+            text = data.decode(enc).encode('utf-8')
+        i = 0
+        lines = re.split(r'\r?\n', text)
+        while i<len(lines):
+            i, subtitle = self._get_next_sub(lines, i)
+            subtitle_list.add_subtitle(subtitle)
+        return subtitle_list
             
     def _get_next_sub(self, lines, i):
         l = lines[i].strip()
@@ -99,21 +112,24 @@ class SrtFile(object):
     def save(self, subtitle_list):
         # TODO maybe support other encodings for destination file
         # TODO handle optional coordinates (X1, X2, Y1, Y2)
+        subtitles = list(subtitle_list)
+        starts = Time.format_many([sub.start for sub in subtitles], True)
+        ends = Time.format_many([sub.end for sub in subtitles], True)
         with codecs.open(self._path, 'w', encoding='utf8') as f:
-            sub_counter = 0
-            for subtitle in subtitle_list:
-                sub_counter += 1
+            for sub_counter, subtitle in enumerate(subtitles):
                 sub = '{0}\r\n{1} --> {2}\r\n{3}\r\n\r\n'.format(
-                    sub_counter,
-                    Time.format(subtitle.start, True),
-                    Time.format(subtitle.end, True),
+                    sub_counter + 1,
+                    starts[sub_counter],
+                    ends[sub_counter],
                     subtitle.text
                 )
                 f.write(sub.decode('utf-8'))
 
 
 class SubtitleList(object):
-   
+
+    _re_tag = re.compile(r'<[^>]*>')
+
     def __init__(self):
         self._subtitles = []
 
@@ -122,6 +138,16 @@ class SubtitleList(object):
         self._subtitles.insert(i, subtitle)
         return i
 
+    def add_subtitles(self, subtitles):
+        """Add multiple subtitles at once.
+
+        The result is the same as calling add_subtitle for each
+        subtitle, but the list is sorted only once (which is nearly
+        linear if the subtitles are already mostly ordered).
+        """
+        self._subtitles.extend(subtitles)
+        self._subtitles.sort()
+
     def remove_subtitle(self, i):
         self._subtitles.pop(i)
 
@@ -232,6 +258,174 @@ class SubtitleList(object):
         millis_new = frame_old / fpms_to
         return millis_new
 
+    def fix_timings(self, max_cps=None, min_gap=0):
+        """Fix the end-times of the subtitles in a single forward sweep.
+
+        Each subtitle that is displayed too short to be read with at
+        most max_cps characters per second is extended. Afterwards the
+        end-time is trimmed so that there is a gap of at least min_gap
+        milliseconds to the start-time of the next subtitle, which also
+        resolves overlapping subtitles. A subtitle is never extended
+        beyond that limit. If the gap does not fit, the subtitle is only
+        trimmed to end at the start of the next subtitle. Subtitles that
+        start at the same time (for example stacked dialog lines) are
+        trimmed to the next subtitle starting later, so no subtitle
+        becomes invisible.
+
+        Only end-times are changed, so only stacked subtitles may change
+        their order; these are sorted by their new end-times. Returns
+        the indices of the changed and of the reordered subtitles.
+        """
+        changed = []
+        subtitles = self._subtitles
+        count = len(subtitles)
+        # Stacked subtitles are at the indices stack_start to j-1, j is
+        # the index of the next subtitle starting later.
+        stack_start = 0
+        j = 0
+        for i, subtitle in enumerate(subtitles):
+            new_end = subtitle.end
+            if max_cps:
+                min_end = subtitle.start + long(math.ceil(
+                               self._count_chars(subtitle.text)*1000.0/max_cps))
+                new_end = max(new_end, min_end)
+            if i == j:
+                stack_start = i
+                while j < count and subtitles[j].start == subtitle.start:
+                    j += 1
+            if j < count:
+                next_start = subtitles[j].start
+                limit = next_start - min_gap
+                if new_end > limit:
+                    if limit > subtitle.start:
+                        new_end = limit
+                    else:
+                        new_end = min(new_end, next_start)
+            if new_end != subtitle.end:
+                subtitle.end = new_end
+                changed.append(i)
+            if i == j - 1 and stack_start < i:
+                stack = subtitles[stack_start:j]
+                sorted_stack = sorted(stack)
+                if sorted_stack != stack:
+                    subtitles[stack_start:j] = sorted_stack
+                    while changed and changed[-1] >= stack_start:
+                        changed.pop()
+                    changed.extend(xrange(stack_start, j))
+        return changed
+
+    @staticmethod
+    def merge(subtitle_lists, offsets=None):
+        """Merge multiple SubtitleLists into a new SubtitleList.
+
+        offsets may be a list of milliseconds (one for each
+        SubtitleList) which are added to the timings of the subtitles of
+        the corresponding SubtitleList.
+
+        The subtitles are copied (the passed SubtitleLists remain
+        unchanged) and merged using a k-way merge. Subtitles with equal
+        timings keep the order of the passed SubtitleLists.
+        """
+        if offsets is None:
+            offsets = [0] * len(subtitle_lists)
+        iterables = [SubtitleList._copy_subtitles(subtitle_list, offset)
+                     for subtitle_list, offset in zip(subtitle_lists, offsets)]
+        merged_list = SubtitleList()
+        merged_list._subtitles = list(heapq.merge(*iterables))
+        return merged_list
+
+    @staticmethod
+    def _copy_subtitles(subtitle_list, offset):
+        for subtitle in subtitle_list:
+            yield Subtitle(subtitle.start + offset, subtitle.end + offset,
+                           subtitle.text)
+
+    def split(self, boundaries, rebase=False):
+        """Split the SubtitleList at the given time boundaries (in
+        milliseconds, sorted ascending) into len(boundaries)+1 new
+        SubtitleLists.
+
+        Each subtitle is put into the SubtitleList of the part that
+        contains its start-time. If rebase is True the timings of each
+        part are shifted so that they are relative to the part's start
+        boundary.
+
+        The subtitles are copied, the SubtitleList remains unchanged.
+        """
+        parts = []
+        i = 0
+        part_start = 0
+        for boundary in list(boundaries) + [None]:
+            if boundary is None:
+                j = len(self._subtitles)
+            else:
+                # A subtitle with an end-time of -1 is lower than any
+                # other subtitle having the same start-time.
+                j = bisect.bisect_left(self._subtitles,
+                                       Subtitle(boundary, -1), i)
+            offset = -part_start if rebase else 0
+            part = SubtitleList()
+            part._subtitles = list(self._copy_subtitles(self._subtitles[i:j],
+                                                        offset))
+            parts.append(part)
+            i = j
+            part_start = boundary
+        return parts
+
+    def split_at_cuts(self, cuts, rebase=False):
+        """Split the SubtitleList at the cut positions of the given
+        cuts (see Cutlist.load). The last cut position is ignored since
+        it is the end of the video.
+        """
+        return self.split([cut for start, duration, cut in cuts[:-1]], rebase)
+
+    def project_to_cuts(self, cuts):
+        """Returns a new SubtitleList with the subtitles of this
+        SubtitleList (timings for the uncut video) projected to the cut
+        video (see project_subtitles).
+
+        The subtitles are copied (including their orig_*-values), the
+        SubtitleList remains unchanged.
+        """
+        projected_list = SubtitleList()
+        projected_list.add_subtitles(SubtitleList.project_subtitles(
+                          [copy.copy(subtitle) for subtitle in self._subtitles],
+                          cuts))
+        return projected_list
+
+    @staticmethod
+    def project_subtitles(subtitles, cuts):
+        """Projects the subtitles (timings for the uncut video) to the
+        cut video using the CutMap (or list of cuts) cuts, see
+        CutMap.project: a subtitle that overlaps a removed part of the
+        video is clipped, a subtitle that spans a removed part is split
+        into one subtitle per kept part (with the same text) and a
+        subtitle inside of a removed part is dropped.
+
+        The timings of the passed subtitles are changed. The first part
+        of a subtitle is the subtitle itself, further parts are new
+        Subtitles. Returns the list of projected subtitles (unordered).
+        """
+        projected = []
+        parts_list = CutMap.compile(cuts).project((subtitle.start,
+                                                   subtitle.end)
+                                                  for subtitle in subtitles)
+        for subtitle, parts in zip(subtitles, parts_list):
+            for n, (start, end) in enumerate(parts):
+                if n == 0:
+                    subtitle.start, subtitle.end = start, end
+                    projected.append(subtitle)
+                else:
+                    projected.append(Subtitle(start, end, subtitle.text))
+        return projected
+
+    def _count_chars(self, text):
+        """Returns the number of visible characters of a subtitle's text
+        (ignoring format tags and line breaks).
+        """
+        return len(self._re_tag.sub('', text.replace('\r\n', '').replace('\n',
+                                                          '')).decode('utf-8'))
+
     def __iter__(self):
         return iter(self._subtitles)
 
@@ -258,6 +452,17 @@ class Subtitle(object):
         self.end = end
         self.text = text
 
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, text):
+        # The text is parsed whenever it is set (when the subtitle is
+        # loaded or edited), so that reading styled_text never parses.
+        self._text = text
+        self.styled_text = StyledText(text)
+
     # __lt__, __eq__ handle overlapping subtitles:
     #
     # e1: |----|            |----|          |--------|      |---|
@@ -287,5 +492,19 @@ if __name__ == '__main__':
     print(sub.get_subtitle(2500))
     print(sub.get_next_closest_subtitle(0))
 
+    sub = SubtitleList()
+    sub.add_subtitle(Subtitle(1000, 3000, '- Hi!'))
+    sub.add_subtitle(Subtitle(1000, 3000, '- Hello!'))
+    sub.add_subtitle(Subtitle(2950, 4000, 'Test3'))
+    sub.add_subtitle(Subtitle(3900, 5000, 'Test4'))
+    sub.add_subtitle(Subtitle(4900, 5000, 'Dialog with more text!'))
+    sub.add_subtitle(Subtitle(4900, 7000, 'Dialog'))
+    # [0, 1, 2, 3, 4, 5]
+    print(sub.fix_timings(max_cps=10, min_gap=100))
+    # [<1000, 2850, - Hi!>, <1000, 2850, - Hello!>, <2950, 3800, Test3>,
+    #  <3900, 4800, Test4>, <4900, 7000, Dialog>,
+    #  <4900, 7100, Dialog with more text!>]
+    print(list(sub))
+
     print('Reading subtitle...')
     SrtFile('example.srt').load('latin1')
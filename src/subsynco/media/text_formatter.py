@@ -17,19 +17,10 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
-from gi.repository import GLib
-
-import re
+from subsynco.media.styled_text import StyledText
 
 
 class TextFormatter(object):
-    def __init__(self):
-        self._brace_pat = re.compile('[<>]')
-        self._tag_pat = re.compile('(/?u|/?i|/?b|(font( color="?([^"]*)"?)?\s*)'
-                                   '|/font)$', re.IGNORECASE)
-        self._empty_tag_pat = re.compile('(<u></u>|<i></i>|<b></b>|<font( [^>]*'
-                                         ')?></font>|<span( [^>]*)?></span>)')
-
     def fix_format(self, msg, pango_markup=False):
         """Return a fixed version of msg that ensures that the format
         syntax is correct.
@@ -41,99 +32,63 @@ class TextFormatter(object):
         these characters will be escaped. Moreover <font>-tags will be
         converted to <span>-tags so that the string can be used where
         pango markup is required and other tags would lead to an error.
+
+        See StyledText, which should be used to render a text more than
+        once.
         """
-        if pango_markup:
-            txt_wrap = lambda x: GLib.markup_escape_text(x)
-            font_tag = 'span'
-            font_color_attr = 'foreground'
-        else:
-            txt_wrap = lambda x: x
-            font_tag = 'font'
-            font_color_attr = 'color'
-    
-        new_msg = ''
-        brace_opened = False
-        opened_tags = []
-        pos = 0
-        while True:
-            brace_match = self._brace_pat.search(msg, pos)
-            if not brace_match:
-                if brace_opened:
-                    # There was a single '<': keep it
-                    new_msg += txt_wrap('<')
-                new_msg += txt_wrap(msg[pos:])
-                while opened_tags:
-                    tag = opened_tags.pop()[0]
-                    new_msg += '</'+(font_tag if tag=='font' else tag)+'>'
-                break
-            brace = brace_match.group()
-            if brace == '<':
-                if brace_opened:
-                    # There was already a single '<': keep it
-                    new_msg += txt_wrap('<')
-                new_msg += txt_wrap(msg[pos:brace_match.start()])
-                pos = brace_match.end()
-                brace_opened = True
-            elif brace == '>':
-                tag = msg[pos:brace_match.start()]
-                pos = brace_match.end()
-                if brace_opened:
-                    brace_opened = False
-                    tag_match = self._tag_pat.match(tag)
-                    if tag_match:
-                        tag = tag.lower()
-                        if tag[0] == '/':
-                            # closing tag
-                            tag = tag[1:]
-                            if not opened_tags:
-                                # missing opening tag
-                                if tag != 'font':
-                                    new_msg = '<'+tag+'>'+new_msg+'</'+tag+'>'
-                                # else: tag is removed since we don't
-                                #       know the color
-                            elif opened_tags[-1][0] != tag:
-                                open_tag_end_pos = opened_tags[-1][1]
-                                # missing opening tag
-                                if tag != 'font':
-                                    new_msg = (new_msg[:open_tag_end_pos]+'<'+
-                                               tag+'>'+
-                                               new_msg[open_tag_end_pos:]+
-                                               '</'+tag+'>')
-                                # else: tag is removed since we don't
-                                #       know the color
-                            else:
-                                new_msg += ('</'+(font_tag if tag=='font' else
-                                                  tag)+'>')
-                                opened_tags.pop() # 
-                        else:
-                            # opening tag
-                            new_msg += ('<'+(font_tag if tag=='font' else tag)+
-                                        '>' if len(tag) < 5 else '<'+font_tag+
-                                        ' '+font_color_attr+'="'+
-                                        tag_match.group(4).strip()+'">')
-                            # (tag, endPos)
-                            opened_tags.append((tag if len(tag) == 1 else
-                                                'font', len(new_msg)))
-                    else:
-                        # unknown tag: keep braces
-                        new_msg += txt_wrap('<'+tag+'>')
-                else:
-                    # missing '<': keep single '>'
-                    new_msg += txt_wrap(tag + '>')
-        
-        # remove empty tags, for example '<i></i>'
-        while True:
-            empty_match = self._empty_tag_pat.search(new_msg)
-            if not empty_match:
-                break
-            new_msg = (new_msg[:empty_match.start()] +
-                       new_msg[empty_match.end():])
+        return StyledText(msg).render(StyledText.PANGO if pango_markup
+                                      else StyledText.SRT)
+
+    @staticmethod
+    def fix_formats(texts):
+        """Fixes the format of all texts (see fix_format, without
+        pango_markup) and returns the list of (index, fixed_text)-tuples
+        for the texts that were changed.
 
-        return new_msg
+        The GUI runs this in a background thread. No worker processes
+        are used: forking the GUI process (with the threads of GLib and
+        GStreamer) is not safe, and for typical subtitle files a pool
+        costs more than it saves.
+        """
+        text_formatter = TextFormatter()
+        fixes = []
+        for i, text in enumerate(texts):
+            new_text = text_formatter.fix_format(text)
+            if new_text != text:
+                fixes.append((i, new_text))
+        return fixes
+
+
+def _benchmark():
+    """Prints the throughput of fix_format for typical and large cues.
+    """
+    import timeit
+    text_formatter = TextFormatter()
+    cues = [
+        ('plain cue', 'Hello, how are you?\r\nFine, thanks.'),
+        ('formatted cue', '<i>Hello, <b>how</b> are you?</i>\r\n'
+                          '<font color="red">Fine</font>, thanks.'),
+        ('karaoke cue', ''.join('<font color="#{:06x}">syl{} </font>'.format(
+                                        i * 4097, i) for i in xrange(2000))),
+        ('unbalanced cue', 'text</i>' * 2000 + '<i><b>' * 2000),
+        ('empty tags', '<i><b></b></i>' * 2000),
+    ]
+    for name, msg in cues:
+        for pango_markup in (False, True):
+            number = max(1, 200000 / len(msg))
+            seconds = min(timeit.repeat(lambda: text_formatter.fix_format(
+                                         msg, pango_markup), number=number,
+                                        repeat=3)) / number
+            print '{:<15} pango_markup={!s:<5} {:>10.1f} cues/s {:>8.2f} MB/s'\
+                .format(name, pango_markup, 1 / seconds,
+                        len(msg) / seconds / 1e6)
 
 
 if __name__ == '__main__':
     import sys
+    if '--benchmark' in sys.argv:
+        _benchmark()
+        sys.exit()
     pango_markup = False
     if len(sys.argv)>1:
         pango_markup = True
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+'''
+SubSynco - a tool for synchronizing subtitle files
+Copyright (C) 2015  da-mkay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import hashlib
+import json
+import os
+import threading
+from os import path
+from subsynco.utils.lru_cache import LruCache
+
+
+class HashCache(object):
+    """HashCache remembers the SHA-256 checksums of files.
+
+    An entry is identified by the real path of the file and is only
+    valid as long as the size, the modification time (in nanoseconds)
+    and the inode of the file are unchanged. The cache holds up to
+    MAX_ENTRIES entries in memory and may be loaded from and saved to a
+    small JSON index file (like Settings) so that it survives restarts.
+    """
+    MAX_ENTRIES = 512
+    BLOCK_SIZE = 64 * 1024
+
+    def __init__(self):
+        # The first HashCache()-call will invoke __init__. Since the
+        # name "HashCache" will be overwritten (see end of file) further
+        # HashCache()-calls will invoke __call__ instead which returns
+        # the singleton instance.
+        self._cache = LruCache(self.MAX_ENTRIES)
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        return self
+
+    def load(self, file_):
+        if not path.exists(file_):
+            return
+        with open(file_) as f:
+            try:
+                json_data = json.load(f)
+            except ValueError:
+                return
+        if not isinstance(json_data, list):
+            return
+        with self._lock:
+            for entry in json_data:
+                try:
+                    realpath, size, mtime_ns, inode, digest = entry
+                except (TypeError, ValueError):
+                    continue
+                self._cache.set(realpath, ((size, mtime_ns, inode), digest))
+
+    def save(self, file_):
+        with self._lock:
+            json_data = [[realpath, signature[0], signature[1], signature[2],
+                          digest]
+                         for realpath, (signature, digest)
+                         in self._cache.items()]
+        dir_, filename = path.split(file_)
+        if not path.exists(dir_):
+            os.makedirs(dir_)
+        with open(file_, 'w') as f:
+            json.dump(json_data, f)
+
+    def get_sha256(self, file_, data=None, stat=None):
+        """Returns the hex digest of the SHA-256 checksum of the file
+        file_.
+
+        If data is specified it must be the content of the file and it
+        is hashed instead of reading the file again; stat may then be
+        the os.stat-result taken when the content was read. Without
+        data the file is read in blocks of BLOCK_SIZE bytes. The
+        checksum is only computed if the file is not in the cache or
+        has changed.
+        """
+        if stat is None:
+            stat = os.stat(file_)
+        realpath = path.realpath(file_)
+        signature = HashCache._get_signature(stat)
+        with self._lock:
+            entry = self._cache.get(realpath)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        if data is not None:
+            digest = hashlib.sha256(data).hexdigest()
+        else:
+            digest = HashCache._hash_file(file_)
+        with self._lock:
+            self._cache.set(realpath, (signature, digest))
+        return digest
+
+    def invalidate(self, file_):
+        with self._lock:
+            self._cache.invalidate(path.realpath(file_))
+
+    @staticmethod
+    def _get_signature(stat):
+        # Python 2 has no st_mtime_ns, so we compute it from the float.
+        # That's fine since we only compare it with itself.
+        mtime_ns = getattr(stat, 'st_mtime_ns', None)
+        if mtime_ns is None:
+            mtime_ns = long(round(stat.st_mtime * 1000000000))
+        return (stat.st_size, mtime_ns, stat.st_ino)
+
+    @staticmethod
+    def _hash_file(file_):
+        sha256 = hashlib.sha256()
+        with open(file_, 'rb') as f:
+            while True:
+                block = f.read(HashCache.BLOCK_SIZE)
+                if not block:
+                    break
+                sha256.update(block)
+        return sha256.hexdigest()
+
+
+# HashCache is a singleton, so we create one (!) instance of the
+# HashCache-class and overwrite the name "HashCache" so that it points
+# to that instance.
+HashCache = HashCache()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+'''
+SubSynco - a tool for synchronizing subtitle files
+Copyright (C) 2015  da-mkay
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import os
+from subsynco.utils.hash_cache import HashCache
+from subsynco.utils.textfile import TextFile
+
+
+class IngestedFile(object):
+    """IngestedFile reads a file only once and shares its content.
+
+    The same buffer is used to compute the SHA-256 checksum, to detect
+    the encoding and to parse the file (see SubtitleFile.load_srt),
+    instead of reading the file again for each of these steps.
+
+    The file is read on first access of data. The checksum is looked
+    up in the HashCache first, so if only the checksum is needed and
+    the file did not change, the file is not read at all. If the file
+    is parsed as well, read it before accessing sha256: otherwise the
+    file is read twice and the hashed bytes may differ from the parsed
+    ones.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._stat = None
+        self._sha256 = None
+        self._encoding = None
+        self._encoding_detected = False
+
+    @staticmethod
+    def get(file_):
+        """Returns file_ if it is already an IngestedFile, otherwise the
+        file at the path file_ is used.
+        """
+        if isinstance(file_, IngestedFile):
+            return file_
+        return IngestedFile(file_)
+
+    @property
+    def data(self):
+        """The content of the file (see read).
+        """
+        return self.read()
+
+    def read(self):
+        """Reads the file if that was not done yet and returns its
+        content.
+        """
+        if self._data is None:
+            with open(self.path, 'rb') as f:
+                self._stat = os.fstat(f.fileno())
+                self._data = f.read()
+        return self._data
+
+    @property
+    def sha256(self):
+        """The hex digest of the SHA-256 checksum of the file. If the
+        file was already read, its data is hashed.
+        """
+        if self._sha256 is None:
+            self._sha256 = HashCache().get_sha256(self.path, self._data,
+                                                  self._stat)
+        return self._sha256
+
+    def detect_encoding(self):
+        """Detect the encoding of the file (see
+        TextFile.detect_encoding). The result is cached.
+        """
+        if not self._encoding_detected:
+            self._encoding = TextFile.detect_encoding(self.path, self.data)
+            self._encoding_detected = True
+        return self._encoding
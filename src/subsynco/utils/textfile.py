@@ -25,16 +25,168 @@ if sys.platform == 'win32':
 else:
     import magic
 import codecs
+import io
+import os
 import re
+import threading
+
+
+# libmagic handles must not be shared by threads, so each thread loads
+# its own handle (see TextFile._get_magic).
+_magic_local = threading.local()
+# Bytes that are not plain ASCII text. ESC is included since it starts
+# the escape sequences of the 7-bit ISO-2022 encodings.
+_RE_NON_ASCII = re.compile('[\x1b\x80-\xff]')
+# Bytes that are not 7-bit (see TextFile._detect_blob_encoding).
+_RE_8BIT = re.compile('[\x80-\xff]')
+_RE_UTF8_CONTINUATION = re.compile('^[\x80-\xbf]{1,3}')
+
+_AVAILABLE_ENCODINGS = frozenset([
+    'utf8', 'maccyrillic', 'chinese', 'mskanji', 's_jis', 'cp1140',
+    'euc_jp', 'cp932', 'cp424', 'iso_2022_jp_2004', 'ibm1140',
+    'eucjis2004', 'iso_2022_jp', 'iso_8859_16', 'utf_7', 'macgreek',
+    'cp500', 'eucjp', 'iso_2022_jp_1', '932', 'ibm1026', 'latin3',
+    '936', 'mac_turkish', 'big5hkscs', 'uhc', 'ksc5601', 'ibm424',
+    'mac_latin2', 'euc_jis_2004', 'ibm500', 'cp936', 'cp862', 'latin10',
+    'iso2022_jp_3', 'iso2022_jp_2', 'iso2022_jp_1', 'iso_2022_kr',
+    'maccentraleurope', 'eucjisx0213', 'gbk', 'ibm857', 'iso8859_7',
+    'ibm855', 'euckr', 'l2', 'ibm852', 'ibm850', 'cp950', 'ibm858',
+    'utf_16be', '862', 'iso2022_jp_2004', 'latin', 'gb18030_2000',
+    'sjis', 'iso_2022_jp_2', 'ebcdic_cp_he', 'ibm437', 'csbig5',
+    'cp1361', 'maciceland', 'csptcp154', 'big5', 'sjis2004',
+    'cyrillic_asian', 'l6', 'iso2022jp', 'l7', 'euc_jisx0213', 'l10',
+    'l4', 'macturkish', 'korean', 'shiftjisx0213', 'l5', 'u32',
+    'mac_iceland', 'unicode_1_1_utf_7', 'shift_jisx0213', 'ms950',
+    'utf_32le', 'l3', 'gb2312_1980', 'iso2022_jp', 'hzgb', 'sjisx0213',
+    'ms1361', 'csiso58gb231280', 'l1', 'iso_ir_58', 'u16', 'ms932',
+    's_jisx0213', 'iso8859_4', 'ksx1001', 'euc_kr', 'ks_c_5601', 'u8',
+    'ibm039', 'johab', 'greek8', 'iso8859_6', 'ptcp154', 'iso2022kr',
+    'utf_32_be', 'ms949', 'ibm037', 'ms_kanji', 'cp850', 'shift_jis',
+    'cp852', 'cp855', 'l8', 'cp857', 'cp856', 'cp775', 'iso2022jp_ext',
+    'l9', 'jisx0213', 'hkscs', 'latin_1', 'us_ascii', 'iso_2022_jp_ext',
+    'cp1026', 'cp_is', 'cp1252', 'iso2022jp_1', 'iso2022jp_3',
+    'iso2022jp_2', 'shiftjis', 'utf_32', 'ujis', 'mac_cyrillic',
+    'maclatin2', 'csiso2022kr', 'iso8859_16', '855', '857', '850',
+    'ks_c_5601_1987', '852', 'ms936', 'u7', 'iso_8859_8', '858',
+    'utf_16_be', 'cp1258', 'windows_1258', 'utf_16_le', 'windows_1254',
+    'windows_1255', 'big5_tw', 'windows_1257', 'windows_1250',
+    'windows_1251', 'windows_1252', 'windows_1253', 'hz', 'utf_8',
+    'csshiftjis', 'ibm869', 'ibm866', 'mac_greek', 'ibm864', 'ibm865',
+    'ibm862', 'ibm863', 'ibm860', 'ibm861', 'utf_8_sig', 'iso_8859_1',
+    'ks_x_1001', 'cp949', 'pt154', 'windows_1256', 'utf32', '869',
+    'utf', 'cp_gr', 'hz_gb_2312', '861', '860', '863', 'cp737', '865',
+    'sjis_2004', '866', 'u_jis', 'iso8859_9', 'iso8859_8', 'iso8859_5',
+    'iso2022_kr', 'cp875', 'cp874', 'iso8859_1', 'iso8859_3',
+    'iso8859_2', 'gb18030', 'cp819', 'iso_8859_9', 'euccn',
+    'iso_8859_7', 'iso_8859_6', 'iso_8859_5', 'iso_8859_4',
+    'iso_8859_3', 'iso_8859_2', 'cp1006', 'gb2312', 'shift_jis_2004',
+    'utf_32_le', 'eucgb2312_cn', 'hebrew', 'arabic', 'ascii',
+    'mac_roman', 'iso8859_15', 'iso8859_14', 'hz_gb', 'iso8859_10',
+    'iso8859_13', 'cp720', '950', 'koi8_u', 'utf16', 'utf_16', 'cp869',
+    'iso_8859_15', 'iso_8859_14', 'iso_8859_13', 'iso2022jp_2004',
+    'iso_8859_10', 'cp860', 'cp861', 'ebcdic_cp_be', 'cp863', 'cp864',
+    'cp865', 'cp866', 'cp154', 'iso_2022_jp_3', 'shiftjis2004', '646',
+    'ebcdic_cp_ch', 'cp1255', 'cp1254', 'cp1257', 'cp1256', 'cp1251',
+    'cp1250', 'cp1253', '437', 'cp437', 'ibm775', 'big5_hkscs',
+    'csiso2022jp', 'gb2312_80', 'latin4', 'latin5', 'latin6', 'latin7',
+    'latin1', 'latin2', '949', 'macroman', 'utf_16le', 'cyrillic',
+    'latin8', 'latin9', 'koi8_r', 'greek', '8859', 'cp037', 'euc_cn',
+    'iso2022_jp_ext', 'utf_32be', 'cp858'])
+
 
 class TextFile(object):
+    # Size of the windows at the head, middle and tail of a file which
+    # are used to detect its encoding (see detect_encoding).
+    SAMPLE_SIZE = 4096
+    # Size of the chunks in which the whole file is read if the sample is
+    # ambiguous.
+    CHUNK_SIZE = 64 * 1024
+
+    # Names of latin1/latin2 (see _fix_latin1_latin2).
+    _LATIN1_LATIN2 = frozenset(['latin_1', 'iso_8859_1', 'iso-8859-1',
+                                'iso8859-1', '8859', 'cp819', 'latin',
+                                'latin1', 'L1', 'iso_8859_2', 'iso8859_2',
+                                'iso-8859-2', 'latin2', 'L2'])
+
+    @staticmethod
+    def detect_encoding(file_, data=None):
+        """Detect the encoding of the text file file_.
+
+        If the content of the file was already read it can be passed as
+        data, so that the file is not read again.
+
+        The encoding is detected from a sample of the file: windows of
+        SAMPLE_SIZE bytes at the head, middle and tail of the file which
+        are aligned to line breaks. The rest of the file is only read
+        (in chunks of CHUNK_SIZE bytes) if the sample is ambiguous:
+        - If the sample is pure ASCII, the file is read up to the first
+          chunk that is not, which is used for the detection instead.
+        - If latin1/latin2 was detected, the file is searched for bytes
+          that only exist in cp1252 (see _fix_latin1_latin2).
+        A sample that is valid UTF-8 (and not pure ASCII) is taken as
+        UTF-8 without asking magic/chardet.
+        Files that contain null bytes (for example UTF-16) are always
+        passed completely to magic/chardet.
+        """
+        if data is not None:
+            return TextFile._detect_encoding(io.BytesIO(data), len(data))
+        with open(file_, 'rb') as f:
+            return TextFile._detect_encoding(f, os.fstat(f.fileno()).st_size)
+
     @staticmethod
-    def detect_encoding(file_):
-        blob = open(file_).read()
+    def _detect_encoding(f, size):
+        sample_size = TextFile.SAMPLE_SIZE
+        head = f.read(sample_size)
         # utf8 files with BOM are not correctly detected by
         # magic/chardet --> check manually for BOM
-        if blob.startswith(codecs.BOM_UTF8):
+        if head.startswith(codecs.BOM_UTF8):
             return 'utf-8-sig'
+        if size <= 3 * sample_size or '\0' in head:
+            # The sample would not be much smaller than the file or the
+            # file cannot be split at line breaks (UTF-16, UTF-32).
+            return TextFile._detect_blob_encoding(head + f.read())
+        # The windows end and start at line breaks, so that no multibyte
+        # character is split. Lines that are longer than the sample size
+        # are cut at UTF-8 sequence boundaries instead.
+        windows = [_read_line_end(f, head, sample_size)]
+        for pos in ((size - sample_size) // 2, size - sample_size):
+            f.seek(pos)
+            window = _read_line_end(f, f.read(sample_size), sample_size)
+            newline = window.find('\n')
+            windows.append(window[newline+1:] if newline >= 0 else
+                           _RE_UTF8_CONTINUATION.sub('', window))
+        sample = '\n'.join(windows)
+        # The part of the file before ascii_end is pure ASCII.
+        ascii_end = 0
+        if _RE_NON_ASCII.search(sample) is None:
+            # Search the whole file for the first chunk that is not pure
+            # ASCII.
+            f.seek(0)
+            while True:
+                chunk = f.read(TextFile.CHUNK_SIZE)
+                if not chunk:
+                    return TextFile._detect_blob_encoding(sample)
+                if _RE_NON_ASCII.search(chunk) is not None:
+                    ascii_end = f.tell() - len(chunk)
+                    sample = _read_line_end(f, chunk, sample_size)
+                    break
+        encoding = TextFile._detect_blob_encoding(sample)
+        if encoding in TextFile._LATIN1_LATIN2:
+            # Bytes that only exist in cp1252 may be anywhere in the file.
+            f.seek(ascii_end)
+            for chunk in iter(lambda: f.read(TextFile.CHUNK_SIZE), ''):
+                if TextFile._fix_latin1_latin2(chunk, encoding) == 'cp1252':
+                    return 'cp1252'
+        return encoding
+
+    @staticmethod
+    def _detect_blob_encoding(blob):
+        """Detect the encoding of the text blob (without BOM).
+        """
+        # 7-bit blobs (for example ISO-2022-JP) are always valid UTF-8,
+        # so only blobs with 8-bit bytes are checked.
+        if _RE_8BIT.search(blob) is not None and _is_utf8(blob):
+            return 'utf_8'
         # Detect charset using chardet on windows and magic on other
         # platforms.
         if sys.platform == 'win32':
@@ -44,8 +196,7 @@ class TextFile(object):
             encoding = encoding.replace('-', '_').lower()
             encoding = TextFile._fix_chardet_iso_8859_7(blob, encoding)
         else:
-            m = magic.open(magic.MAGIC_MIME_ENCODING)
-            m.load()
+            m = TextFile._get_magic()
             encoding = m.buffer(blob).replace('-', '_').lower()
         # Try to fix wrong detected encodings
         encoding = TextFile._fix_latin1_latin2(blob, encoding)
@@ -53,6 +204,19 @@ class TextFile(object):
             return encoding
         return None
 
+    @staticmethod
+    def _get_magic():
+        """Returns the libmagic handle of the current thread. Loading the
+        magic database is expensive, so the handle is created only once
+        per thread.
+        """
+        m = getattr(_magic_local, 'handle', None)
+        if m is None:
+            m = magic.open(magic.MAGIC_MIME_ENCODING)
+            m.load()
+            _magic_local.handle = m
+        return m
+
     @staticmethod
     def _fix_chardet_iso_8859_7(blob, detected_encoding):
         """Check if the iso-8859-7 (greek) detected by chardet should be
@@ -98,10 +262,7 @@ class TextFile(object):
         
         Returns 'cp1252' or the passed detected_encoding.
         """
-        if detected_encoding in ['latin_1', 'iso_8859_1', 'iso-8859-1',
-                                 'iso8859-1', '8859', 'cp819', 'latin',
-                                 'latin1', 'L1', 'iso_8859_2', 'iso8859_2',
-                                 'iso-8859-2', 'latin2', 'L2']:
+        if detected_encoding in TextFile._LATIN1_LATIN2:
             unsupported_chars = map(chr, [128, 130, 131, 132, 133, 134, 135,
                                           136, 137, 138, 139, 140, 142, 145,
                                           146, 147, 148, 149, 150, 151, 152,
@@ -114,56 +275,9 @@ class TextFile(object):
 
     @staticmethod
     def get_available_encodings():
-        return ['utf8', 'maccyrillic', 'chinese', 'mskanji', 's_jis', 'cp1140',
-            'euc_jp', 'cp932', 'cp424', 'iso_2022_jp_2004', 'ibm1140',
-            'eucjis2004', 'iso_2022_jp', 'iso_8859_16', 'utf_7', 'macgreek',
-            'cp500', 'eucjp', 'iso_2022_jp_1', '932', 'ibm1026', 'latin3',
-            '936', 'mac_turkish', 'big5hkscs', 'uhc', 'ksc5601', 'ibm424',
-            'mac_latin2', 'euc_jis_2004', 'ibm500', 'cp936', 'cp862', 'latin10',
-            'iso2022_jp_3', 'iso2022_jp_2', 'iso2022_jp_1', 'iso_2022_kr',
-            'maccentraleurope', 'eucjisx0213', 'gbk', 'ibm857', 'iso8859_7',
-            'ibm855', 'euckr', 'l2', 'ibm852', 'ibm850', 'cp950', 'ibm858',
-            'utf_16be', '862', 'iso2022_jp_2004', 'latin', 'gb18030_2000',
-            'sjis', 'iso_2022_jp_2', 'ebcdic_cp_he', 'ibm437', 'csbig5',
-            'cp1361', 'maciceland', 'csptcp154', 'big5', 'sjis2004',
-            'cyrillic_asian', 'l6', 'iso2022jp', 'l7', 'euc_jisx0213', 'l10',
-            'l4', 'macturkish', 'korean', 'shiftjisx0213', 'l5', 'u32',
-            'mac_iceland', 'unicode_1_1_utf_7', 'shift_jisx0213', 'ms950',
-            'utf_32le', 'l3', 'gb2312_1980', 'iso2022_jp', 'hzgb', 'sjisx0213',
-            'ms1361', 'csiso58gb231280', 'l1', 'iso_ir_58', 'u16', 'ms932',
-            's_jisx0213', 'iso8859_4', 'ksx1001', 'euc_kr', 'ks_c_5601', 'u8',
-            'ibm039', 'johab', 'greek8', 'iso8859_6', 'ptcp154', 'iso2022kr',
-            'utf_32_be', 'ms949', 'ibm037', 'ms_kanji', 'cp850', 'shift_jis',
-            'cp852', 'cp855', 'l8', 'cp857', 'cp856', 'cp775', 'iso2022jp_ext',
-            'l9', 'jisx0213', 'hkscs', 'latin_1', 'us_ascii', 'iso_2022_jp_ext',
-            'cp1026', 'cp_is', 'cp1252', 'iso2022jp_1', 'iso2022jp_3',
-            'iso2022jp_2', 'shiftjis', 'utf_32', 'ujis', 'mac_cyrillic',
-            'maclatin2', 'csiso2022kr', 'iso8859_16', '855', '857', '850',
-            'ks_c_5601_1987', '852', 'ms936', 'u7', 'iso_8859_8', '858',
-            'utf_16_be', 'cp1258', 'windows_1258', 'utf_16_le', 'windows_1254',
-            'windows_1255', 'big5_tw', 'windows_1257', 'windows_1250',
-            'windows_1251', 'windows_1252', 'windows_1253', 'hz', 'utf_8',
-            'csshiftjis', 'ibm869', 'ibm866', 'mac_greek', 'ibm864', 'ibm865',
-            'ibm862', 'ibm863', 'ibm860', 'ibm861', 'utf_8_sig', 'iso_8859_1',
-            'ks_x_1001', 'cp949', 'pt154', 'windows_1256', 'utf32', '869',
-            'utf', 'cp_gr', 'hz_gb_2312', '861', '860', '863', 'cp737', '865',
-            'sjis_2004', '866', 'u_jis', 'iso8859_9', 'iso8859_8', 'iso8859_5',
-            'iso2022_kr', 'cp875', 'cp874', 'iso8859_1', 'iso8859_3',
-            'iso8859_2', 'gb18030', 'cp819', 'iso_8859_9', 'euccn',
-            'iso_8859_7', 'iso_8859_6', 'iso_8859_5', 'iso_8859_4',
-            'iso_8859_3', 'iso_8859_2', 'cp1006', 'gb2312', 'shift_jis_2004',
-            'utf_32_le', 'eucgb2312_cn', 'hebrew', 'arabic', 'ascii',
-            'mac_roman', 'iso8859_15', 'iso8859_14', 'hz_gb', 'iso8859_10',
-            'iso8859_13', 'cp720', '950', 'koi8_u', 'utf16', 'utf_16', 'cp869',
-            'iso_8859_15', 'iso_8859_14', 'iso_8859_13', 'iso2022jp_2004',
-            'iso_8859_10', 'cp860', 'cp861', 'ebcdic_cp_be', 'cp863', 'cp864',
-            'cp865', 'cp866', 'cp154', 'iso_2022_jp_3', 'shiftjis2004', '646',
-            'ebcdic_cp_ch', 'cp1255', 'cp1254', 'cp1257', 'cp1256', 'cp1251',
-            'cp1250', 'cp1253', '437', 'cp437', 'ibm775', 'big5_hkscs',
-            'csiso2022jp', 'gb2312_80', 'latin4', 'latin5', 'latin6', 'latin7',
-            'latin1', 'latin2', '949', 'macroman', 'utf_16le', 'cyrillic',
-            'latin8', 'latin9', 'koi8_r', 'greek', '8859', 'cp037', 'euc_cn',
-            'iso2022_jp_ext', 'utf_32be', 'cp858']
+        """Returns the frozenset of the names of all supported encodings.
+        """
+        return _AVAILABLE_ENCODINGS
 
     @staticmethod
     def get_available_encodings_with_title():
@@ -462,3 +576,43 @@ class TextFile(object):
             #[_('utf8 [all languages]'), 'utf_8'],
             [_('utf_8_sig [all languages]'), 'utf_8_sig']
         ]
+
+
+def _read_line_end(f, data, size):
+    """Appends the rest of the current line of f (at most size bytes)
+    to data. If the line is longer, an incomplete UTF-8 sequence at the
+    end is cut off.
+    """
+    line = f.readline(size)
+    data += line
+    if len(line) < size or line.endswith('\n'):
+        return data
+    # Find the start of the last sequence (at most 3 continuation bytes).
+    i = len(data) - 1
+    while i > 0 and len(data) - i < 4 and '\x80' <= data[i] <= '\xbf':
+        i -= 1
+    lead = ord(data[i])
+    if lead >= 0xf0:
+        length = 4
+    elif lead >= 0xe0:
+        length = 3
+    elif lead >= 0xc0:
+        length = 2
+    else:
+        length = 1
+    return data[:i] if length > len(data) - i else data
+
+
+def _is_utf8(blob):
+    """Checks if blob is valid UTF-8. The blob is decoded in slices, so
+    that an invalid byte near the start is found without decoding the
+    whole blob.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for i in xrange(0, len(blob), TextFile.SAMPLE_SIZE):
+            decoder.decode(blob[i:i+TextFile.SAMPLE_SIZE])
+        decoder.decode('', True)
+    except UnicodeDecodeError:
+        return False
+    return True
@@ -20,29 +20,59 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import re
 
 class Time(object):
+    """Time converts timings (milliseconds) from/to strings of the form
+    hh:mm:ss.iii (or hh:mm:ss,iii as used by SRT-files).
+
+    format_many and parse_many convert whole lists of timings at once,
+    which is much faster than calling format/millis_from_str for each
+    timing, so they should be used when writing/reading files.
+    """
+    _re_time = re.compile(r'^([+-]?)(\d{2}):([0-5]\d):([0-5]\d)\.(\d{3})$')
+    _templates = {
+        False: '%s%02d:%02d:%02d.%03d',
+        True: '%s%02d:%02d:%02d,%03d',
+    }
+
     @staticmethod
     def format(millis, comma=False):
-        millis = long(round(millis, 0))
-        pre = ''
+        millis = long(round(millis))
+        sign = ''
         if millis < 0:
-            pre = '-'
+            sign = '-'
             millis = - millis
-        hours = millis / 3600000
-        millis -= hours * 3600000
-        minutes = millis / 60000
-        millis -= minutes * 60000
-        seconds = millis / 1000
-        millis = millis - seconds * 1000
-        if comma:
-            time_format = '{0}{1:0>2}:{2:0>2}:{3:0>2},{4:0>3}'
-        else:
-            time_format = '{0}{1:0>2}:{2:0>2}:{3:0>2}.{4:0>3}'
-        return time_format.format(pre, hours, minutes, seconds, millis)
-    
+        seconds, millis = divmod(millis, 1000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return Time._templates[comma] % (sign, hours, minutes, seconds,
+                                         millis)
+
+    @staticmethod
+    def format_many(millis_list, comma=False):
+        """Returns the list of formatted timings (see format) for the
+        iterable of timings millis_list.
+        """
+        # Same as format, but inlined and with local names since a
+        # function call per timing is more expensive than the
+        # formatting itself.
+        template = Time._templates[comma]
+        result = []
+        append = result.append
+        for millis in millis_list:
+            millis = long(round(millis))
+            if millis < 0:
+                sign = '-'
+                millis = - millis
+            else:
+                sign = ''
+            seconds, millis = divmod(millis, 1000)
+            minutes, seconds = divmod(seconds, 60)
+            hours, minutes = divmod(minutes, 60)
+            append(template % (sign, hours, minutes, seconds, millis))
+        return result
+
     @staticmethod
     def millis_from_str(text):
-        regex = re.compile(r'^([+-]?)(\d{2}):([0-5]\d):([0-5]\d)\.(\d{3})$')
-        match = regex.match(text)
+        match = Time._re_time.match(text)
         if (match is None):
             raise TypeError(_('"{}" is not a time. Failed to determine number '
                             'of milliseconds.').format(text))
@@ -51,7 +81,25 @@ class Time(object):
         millis = (- millis) if match.group(1) == '-' else millis
         return millis
 
+    @staticmethod
+    def parse_many(texts):
+        """Returns the list of timings (see millis_from_str) for the
+        iterable of strings texts. Raises a TypeError for the first
+        string that is not a time.
+        """
+        match = Time._re_time.match
+        result = []
+        append = result.append
+        for text in texts:
+            time_match = match(text)
+            if time_match is None:
+                # raises the TypeError
+                Time.millis_from_str(text)
+            sign, h, m, s, ms = time_match.groups()
+            millis = long(ms) + long(s)*1000 + long(m)*60000 + long(h)*3600000
+            append(- millis if sign == '-' else millis)
+        return result
+
     @staticmethod
     def millis_from_strs(h, m, s, ms):
         return long(ms) + long(s)*1000 + long(m)*60000 + long(h)*3600000
-